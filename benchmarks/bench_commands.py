@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+# pylint: disable=missing-docstring               # [C0111] docstrings are always outdated and wrong
+# pylint: disable=missing-module-docstring        # [C0114]
+# pylint: disable=invalid-name                    # [C0103] single letter var names, name too descriptive(!)
+# pylint: disable=too-many-arguments              # [R0913]
+# pylint: disable=too-many-locals                 # [R0914]
+
+# times zfstool subcommands against benchmarks/fakezfs.py standing in for zfs/zpool
+# each case runs in its own process so peak rss is per case
+# baseline.json holds the numbers of the machine it was saved on, before comparing on another
+# machine save its own: PYTHONPATH=. python3 benchmarks/bench_commands.py run --save-baseline
+from __future__ import annotations
+
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import click
+
+BENCHMARKS = Path(__file__).resolve().parent
+DEFAULT_BASELINE = BENCHMARKS / Path("baseline.json")
+
+# subcommand arguments, {work} is a scratch directory
+CASES = {
+    "zfs-check-mountpoints": [],
+    "create-zfs-pool": ["--simulate", "--raid", "mirror", "--raid-group-size", "2", "--pool-name", "bench", "/dev/sda", "/dev/sdb"],
+    "create-zfs-filesystem": ["tank", "bench", "--simulate"],
+    "create-zfs-filesystem-snapshot": ["--simulate", "tank/tenant0"],
+    "zfs-set-sharenfs": ["tank", "tenant0", "10.0.0.0/8", "--simulate"],
+    "zfs-filesystem-destroy": ["tank", "tenant0", "--recursive", "--simulate"],
+    "unlock": ["--simulate"],
+    "boot-cache": ["--root", "{work}"],
+    "send-plan": ["tank/tenant0", "--json"],
+    "watch": ["--count", "1", "--interval", "1"],
+    "find-slow-disks": ["tank", "--window", "1"],
+    "capacity-plan": ["tank", "--set", "tank/tenant0:quota=1G", "--simulate"],
+    "rebalance": ["tank/tenant0", "--jobs", "4"],
+    "archive send": ["tank/tenant0/vol0@__1700000000", "--store", "{work}/store"],
+    "archive restore": [
+        "{work}/store/streams/tank%2Ftenant0%2Fvol0@__1700000000.full.json",
+        "tank/restored",
+        "--store",
+        "{work}/store",
+    ],
+    "archive verify": ["--store", "{work}/store"],
+    "serve": [],  # time_serve(), the wall column is the time until the first answer
+}
+CASE_ENV = {
+    "rebalance": {"FAKEZFS_MOUNTPOINTS": "{work}"},
+}
+SERVE_QUERIES = 2000
+REBALANCE_FILE_SIZE = 16 << 10
+# need real block devices
+NOT_BENCHMARKED = [
+    "write-zfs-root-filesystem-on-devices",
+    "disk-bench",
+]
+
+
+def fake_bin(directory: Path) -> Path:
+    bin_dir = directory / Path("bin")
+    bin_dir.mkdir()
+    for program in ["zfs", "zpool", "modprobe"]:
+        path = bin_dir / Path(program)
+        path.write_text(
+            f'#!/bin/sh\nexec {sys.executable} {BENCHMARKS / Path("fakezfs.py")} {program} "$@"\n'
+        )
+        path.chmod(0o755)
+    return bin_dir
+
+
+def prepare(name: str, work: Path, count: int, env: dict[str, str]) -> None:
+    # untimed state a case needs
+    if name == "rebalance":  # one 16KiB file per 100 objects, 100 per directory
+        for index in range(max(count // 100, 10)):
+            directory = work / Path(f"tank/tenant0/d{index // 100}")
+            directory.mkdir(parents=True, exist_ok=True)
+            (directory / Path(f"f{index}")).write_bytes(os.urandom(REBALANCE_FILE_SIZE))
+    if name in ["archive restore", "archive verify"]:
+        subprocess.run(
+            [sys.executable, __file__, "case", "archive send", os.devnull, work.as_posix()],
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        Path(env["FAKEZFS_LOG"]).unlink(missing_ok=True)
+
+
+def time_serve() -> dict:
+    # start up until the socket answers, then round trips through daemon_request() like the subcommands
+    from zfstool.zfstool import daemon_request  # pylint: disable=import-outside-toplevel
+
+    start = time.perf_counter()
+    with subprocess.Popen(
+        [sys.executable, "-c", "from zfstool.zfstool import cli; cli()", "serve"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,  # serve and its zpool events -f are stopped together
+    ) as process:
+        try:
+            while daemon_request({"op": "stats"}) is None:
+                if process.poll() is not None:
+                    raise RuntimeError(f"serve exited {process.returncode}")
+                time.sleep(0.01)
+            ready = time.perf_counter() - start
+            query_start = time.perf_counter()
+            for _ in range(SERVE_QUERIES):
+                response = daemon_request({"op": "get", "name": "tank/tenant0", "property": "mountpoint"})
+                assert response is not None
+            query = (time.perf_counter() - query_start) / SERVE_QUERIES
+        finally:
+            os.killpg(process.pid, signal.SIGTERM)
+    # serve runs in a child, its cpu includes the zfs/zpool calls of its load
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "wall": ready,
+        "python_cpu": children.ru_utime + children.ru_stime,
+        "maxrss_kib": children.ru_maxrss,
+        "query_us": query * 1e6,
+    }
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("case", hidden=True)
+@click.argument("name")
+@click.argument("result_file", type=click.Path(path_type=Path))
+@click.argument("work", type=click.Path(path_type=Path))
+def run_case(name: str, result_file: Path, work: Path) -> None:
+    from zfstool.zfstool import cli as zfstool_cli  # pylint: disable=import-outside-toplevel
+
+    args = name.split() + [_.format(work=work) for _ in CASES[name]]
+    log = Path(os.environ["FAKEZFS_LOG"])
+    result: dict = {"error": None}
+    if name == "serve":
+        try:
+            result.update(time_serve())
+        except Exception as e:  # pylint: disable=broad-except
+            result.update({"wall": 0.0, "python_cpu": 0.0, "maxrss_kib": 0, "error": repr(e)})
+    else:
+        self_before = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        try:
+            zfstool_cli.main(args=args, standalone_mode=False)
+        except SystemExit as e:
+            if e.code:
+                result["error"] = f"exit {e.code}"
+        except Exception as e:  # pylint: disable=broad-except
+            result["error"] = repr(e)
+        result["wall"] = time.perf_counter() - start
+        self_after = resource.getrusage(resource.RUSAGE_SELF)
+        result["python_cpu"] = (self_after.ru_utime - self_before.ru_utime) + (
+            self_after.ru_stime - self_before.ru_stime
+        )
+        result["maxrss_kib"] = self_after.ru_maxrss
+    external = [float(_) for _ in log.read_text().split()] if log.exists() else []
+    result["external_wall"] = sum(external)
+    result["external_calls"] = len(external)
+    result_file.write_text(json.dumps(result))
+
+
+@cli.command("run")
+@click.option("--objects", "-n", type=int, multiple=True, default=[1_000, 100_000, 1_000_000])
+@click.option("--case", "cases", type=click.Choice(sorted(CASES)), multiple=True)
+@click.option("--snapshots", type=int, default=4, show_default=True, help="per dataset")
+@click.option("--devices", type=int, default=16, show_default=True)
+@click.option("--latency", type=float, default=0.0, show_default=True, help="seconds per zfs/zpool call")
+@click.option("--baseline", type=click.Path(dir_okay=False, path_type=Path), default=DEFAULT_BASELINE, show_default=True)
+@click.option("--save-baseline", is_flag=True)
+@click.option("--tolerance", type=float, default=0.25, show_default=True)
+def run(
+    objects: tuple[int, ...],
+    cases: tuple[str, ...],
+    snapshots: int,
+    devices: int,
+    latency: float,
+    baseline: Path,
+    save_baseline: bool,
+    tolerance: float,
+) -> None:
+    baselines = json.loads(baseline.read_text()) if baseline.exists() else {}
+    results = {}
+    regressions = 0
+    print(f"not benchmarked: {', '.join(NOT_BENCHMARKED)}", file=sys.stderr)
+    print(f"{'case':<32}{'objects':>9}{'wall':>9}{'python':>9}{'external':>10}{'calls':>7}{'rss MiB':>9}")
+    for count in objects:
+        for name in cases or sorted(CASES):
+            with tempfile.TemporaryDirectory() as _work:
+                work = Path(_work)
+                env = dict(os.environ)
+                env.update(
+                    {
+                        "PATH": fake_bin(work).as_posix() + os.pathsep + env["PATH"],
+                        "FAKEZFS_OBJECTS": str(count),
+                        "FAKEZFS_SNAPSHOTS": str(snapshots),
+                        "FAKEZFS_DEVICES": str(devices),
+                        "FAKEZFS_LATENCY": str(latency),
+                        "FAKEZFS_LOG": (work / Path("calls.log")).as_posix(),
+                        "ZFSTOOL_SOCKET": (work / Path("no.sock")).as_posix(),
+                    }
+                )
+                result_file = work / Path("result.json")
+                root = work / Path("root")
+                root.mkdir()
+                env.update({key: value.format(work=root) for key, value in CASE_ENV.get(name, {}).items()})
+                prepare(name, root, count, env)
+                subprocess.run(
+                    [sys.executable, __file__, "case", name, result_file.as_posix(), root.as_posix()],
+                    env=env,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    check=False,
+                )
+                result = json.loads(result_file.read_text())
+
+            key = f"{name}:{count}"
+            results[key] = result
+            line = (
+                f"{name:<32}{count:>9}{result['wall']:>9.3f}{result['python_cpu']:>9.3f}"
+                f"{result['external_wall']:>10.3f}{result['external_calls']:>7}{result['maxrss_kib'] / 1024:>9.1f}"
+            )
+            if "query_us" in result:
+                line += f"  {result['query_us']:.0f}us/query"
+            if result["error"]:
+                line += f"  {result['error']}"
+            previous = baselines.get(key)
+            if previous:
+                slower = result["python_cpu"] > previous["python_cpu"] * (1 + tolerance) + 0.05
+                bigger = result["maxrss_kib"] > previous["maxrss_kib"] * (1 + tolerance)
+                if slower or bigger:
+                    regressions += 1
+                    line += f"  REGRESSION (baseline python {previous['python_cpu']:.3f}s, rss {previous['maxrss_kib'] / 1024:.1f}MiB)"
+            print(line, flush=True)
+
+    if save_baseline:
+        baselines.update(results)
+        baseline.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+# pylint: disable=missing-docstring               # [C0111] docstrings are always outdated and wrong
+# pylint: disable=missing-module-docstring        # [C0114]
+# pylint: disable=invalid-name                    # [C0103] single letter var names, name too descriptive(!)
+from __future__ import annotations
+
+import time
+import tracemalloc
+from collections.abc import Iterator
+
+import click
+
+from zfstool.zfstool import DatasetTree
+
+
+def synthetic_zfs_get(entries: int, *, snapshots_per_dataset: int = 4) -> Iterator[str]:
+    # tank/tenantN/volM datasets, each with snapshots, a few local properties here and there
+    per_dataset = snapshots_per_dataset + 1
+    datasets = max(entries // per_dataset, 1)
+    tenants = max(int(datasets**0.5), 1)
+    yield "tank\tcompression\tzstd\tlocal\n"
+    yield "tank\tmountpoint\t/tank\tlocal\n"
+    for index in range(datasets):
+        tenant = f"tank/tenant{index % tenants}"
+        dataset = f"{tenant}/vol{index}"
+        if index < tenants:
+            yield f"{tenant}\tquota\t{1 << 40}\tlocal\n"
+            yield f"{tenant}\tcom.example:owner\tteam{index}\treceived\n"
+        if index % 10 == 0:
+            yield f"{dataset}\trecordsize\t1048576\tlocal\n"
+        yield f"{dataset}\tatime\toff\tlocal\n"
+        for snapshot in range(snapshots_per_dataset):
+            yield f"{dataset}@__{1700000000 + snapshot}\tcom.example:keep\t1\tlocal\n"
+
+
+@click.command()
+@click.option("--entries", "-n", type=int, multiple=True, default=[10_000, 100_000, 1_000_000])
+@click.option("--queries", type=int, default=100_000)
+def cli(entries: tuple[int, ...], queries: int) -> None:
+    for count in entries:
+        start = time.perf_counter()
+        tree = DatasetTree()
+        tree.load_zfs_get(synthetic_zfs_get(count))
+        load_seconds = time.perf_counter() - start
+
+        # a second, traced, load for memory, tracemalloc slows loading down a lot
+        del tree
+        tracemalloc.start()
+        tree = DatasetTree()
+        tree.load_zfs_get(synthetic_zfs_get(count))
+        memory, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        names = [tree.name(_) for _ in tree.iter_subtree("tank")]
+        step = max(len(names) // queries, 1)
+        sample = names[::step][:queries]
+        start = time.perf_counter()
+        for name in sample:
+            tree.get(name, "compression")
+            tree.get(name, "mountpoint")
+        get_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        subtree = sum(1 for _ in tree.iter_subtree("tank/tenant0"))
+        subtree_seconds = time.perf_counter() - start
+
+        print(
+            f"{len(tree):>9} entries"
+            f"  load {load_seconds:7.2f}s"
+            f"  {memory / len(tree):6.1f} B/entry (peak {peak / (1 << 20):.0f}MiB)"
+            f"  get {get_seconds / (2 * len(sample)) * 1e6:6.2f}us"
+            f"  subtree({subtree}) {subtree_seconds * 1e3:6.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+# pylint: disable=missing-docstring               # [C0111] docstrings are always outdated and wrong
+# pylint: disable=missing-module-docstring        # [C0114]
+# pylint: disable=invalid-name                    # [C0103] single letter var names, name too descriptive(!)
+# pylint: disable=too-many-return-statements      # [R0911]
+# pylint: disable=too-many-branches               # [R0912]
+
+# stand-in zfs/zpool/modprobe for benchmarks/bench_commands.py, invoked as: fakezfs.py zfs|zpool|modprobe args...
+# FAKEZFS_OBJECTS         datasets + snapshots in the simulated pool "tank"
+# FAKEZFS_SNAPSHOTS       snapshots per dataset
+# FAKEZFS_DEVICES         leaf devices, in raidz2 groups of 8 (a mirror below 8)
+# FAKEZFS_LATENCY         seconds every command sleeps before doing anything
+# FAKEZFS_LOG             every invocation appends its wall time here
+# FAKEZFS_MOUNTPOINTS     directory the mountpoints are under, / by default
+# FAKEZFS_SEND_BYTES      size of a zfs send stream, 256 bytes per object by default
+from __future__ import annotations
+
+import os
+import random
+import sys
+import time
+from collections.abc import Iterator
+
+POOL = "tank"
+OBJECTS = int(os.environ.get("FAKEZFS_OBJECTS", "1000"))
+SNAPSHOTS = int(os.environ.get("FAKEZFS_SNAPSHOTS", "4"))
+DEVICES = int(os.environ.get("FAKEZFS_DEVICES", "8"))
+LATENCY = float(os.environ.get("FAKEZFS_LATENCY", "0"))
+DATASETS = max(OBJECTS // (SNAPSHOTS + 1), 1)
+TENANTS = max(int(DATASETS**0.5), 1)
+DEVICE_SIZE = 4 << 40
+MOUNTPOINTS = os.environ.get("FAKEZFS_MOUNTPOINTS", "").rstrip("/")
+SEND_BYTES = int(os.environ.get("FAKEZFS_SEND_BYTES", str(OBJECTS * 256)))
+
+
+def objects() -> Iterator[tuple[str, str, int]]:
+    # (name, type, createtxg) in zfs list -r order
+    yield POOL, "filesystem", 1
+    txg = 2
+    for tenant in range(TENANTS):
+        tenant_name = f"{POOL}/tenant{tenant}"
+        yield tenant_name, "filesystem", txg
+        txg += 1
+        for index in range(tenant, DATASETS, TENANTS):
+            dataset = f"{tenant_name}/vol{index}"
+            yield dataset, "filesystem", txg
+            txg += 1
+            for snapshot in range(SNAPSHOTS):
+                yield f"{dataset}@__{1700000000 + snapshot}", "snapshot", txg
+                txg += 1
+
+
+def value(name: str, kind: str, txg: int, prop: str) -> str:
+    snapshot = kind == "snapshot"
+    if prop == "name":
+        return name
+    if prop == "type":
+        return kind
+    if prop == "createtxg":
+        return str(txg)
+    if prop == "creation":
+        return str(1700000000 + txg)
+    if prop in ["used", "referenced", "logicalused"]:
+        return str(1 << 20 if snapshot else 1 << 30)
+    if prop == "available":
+        return "-" if snapshot else str(1 << 40)
+    if prop == "mountpoint":
+        return "-" if snapshot else MOUNTPOINTS + "/" + name
+    if prop == "mounted":
+        return "-" if snapshot else "yes"
+    if prop == "canmount":
+        return "-" if snapshot else "on"
+    if prop in ["quota", "reservation", "refreservation", "refquota"]:
+        return "-" if snapshot else "0"
+    if prop in ["encryptionroot", "encroot", "keystatus", "clones", "origin"]:
+        return "-"
+    if prop == "keylocation":
+        return "none"
+    if prop == "compression":
+        return "zstd"
+    return "-"
+
+
+def write(lines: Iterator[str]) -> None:
+    out = sys.stdout
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= 4096:
+            out.write("".join(batch))
+            batch.clear()
+    out.write("".join(batch))
+
+
+def selected(args: list[str]) -> Iterator[tuple[str, str, int]]:
+    # the -r/-d/-t/target part of zfs list and zfs get, the first positional of zfs get is the property
+    types = {"filesystem", "volume"}
+    recursive = False
+    depth = None
+    targets = []
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg == "-t":
+            types = {"filesystem", "volume", "snapshot"} if args[index + 1] == "all" else set(args[index + 1].split(","))
+            index += 1
+        elif arg == "-d":
+            depth = int(args[index + 1])
+            recursive = True
+            index += 1
+        elif arg == "-r":
+            recursive = True
+        elif arg in ["-o", "-s"]:
+            index += 1
+        elif not arg.startswith("-"):
+            targets.append(arg)
+        index += 1
+    for name, kind, txg in objects():
+        if kind not in types:
+            continue
+        if targets:
+            match = False
+            for target in targets:
+                if name == target:
+                    match = True
+                elif recursive and (name.startswith(target + "/") or name.startswith(target + "@")):
+                    relative = name[len(target):]
+                    match = depth is None or relative.count("/") + relative.count("@") <= depth
+            if not match:
+                continue
+        yield name, kind, txg
+
+
+def option(args: list[str], flag: str, default: str) -> str:
+    if flag in args:
+        return args[args.index(flag) + 1]
+    return default
+
+
+def positional(args: list[str]) -> list[str]:
+    # drops flags and the values of -o/-s/-t/-d
+    result = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+            continue
+        if arg in ["-o", "-s", "-t", "-d"]:
+            skip = True
+            continue
+        if not arg.startswith("-"):
+            result.append(arg)
+    return result
+
+
+def zfs(args: list[str]) -> int:
+    command, args = args[0], args[1:]
+    if command == "list":
+        columns = option(args, "-o", "name,used,available,referenced,mountpoint").split(",")
+        write(
+            "\t".join(value(name, kind, txg, _) for _ in columns) + "\n"
+            for name, kind, txg in selected(args)
+        )
+        return 0
+    if command == "get":
+        columns = option(args, "-o", "name,property,value,source").split(",")
+        rest = positional(args)
+        props = rest[0].split(",")
+        if "all" in props:
+            props = ["mountpoint", "compression", "used", "available", "quota"]
+        if "-s" in args:  # only local values, a compression on the pool
+            props = ["compression"]
+        targets = rest[1:]
+        list_args = [_ for _ in args if _ != rest[0]]
+        if not targets:
+            list_args += ["-t", "all"]
+        rows = []
+        for name, kind, txg in selected(list_args):
+            if "-s" in args and name != POOL:
+                continue
+            for prop in props:
+                row = {"name": name, "property": prop, "value": value(name, kind, txg, prop), "source": "local" if name == POOL else "default"}
+                rows.append("\t".join(row[_] for _ in columns) + "\n")
+        write(iter(rows))
+        return 0
+    if command == "send":
+        if "-n" in args:
+            print("full\tx\t1073741824\nsize\t1073741824")
+        else:
+            send_stream()
+        return 0
+    if command == "recv":
+        while sys.stdin.buffer.read(1 << 20):
+            pass
+        return 0
+    if command in ["create", "destroy", "snapshot", "set", "mount", "unmount", "load-key"]:
+        return 0
+    print(f"fakezfs: zfs {command} not simulated", file=sys.stderr)
+    return 2
+
+
+def send_stream() -> None:
+    # every 1MiB random block is sent twice, so the chunk store has something to dedup
+    out = sys.stdout.buffer
+    remaining = SEND_BYTES
+    index = 0
+    while remaining > 0:
+        block = random.Random(index // 2).randbytes(min(1 << 20, remaining))
+        out.write(block)
+        remaining -= len(block)
+        index += 1
+    out.flush()
+
+
+def leaves() -> Iterator[tuple[str, list[str]]]:
+    group = 8 if DEVICES >= 8 else DEVICES
+    kind = "raidz2" if group == 8 else "mirror"
+    for vdev in range(DEVICES // group):
+        yield f"{kind}-{vdev}", [f"sd{vdev}{_}" for _ in range(group)]
+
+
+def zpool(args: list[str]) -> int:
+    command, args = args[0], args[1:]
+    if command == "list":
+        if "-v" in args:  # like zpool, -H puts a single tab before every vdev
+            indent = ["", "\t", "\t"] if "-H" in args else ["", "  ", "    "]
+            sep = "\t" if "-H" in args else "  "
+            if "-H" not in args:
+                print("NAME  SIZE  ALLOC  FREE  CKPOINT  EXPANDSZ  FRAG  CAP  DEDUP  HEALTH  ALTROOT")
+            print(indent[0] + sep.join([POOL, str(DEVICE_SIZE * DEVICES), str(DEVICE_SIZE), str(DEVICE_SIZE * (DEVICES - 1)), "-", "-", "1", "10", "1.00", "ONLINE", "-"]))
+            for vdev, disks in leaves():
+                print(indent[1] + sep.join([vdev, str(DEVICE_SIZE * len(disks)), str(DEVICE_SIZE // 2), str(DEVICE_SIZE), "-", "-", "1", "10", "-", "ONLINE"]))
+                for disk in disks:
+                    print(indent[2] + sep.join([disk, "-", "-", "-", "-", "-", "-", "-", "-", "ONLINE"]))
+        elif "-H" in args:
+            pool = {
+                "name": POOL,
+                "size": DEVICE_SIZE * DEVICES,
+                "allocated": DEVICE_SIZE,
+                "free": DEVICE_SIZE * (DEVICES - 1),
+                "fragmentation": 1,
+                "capacity": 6,
+            }
+            print("\t".join(str(pool[_]) for _ in option(args, "-o", "name").split(",")))
+        else:
+            print("NAME    SIZE  ALLOC   FREE  CKPOINT  EXPANDSZ   FRAG    CAP  DEDUP    HEALTH  ALTROOT")
+            print(f"{POOL}  32T  4T  28T  -  -  1%  10%  1.00x  ONLINE  -")
+        return 0
+    if command == "get":
+        rest = positional(args)
+        columns = option(args, "-o", "name,property,value,source").split(",")
+        props = {"altroot": "-", "cachefile": "-", "size": str(DEVICE_SIZE * DEVICES), "health": "ONLINE"}
+        if rest[0] != "all":
+            props = {rest[0]: props.get(rest[0], "-")}
+        for prop, prop_value in props.items():
+            row = {"name": POOL, "property": prop, "value": prop_value, "source": "default"}
+            print("\t".join(row[_] for _ in columns))
+        return 0
+    if command == "set":
+        prop, _, prop_value = args[0].partition("=")
+        if prop == "cachefile" and prop_value:
+            with open(prop_value, "wb") as fh:
+                fh.write(b"fake zpool.cache\n")
+        return 0
+    if command == "status":
+        if "-j" in args:
+            return 2
+        print(f"  pool: {POOL}\n state: ONLINE\n  scan: scrub repaired 0B in 00:01:00 with 0 errors on Sun Oct 19 00:00:00 2026\nconfig:\n")
+        print("\tNAME        STATE     READ WRITE CKSUM")
+        print(f"\t{POOL}        ONLINE       0     0     0")
+        for vdev, disks in leaves():
+            print(f"\t  {vdev}  ONLINE       0     0     0")
+            for disk in disks:
+                print(f"\t    {disk}     ONLINE       0     0     0")
+        print("\nerrors: No known data errors")
+        return 0
+    if command == "iostat":
+        names = [POOL] + [_ for vdev, disks in leaves() for _ in [vdev] + disks]
+        if "-w" in args:
+            for name in names:
+                print(name)
+                for bucket in range(1, 37):
+                    print("\t".join([str((1 << bucket) - 1)] + ["100" if 16 <= bucket <= 22 else "0"] * 11))
+        else:
+            for name in names:
+                print("\t".join([name] + ["1000"] * 17))
+        return 0
+    if command == "events":
+        if "-f" in args:  # follows until zfstool serve is stopped
+            while True:
+                time.sleep(3600)
+        return 0
+    print(f"fakezfs: zpool {command} not simulated", file=sys.stderr)
+    return 2
+
+
+def main() -> int:
+    start = time.monotonic()
+    program, args = os.path.basename(sys.argv[1]), sys.argv[2:]
+    if LATENCY:
+        time.sleep(LATENCY)
+    if program == "zfs":
+        status = zfs(args)
+    elif program == "zpool":
+        status = zpool(args)
+    else:  # modprobe
+        status = 0
+    sys.stdout.flush()
+    log = os.environ.get("FAKEZFS_LOG")
+    if log:
+        with open(log, "a", encoding="utf8") as fh:
+            fh.write(f"{time.monotonic() - start}\n")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
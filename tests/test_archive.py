@@ -0,0 +1,126 @@
+import json
+import random
+import threading
+import zlib
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+from zfstool.zfstool import ChunkStore
+from zfstool.zfstool import ContentDefinedChunker
+from zfstool.zfstool import cli
+from zfstool.zfstool import write_file_atomic
+
+
+def chunker() -> ContentDefinedChunker:
+    # ~128 byte chunks so a small input has plenty of boundaries
+    return ContentDefinedChunker(run_length=6, min_size=32, max_size=1024, seed=0x5A17)
+
+
+def data(size: int) -> bytes:
+    return random.Random(size).randbytes(size)
+
+
+def blocks(payload: bytes, block_size: int) -> list[bytes]:
+    return [payload[_ : _ + block_size] for _ in range(0, len(payload), block_size)]
+
+
+def test_chunks_join_to_the_input():
+    payload = data(200_000)
+    chunks = list(chunker().chunks(blocks(payload, 4096)))
+    assert b"".join(chunks) == payload
+    assert len(chunks) > 100
+    assert all(len(_) <= 1024 for _ in chunks)
+    assert all(len(_) >= 32 for _ in chunks[:-1])
+
+
+@pytest.mark.parametrize("block_size", [7, 100, 1023, 65536, 200_000])
+def test_boundaries_do_not_depend_on_block_size(block_size):
+    payload = data(200_000)
+    expected = list(chunker().chunks([payload]))
+    assert list(chunker().chunks(blocks(payload, block_size))) == expected
+
+
+def test_boundaries_resync_after_an_insert():
+    payload = data(200_000)
+    before = set(chunker().chunks([payload]))
+    after = set(chunker().chunks([payload[:1000] + b"inserted" + payload[1000:]]))
+    assert len(before & after) > len(before) * 0.9
+
+
+def test_put_and_get(tmp_path):
+    store = ChunkStore(tmp_path, create=True)
+    digest, written = store.put(b"chunk")
+    assert written > 0
+    assert store.put(b"chunk") == (digest, 0)
+    assert store.get(digest) == b"chunk"
+    assert list(store.chunk_digests()) == [digest]
+
+
+def test_concurrent_duplicate_put_is_written_once(tmp_path, monkeypatch):
+    store = ChunkStore(tmp_path, create=True)
+    # every writer gets past the exists() check before any of them links the chunk
+    monkeypatch.setattr(Path, "exists", lambda self: False)
+    barrier = threading.Barrier(8)
+    results = []
+
+    def _put():
+        barrier.wait()
+        results.append(store.put(b"same chunk" * 1000))
+
+    threads = [threading.Thread(target=_put) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({digest for digest, _ in results}) == 1
+    assert len([written for _, written in results if written]) == 1
+    monkeypatch.undo()
+    assert [_.name for _ in store.chunk_path(results[0][0]).parent.iterdir()] == [results[0][0]]
+
+
+def archive_with_two_chunks(tmp_path) -> tuple[ChunkStore, list[str]]:
+    store = ChunkStore(tmp_path / Path("store"), create=True)
+    digests = [store.put(data(5000))[0], store.put(data(6000))[0]]
+    write_file_atomic(
+        store.manifest_path("tank/a@daily", None),
+        json.dumps(
+            {"snapshot": "tank/a@daily", "from": None, "raw": False, "size": 11000, "created": 0, "chunks": digests}
+        ).encode(),
+    )
+    return store, digests
+
+
+def verify(store: ChunkStore):
+    return CliRunner().invoke(cli, ["archive", "verify", "--store", store.path.as_posix(), "--jobs", "2"])
+
+
+def test_verify_clean_store(tmp_path):
+    store, _ = archive_with_two_chunks(tmp_path)
+    result = verify(store)
+    assert result.exit_code == 0, result.output
+
+
+def test_verify_flags_a_truncated_chunk(tmp_path):
+    store, digests = archive_with_two_chunks(tmp_path)
+    path = store.chunk_path(digests[0])
+    path.write_bytes(path.read_bytes()[:100])
+    result = verify(store)
+    assert result.exit_code == 1
+    assert digests[0] in result.output
+
+
+def test_verify_flags_a_corrupted_chunk(tmp_path):
+    store, digests = archive_with_two_chunks(tmp_path)
+    store.chunk_path(digests[1]).write_bytes(zlib.compress(data(6001)))
+    result = verify(store)
+    assert result.exit_code == 1
+    assert digests[1] in result.output
+
+
+def test_verify_flags_a_missing_chunk(tmp_path):
+    store, digests = archive_with_two_chunks(tmp_path)
+    store.chunk_path(digests[0]).unlink()
+    result = verify(store)
+    assert result.exit_code == 1
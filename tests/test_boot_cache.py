@@ -0,0 +1,77 @@
+import os
+import stat
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from zfstool.zfstool import cli
+from zfstool.zfstool import zpool_cache_summary
+from zfstool.zfstool import zpool_live_summary
+
+FIXTURES = Path(__file__).parent / Path("fixtures")
+
+ZPOOL = f"""#!/bin/sh
+case "$*" in
+"get -H -o name,value cachefile") printf 'tank\\t-\\n';;
+"get -H -o name,value altroot tank") printf 'tank\\t-\\n';;
+"list -H -p -o name,guid tank") printf 'tank\\t4829103382012843371\\n';;
+"list -v -p -P tank") cat {FIXTURES}/zpool_list_v_paths.txt;;
+"list -v -p -g tank") cat {FIXTURES}/zpool_list_v_guids.txt;;
+*) echo "unexpected zpool $*" >&2; exit 2;;
+esac
+"""
+
+ZDB = f"""#!/bin/sh
+cat {FIXTURES}/zdb_C_tank.txt
+"""
+
+ZFS = """#!/bin/sh
+printf 'tank\\t/tank\\ton\\n'
+"""
+
+
+def fake_commands(tmp_path, monkeypatch):
+    bin_path = tmp_path / Path("bin")
+    bin_path.mkdir()
+    for name, script in [("zpool", ZPOOL), ("zdb", ZDB), ("zfs", ZFS)]:
+        path = bin_path / Path(name)
+        path.write_text(script)
+        path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv("PATH", bin_path.as_posix() + os.pathsep + os.environ["PATH"])
+
+
+def boot_cache_check(tmp_path):
+    etc_zfs = tmp_path / Path("root/etc/zfs")
+    (etc_zfs / Path("zfs-list.cache")).mkdir(parents=True)
+    (etc_zfs / Path("zpool.cache")).write_bytes(b"\0")
+    (etc_zfs / Path("zfs-list.cache/tank")).write_text("tank\t/tank\ton\n")
+    return CliRunner().invoke(cli, ["boot-cache", "--check", "--root", (tmp_path / Path("root")).as_posix()])
+
+
+def test_live_summary_skips_class_rows(tmp_path, monkeypatch):
+    fake_commands(tmp_path, monkeypatch)
+    summary = zpool_live_summary(["tank"])
+    assert list(summary) == ["tank"]
+    leaves = dict(summary["tank"]["leaves"])
+    assert leaves["8721039122834729121"] == "/dev/nvme0n1p1"  # log
+    assert "5512983021774832019" not in leaves  # cache
+    assert "14409218371238127731" not in leaves  # spare
+    assert len(leaves) == 6
+
+
+def test_check_current_with_log_and_cache(tmp_path, monkeypatch):
+    fake_commands(tmp_path, monkeypatch)
+    assert zpool_cache_summary(tmp_path) == zpool_live_summary(["tank"])
+    result = boot_cache_check(tmp_path)
+    assert result.exit_code == 0, result.output
+    assert "stale" not in result.output
+
+
+def test_check_stale_after_a_device_moves(tmp_path, monkeypatch):
+    fake_commands(tmp_path, monkeypatch)
+    moved = (FIXTURES / Path("zdb_C_tank.txt")).read_text().replace("/dev/nvme1n1p1", "/dev/nvme2n1p1")
+    (tmp_path / Path("zdb.txt")).write_text(moved)
+    (tmp_path / Path("bin/zdb")).write_text(f"#!/bin/sh\ncat {tmp_path}/zdb.txt\n")
+    result = boot_cache_check(tmp_path)
+    assert result.exit_code == 1
+    assert "stale" in result.output
@@ -0,0 +1,90 @@
+import pytest
+
+from zfstool.zfstool import CAPACITY_PROPERTIES
+from zfstool.zfstool import CAPACITY_USAGE_PROPERTIES
+from zfstool.zfstool import capacity_fill_limit
+from zfstool.zfstool import capacity_plan_refused
+from zfstool.zfstool import capacity_projection
+from zfstool.zfstool import parse_capacity_plan
+from zfstool.zfstool import parse_size
+
+G = 1 << 30
+
+
+def dataset(**values: int) -> dict[str, int]:
+    row = {_: 0 for _ in CAPACITY_USAGE_PROPERTIES + CAPACITY_PROPERTIES}
+    row.update({key: value * G for key, value in values.items()})
+    return row
+
+
+def datasets(available: int = 500) -> dict[str, dict[str, int]]:
+    # tank/parent reserves 100G and holds a 10G child, so tank is charged 100G for it
+    return {
+        "tank": dataset(used=500, available=available, referenced=1, usedbydataset=1, usedbychildren=499),
+        "tank/parent": dataset(used=10, usedbychildren=10, reservation=100),
+        "tank/parent/child": dataset(used=10, referenced=10, usedbydataset=10),
+        "tank/other": dataset(used=399, referenced=399, usedbydataset=399),
+    }
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [
+        ("512", 512),
+        ("10G", 10 << 30),
+        ("10g", 10 << 30),
+        ("100m", 100 << 20),
+        ("1.5Ti", 3 << 39),
+        ("2KiB", 2048),
+        ("none", None),
+        ("-", None),
+    ],
+)
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
+
+
+def test_parse_size_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_size("10x")
+
+
+def test_child_reservation_inside_parent_reservation_adds_nothing():
+    projection = capacity_projection("tank", datasets(), {"tank/parent/child": {"reservation": 50 * G}})
+    assert projection["projected_used"] == projection["used"] == 500 * G
+
+
+def test_child_reservation_past_parent_reservation_adds_the_difference():
+    projection = capacity_projection("tank", datasets(), {"tank/parent/child": {"reservation": 150 * G}})
+    assert projection["projected_used"] == 550 * G
+
+
+def test_reservation_on_a_new_dataset():
+    projection = capacity_projection("tank", datasets(), {"tank/other/new": {"reservation": 20 * G}})
+    assert projection["projected_used"] == 520 * G
+    assert projection["projected_fill"] == 0.52
+
+
+def test_shrink_on_a_pool_over_the_threshold_is_accepted():
+    state = datasets(available=50)
+    limit = capacity_fill_limit(1, fill_threshold=0.8, fragmentation_margin=0.1)
+    shrink = capacity_projection("tank", state, {"tank/parent": {"reservation": 20 * G}})
+    assert shrink["fill"] > limit
+    assert shrink["projected_used"] == 420 * G
+    assert not capacity_plan_refused(shrink, limit)
+    grow = capacity_projection("tank", state, {"tank/other/new": {"reservation": 1 * G}})
+    assert capacity_plan_refused(grow, limit)
+
+
+def test_parse_capacity_plan():
+    changes = parse_capacity_plan(["# nightly", "tank/a quota=100g reservation=none", ""])
+    assert changes == {"tank/a": {"quota": 100 * G, "reservation": 0}}
+
+
+@pytest.mark.parametrize(
+    "line",
+    ["tank/a refreservation=auto", "tank/a quota=10x", "tank/a reservation=lots"],
+)
+def test_parse_capacity_plan_rejects(line):
+    with pytest.raises(ValueError):
+        parse_capacity_plan([line])
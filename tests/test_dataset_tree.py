@@ -0,0 +1,72 @@
+import pytest
+
+from zfstool.zfstool import DatasetTree
+
+
+def tree(*rows: str) -> DatasetTree:
+    # zfs get -H -p -o name,property,value,source -s local,received rows
+    dataset_tree = DatasetTree()
+    dataset_tree.load_zfs_get(rows)
+    dataset_tree.load_names(["tank", "tank/a", "tank/a/b", "tank/a/b@daily", "tank/c"])
+    return dataset_tree
+
+
+@pytest.mark.parametrize(
+    "rows",
+    [
+        ["tank/a\tcompression\tlz4\treceived", "tank/a\tcompression\tzstd\tlocal"],
+        ["tank/a\tcompression\tzstd\tlocal", "tank/a\tcompression\tlz4\treceived"],
+    ],
+)
+def test_local_overrides_received_in_either_order(rows):
+    dataset_tree = tree(*rows)
+    assert dataset_tree.get("tank/a", "compression") == ("zstd", "local")
+    assert dataset_tree.get("tank/a/b", "compression") == ("zstd", "inherited from tank/a")
+
+
+def test_received_value():
+    dataset_tree = tree("tank/a\tcompression\tlz4\treceived")
+    assert dataset_tree.get("tank/a", "compression") == ("lz4", "received")
+    assert dataset_tree.get("tank/a/b@daily", "compression") == ("lz4", "inherited from tank/a")
+
+
+@pytest.mark.parametrize(
+    "root, expected",
+    [("/srv", "/srv/a/b"), ("/srv/", "/srv/a/b"), ("/", "/a/b")],
+)
+def test_inherited_mountpoint_appends_the_relative_path(root, expected):
+    dataset_tree = tree(f"tank\tmountpoint\t{root}\tlocal")
+    assert dataset_tree.get("tank/a/b", "mountpoint") == (expected, "inherited from tank")
+    assert dataset_tree.get("tank", "mountpoint") == (root, "local")
+
+
+@pytest.mark.parametrize("value", ["none", "legacy"])
+def test_inherited_mountpoint_keyword(value):
+    dataset_tree = tree(f"tank/a\tmountpoint\t{value}\tlocal")
+    assert dataset_tree.get("tank/a/b", "mountpoint") == (value, "inherited from tank/a")
+
+
+def test_default_mountpoint():
+    dataset_tree = tree()
+    assert dataset_tree.get("tank/a/b", "mountpoint") == ("/tank/a/b", "default")
+    assert dataset_tree.get("tank/c", "compression") == (None, "default")
+
+
+@pytest.mark.parametrize(
+    "prop", ["quota", "reservation", "canmount", "filesystem_limit", "snapshot_limit"]
+)
+def test_non_inheritable(prop):
+    dataset_tree = tree(f"tank/a\t{prop}\t1024\tlocal")
+    assert dataset_tree.get("tank/a", prop) == ("1024", "local")
+    assert dataset_tree.get("tank/a/b", prop) == (None, "default")
+    assert dataset_tree.get("tank/a/b@daily", prop) == (None, "-")
+
+
+def test_snapshot_mountpoint():
+    dataset_tree = tree("tank\tmountpoint\t/srv\tlocal")
+    assert dataset_tree.get("tank/a/b@daily", "mountpoint") == (None, "-")
+
+
+def test_unknown_dataset():
+    with pytest.raises(KeyError):
+        tree().get("tank/missing", "compression")
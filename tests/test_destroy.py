@@ -0,0 +1,37 @@
+import pytest
+from click.testing import CliRunner
+
+import zfstool.zfstool
+from zfstool.zfstool import cli
+
+ENTRIES = [
+    {"name": "tank/scratch", "type": "filesystem", "used": "3000", "createtxg": "10", "clones": "", "mountpoint": "/tank/scratch", "mounted": "yes"},
+    {"name": "tank/scratch/build", "type": "filesystem", "used": "2000", "createtxg": "11", "clones": "", "mountpoint": "/tank/scratch/build", "mounted": "yes"},
+    {"name": "tank/scratch/build@a", "type": "snapshot", "used": "100", "createtxg": "12", "clones": "-", "mountpoint": "-", "mounted": "-"},
+]
+
+
+@pytest.fixture
+def busy_build(monkeypatch):
+    monkeypatch.setattr(zfstool.zfstool, "zfs_list", lambda properties, *args: ENTRIES)
+    monkeypatch.setattr(
+        zfstool.zfstool,
+        "processes_using_mountpoints",
+        lambda mountpoints: {_: {4242} for _ in mountpoints if _.endswith("/build")},
+    )
+
+
+@pytest.mark.parametrize("recursive", [[], ["--recursive"]])
+def test_simulate_prints_the_plan_with_busy_mountpoints(busy_build, recursive):
+    result = CliRunner().invoke(cli, ["zfs-filesystem-destroy", "tank", "scratch", "--simulate", *recursive])
+    assert result.exit_code == 0, result.output
+    assert "tank/scratch/build is busy at /tank/scratch/build, pids: [4242]" in result.output
+    assert "a real run would refuse" in result.output
+    assert "tank/scratch/build@a" in result.output or not recursive
+
+
+def test_real_run_refuses_busy_mountpoints(busy_build, monkeypatch):
+    monkeypatch.setattr(zfstool.zfstool.sh, "zfs", None, raising=False)  # nothing may be unmounted or destroyed
+    result = CliRunner().invoke(cli, ["zfs-filesystem-destroy", "tank", "scratch", "--recursive"])
+    assert result.exit_code == 1
+    assert "is busy at /tank/scratch/build" in result.output
@@ -0,0 +1,53 @@
+import threading
+import time
+from pathlib import Path
+
+import zfstool.zfstool
+from zfstool.zfstool import benchmark_block_devices
+from zfstool.zfstool import block_device_controller
+
+
+def test_virtual_devices_are_their_own_controller():
+    assert block_device_controller(Path("/dev/loop7")) == "virtual:loop7"
+    assert block_device_controller(Path("/dev/loop7")) != block_device_controller(Path("/dev/loop8"))
+
+
+def fake_probes(monkeypatch, controllers: dict[str, str]) -> dict:
+    state = {"running": 0, "peak": 0, "starts": {}}
+    lock = threading.Lock()
+
+    def _probe(device: Path, *, seconds: float) -> dict:
+        with lock:
+            state["starts"][device.name] = time.monotonic()
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(seconds)
+        with lock:
+            state["running"] -= 1
+        return {"device": device.as_posix()}
+
+    monkeypatch.setattr(zfstool.zfstool, "probe_block_device", _probe)
+    monkeypatch.setattr(zfstool.zfstool, "block_device_controller", lambda _: controllers[_.name])
+    return state
+
+
+def test_all_devices_run_at_once_by_default(monkeypatch):
+    controllers = {"sda": "0000:01:00.0", "sdb": "0000:01:00.0", "sdc": "0000:01:00.0", "sdd": "0000:02:00.0"}
+    state = fake_probes(monkeypatch, controllers)
+    devices = [Path("/dev") / Path(_) for _ in controllers]
+    results = benchmark_block_devices(devices, seconds=0.3, stagger=0.05)
+    assert sorted(_["device"] for _ in results) == sorted(_.as_posix() for _ in devices)
+    assert state["peak"] == 4
+    starts = state["starts"]
+    # staggered behind one controller, the other controller starts right away
+    assert starts["sdb"] - starts["sda"] >= 0.04
+    assert starts["sdc"] - starts["sdb"] >= 0.04
+    assert abs(starts["sdd"] - starts["sda"]) < 0.04
+
+
+def test_per_controller_caps_devices_behind_one_controller(monkeypatch):
+    controllers = {"sda": "0000:01:00.0", "sdb": "0000:01:00.0", "sdc": "0000:01:00.0"}
+    state = fake_probes(monkeypatch, controllers)
+    devices = [Path("/dev") / Path(_) for _ in controllers]
+    benchmark_block_devices(devices, seconds=0.1, per_controller=1, stagger=0)
+    assert state["peak"] == 1
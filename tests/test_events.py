@@ -0,0 +1,47 @@
+from zfstool.zfstool import parse_zpool_events
+from zfstool.zfstool import zpool_event_datasets
+
+RENAME_EVENTS = """\
+Oct 19 2026 10:12:01.331872911\tsysevent.fs.zfs.history_event
+        version = 0x0
+        class = "sysevent.fs.zfs.history_event"
+        pool = "tank"
+        pool_guid = 0x4305b3b5b8e0f16b
+        history_dsname = "tank/home/alice"
+        history_internal_str = "-> tank/users/alice"
+        history_internal_name = "rename"
+        history_dsid = 0x10a
+
+Oct 19 2026 10:12:07.104822510\tsysevent.fs.zfs.history_event
+        version = 0x0
+        class = "sysevent.fs.zfs.history_event"
+        pool = "tank"
+        pool_guid = 0x4305b3b5b8e0f16b
+        history_dsname = "tank/users/alice@daily"
+        history_internal_str = "-> @weekly"
+        history_internal_name = "rename"
+        history_dsid = 0x1b3
+
+Oct 19 2026 10:12:09.773012114\tsysevent.fs.zfs.history_event
+        version = 0x0
+        class = "sysevent.fs.zfs.history_event"
+        pool = "tank"
+        pool_guid = 0x4305b3b5b8e0f16b
+        history_dsname = "tank/users/alice/%recv"
+        history_internal_str = "compression=3"
+        history_internal_name = "set"
+        history_dsid = 0x1c0
+"""
+
+
+def test_rename_queues_old_and_new_names():
+    events = list(parse_zpool_events(RENAME_EVENTS.splitlines()))
+    assert [zpool_event_datasets(_) for _ in events] == [
+        ["tank/home/alice", "tank/users/alice"],
+        ["tank/users/alice@daily", "tank/users/alice@weekly"],
+        ["tank/users/alice"],
+    ]
+
+
+def test_event_without_dataset():
+    assert zpool_event_datasets({"class": "sysevent.fs.zfs.pool_import", "pool": "tank"}) == []
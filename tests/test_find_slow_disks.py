@@ -0,0 +1,59 @@
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from zfstool.zfstool import cli
+from zfstool.zfstool import histogram_percentile
+from zfstool.zfstool import merge_histograms
+from zfstool.zfstool import parse_zpool_iostat_histograms
+
+FIXTURES = Path(__file__).parent / Path("fixtures")
+
+
+def samples() -> list[dict]:
+    text = (FIXTURES / Path("zpool_iostat_histograms.txt")).read_text()
+    return parse_zpool_iostat_histograms(text, "tank")
+
+
+def test_parse_histograms_per_sample():
+    parsed = samples()
+    assert len(parsed) == 2
+    for sample in parsed:
+        assert list(sample) == ["tank", "raidz2-0", "sda", "sdb", "sdc", "sdd"]
+        # the pool row sums the leaves, empty buckets are left out
+        for column in ["disk_wait_read", "total_wait_write"]:
+            leaves = merge_histograms(sample[_][column] for _ in ["sda", "sdb", "sdc", "sdd"])
+            assert sample["tank"][column] == leaves
+        assert 0 not in sample["sda"]["disk_wait_read"].values()
+        assert sample["sda"]["scrub_wait"] == {}
+    assert sum(parsed[0]["sda"]["disk_wait_read"].values()) == 300
+    assert sum(parsed[0]["sdd"]["disk_wait_read"].values()) == 360
+
+
+def test_histogram_percentile():
+    histogram = {1023: 50, 2047: 40, 4095: 9, 8191: 1}
+    assert histogram_percentile(histogram, 50) == 1023
+    assert histogram_percentile(histogram, 51) == 2047
+    assert histogram_percentile(histogram, 99) == 4095
+    assert histogram_percentile(histogram, 100) == 8191
+    assert histogram_percentile({}, 99) is None
+
+
+def test_find_slow_disks_ranks_the_outlier_first():
+    result = CliRunner().invoke(
+        cli,
+        [
+            "find-slow-disks",
+            "tank",
+            "--status-file",
+            (FIXTURES / Path("zpool_status_scrub.txt")).as_posix(),
+            "--iostat-file",
+            (FIXTURES / Path("zpool_iostat_histograms.txt")).as_posix(),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    # one record per leaf, highest score first
+    records = [_ for _ in result.output.splitlines() if _.strip()]
+    assert len(records) == 4
+    assert "sdd" in records[0]
+    assert "raidz2-0" in records[0]
@@ -0,0 +1,180 @@
+import json
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+from zfstool.zfstool import RateHistory
+from zfstool.zfstool import cli
+from zfstool.zfstool import parse_zpool_iostat
+from zfstool.zfstool import parse_zpool_status
+from zfstool.zfstool import parse_zpool_status_any
+from zfstool.zfstool import vdev_tree
+from zfstool.zfstool import zpool_status_json_to_pools
+
+FIXTURES = Path(__file__).parent / Path("fixtures")
+
+
+def status_text(name: str) -> dict[str, dict]:
+    return parse_zpool_status((FIXTURES / Path(f"zpool_status_{name}.txt")).read_text())
+
+
+def status_json(name: str) -> dict[str, dict]:
+    return zpool_status_json_to_pools(
+        json.loads((FIXTURES / Path(f"zpool_status_{name}.json")).read_text())
+    )
+
+
+def config(pool: dict) -> list[tuple]:
+    return [(_["depth"], _["name"], _["state"]) for _ in pool["config"]]
+
+
+@pytest.mark.parametrize("parse", [status_text, status_json])
+def test_scrub_in_progress(parse):
+    pool = parse("scrub")["tank"]
+    scan = pool["scan"]
+    assert pool["state"] == "ONLINE"
+    assert scan["function"] == "scrub"
+    assert scan["state"] == "in progress"
+    assert scan["issued"] == pytest.approx(702 << 30, rel=0.01)
+    assert scan["total"] == pytest.approx(3.61 * (1 << 40), rel=0.01)
+    assert scan["percent"] == pytest.approx(18.99, abs=0.01)
+    assert config(pool)[:3] == [
+        (0, "tank", "ONLINE"),
+        (1, "raidz2-0", "ONLINE"),
+        (2, "sda", "ONLINE"),
+    ]
+
+
+def test_scrub_in_progress_text_eta():
+    assert status_text("scrub")["tank"]["scan"]["eta_seconds"] == 1 * 3600 + 44 * 60 + 33
+
+
+@pytest.mark.parametrize("parse", [status_text, status_json])
+def test_resilver_replacing(parse):
+    pool = parse("resilver")["tank"]
+    scan = pool["scan"]
+    assert pool["state"] == "DEGRADED"
+    assert scan["function"] == "resilver"
+    assert scan["state"] == "in progress"
+    assert scan["processed"] == pytest.approx(75.1 * (1 << 30), rel=0.01)
+    assert config(pool) == [
+        (0, "tank", "DEGRADED"),
+        (1, "raidz2-0", "DEGRADED"),
+        (2, "sda", "ONLINE"),
+        (2, "sdb", "ONLINE"),
+        (2, "replacing-2", "DEGRADED"),
+        (3, "sdc", "FAULTED"),
+        (3, "sdg", "ONLINE"),
+        (2, "sdd", "ONLINE"),
+    ]
+    vdevs = {_["name"]: _ for _ in pool["config"]}
+    assert vdevs["sdc"]["write"] == 33
+    assert vdevs["sdg"]["note"] == "resilvering"
+    tree = vdev_tree(pool["config"])
+    assert tree["sdg"]["parent"] == "replacing-2"
+    assert tree["raidz2-0"]["children"] == ["sda", "sdb", "replacing-2", "sdd"]
+
+
+@pytest.mark.parametrize("parse", [status_text, status_json])
+def test_trim(parse):
+    pool = parse("trim")["fast"]
+    assert pool["scan"] == {"function": None, "state": None}
+    trim = {_["name"]: _.get("trim_percent") for _ in pool["config"]}
+    assert trim == {"fast": None, "mirror-0": None, "nvme2n1": 37, "nvme3n1": 41}
+
+
+@pytest.mark.parametrize("parse", [status_text, status_json])
+def test_finished(parse):
+    pools = parse("finished")
+    assert sorted(pools) == ["rpool", "tank"]
+    assert pools["rpool"]["scan"]["function"] == "scrub"
+    assert pools["rpool"]["scan"]["state"] == "finished"
+    assert pools["tank"]["scan"]["function"] == "resilver"
+    assert pools["tank"]["scan"]["state"] == "finished"
+    assert [_.get("trim_percent") for _ in pools["rpool"]["config"]] == [None, None, 100, 100]
+
+
+def test_parse_zpool_status_any_detects_json():
+    text = (FIXTURES / Path("zpool_status_resilver.json")).read_text()
+    assert parse_zpool_status_any(text) == status_json("resilver")
+
+
+def test_parse_zpool_iostat():
+    text = (FIXTURES / Path("zpool_iostat_resilver.txt")).read_text()
+    samples = parse_zpool_iostat(text + text, ["tank"])
+    assert len(samples["tank"]) == 2
+    rows = {_["name"]: _ for _ in samples["tank"][-1]}
+    assert list(rows) == ["tank", "raidz2-0", "sda", "sdb", "replacing-2", "sdc", "sdg", "sdd"]
+    assert rows["tank"]["alloc"] == 2415919104000
+    assert rows["sda"]["alloc"] is None
+    assert rows["sda"]["read_bytes"] == 115343360
+    assert rows["sdd"]["disk_wait_read"] == 95120221
+    assert rows["sdc"]["disk_wait_read"] is None
+
+
+def test_rate_history_eta():
+    history = RateHistory(window=10, alpha=0.5)
+    assert history.add(0, 1000) is None
+    assert history.eta(1000) is None
+    assert history.add(10, 2000) == 100
+    assert history.add(20, 2400) == pytest.approx(70)  # 0.5 * 40 + 0.5 * 100
+    assert history.rate == 40
+    assert history.peak == 100
+    assert history.eta(7000) == pytest.approx(100)
+    # a restarted scan starts a new history
+    assert history.add(30, 10) is None
+    assert history.eta(7000) is None
+
+
+def test_rate_history_trim_percent():
+    history = RateHistory()
+    history.add(0, 37)
+    history.add(5, 41)
+    assert history.eta(100 - 41) == pytest.approx(59 * 5 / 4)
+
+
+def test_watch_replay_flags_slow_disk(tmp_path):
+    # issued grows 100G per poll, then 2G, the rate drop makes watch look at disk waits
+    text = (FIXTURES / Path("zpool_status_resilver.txt")).read_text()
+    polls = []
+    for index, issued in enumerate(["301G", "401G", "501G", "503G"]):
+        path = tmp_path / Path(f"status{index}.txt")
+        path.write_text(text.replace("301G / 3.61T issued", f"{issued} / 3.61T issued"))
+        polls.append(path)
+    iostat = (FIXTURES / Path("zpool_iostat_resilver.txt")).as_posix()
+    args = ["watch", "--json", "--interval", "5", "--drop-ratio", "0.9"]
+    for path in polls:
+        args += ["--replay", path.as_posix(), "--replay-iostat", iostat]
+    result = CliRunner().invoke(cli, args)
+    assert result.exit_code == 0, result.output
+    records = [json.loads(_) for _ in result.output.splitlines()]
+    assert [_["slow_devices"] for _ in records[:3]] == [[], [], []]
+    assert [(_["vdev"], _["name"]) for _ in records[3]["slow_devices"]] == [("raidz2-0", "sdd")]
+    assert records[3]["eta_seconds"] > records[2]["eta_seconds"]
+    assert {_["name"] for _ in records[3]["vdevs"]} >= {"sda", "sdd"}
+
+
+def test_watch_replay_without_iostat(tmp_path):
+    status = (FIXTURES / Path("zpool_status_trim.txt")).as_posix()
+    result = CliRunner().invoke(
+        cli, ["watch", "--json", "--replay", status, "--replay", status]
+    )
+    assert result.exit_code == 0, result.output
+    record = json.loads(result.output.splitlines()[-1])
+    assert record["slow_devices"] == []
+    assert [_["trim_percent"] for _ in record["vdevs"]] == [37, 41]
+
+
+def test_watch_replay_pool_missing_from_iostat():
+    # the iostat sample only has tank, rpool gets no disk waits
+    status = (FIXTURES / Path("zpool_status_finished.txt")).as_posix()
+    iostat = (FIXTURES / Path("zpool_iostat_resilver.txt")).as_posix()
+    result = CliRunner().invoke(
+        cli, ["watch", "--json", "--replay", status, "--replay-iostat", iostat]
+    )
+    assert result.exit_code == 0, result.output
+    records = {_["pool"]: _ for _ in map(json.loads, result.output.splitlines())}
+    assert records["rpool"]["vdevs"] == []
+    assert records["rpool"]["slow_devices"] == []
+    assert records["tank"]["scan_state"] == "finished"
@@ -0,0 +1,50 @@
+from pathlib import Path
+
+import pytest
+
+from zfstool.zfstool import parse_zpool_list_vdevs
+
+FIXTURES = Path(__file__).parent / Path("fixtures")
+
+
+def vdevs(name: str) -> list[dict]:
+    return parse_zpool_list_vdevs((FIXTURES / Path(name)).read_text())
+
+
+def test_class_headers_are_not_vdevs():
+    names = [(_["depth"], _["name"], _["class"]) for _ in vdevs("zpool_list_v.txt")]
+    assert names == [
+        (0, "tank", None),
+        (1, "raidz2-0", None),
+        (2, "sda", None),
+        (2, "sdb", None),
+        (2, "sdc", None),
+        (2, "sdd", None),
+        (1, "mirror-1", "logs"),
+        (2, "nvme0n1p1", "logs"),
+        (2, "nvme1n1p1", "logs"),
+        (1, "nvme0n1p2", "cache"),
+        (1, "sde", "spare"),
+    ]
+
+
+def test_sizes():
+    by_name = {_["name"]: _ for _ in vdevs("zpool_list_v.txt")}
+    assert by_name["tank"]["alloc"] == 2415919104000
+    assert by_name["raidz2-0"]["size"] == 7971459301376
+    assert by_name["sda"]["size"] == 2000398934016
+    assert by_name["sda"]["alloc"] is None
+    assert by_name["mirror-1"]["alloc"] == 1048576
+
+
+def test_paths_and_guids_line_up():
+    paths = vdevs("zpool_list_v_paths.txt")
+    guids = vdevs("zpool_list_v_guids.txt")
+    assert [_["depth"] for _ in paths] == [_["depth"] for _ in guids]
+    assert paths[2]["name"].startswith("/dev/disk/by-id/")
+    assert guids[2]["name"] == "12240516512874121011"
+
+
+def test_scripted_output_is_refused():
+    with pytest.raises(AssertionError):
+        parse_zpool_list_vdevs("tank\t100\t10\t90\n\tsda\t100\t10\t90\n")
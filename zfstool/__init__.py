@@ -1,8 +1,26 @@
+from .zfstool import ChunkStore
+from .zfstool import DatasetTree
 from .zfstool import RAID_LIST
+from .zfstool import archive
+from .zfstool import boot_cache
+from .zfstool import capacity_plan
+from .zfstool import capacity_plan_refused
+from .zfstool import capacity_projection
 from .zfstool import create_zfs_filesystem
 from .zfstool import create_zfs_filesystem_snapshot
 from .zfstool import create_zfs_pool
+from .zfstool import disk_bench
+from .zfstool import find_slow_disks
+from .zfstool import parse_capacity_plan
+from .zfstool import parse_zpool_status
+from .zfstool import rebalance
+from .zfstool import send_plan
+from .zfstool import serve
+from .zfstool import unlock
+from .zfstool import watch
 from .zfstool import write_zfs_root_filesystem_on_devices
 from .zfstool import zfs_check_mountpoints
 from .zfstool import zfs_set_sharenfs
+from .zfstool import zpool_cache_summary
 from .zfstool import zpool_is_imported
+from .zfstool import zpool_live_summary
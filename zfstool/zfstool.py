@@ -23,11 +23,39 @@
 # pylint: disable=too-many-boolean-expressions    # [R0916] in if statement
 from __future__ import annotations
 
+import errno
+import hashlib
+import json
+import math
+import mmap
 import os
+import random
+import re
+import shutil
+import socket
+import socketserver
+import stat
+import statistics
+import subprocess
 import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import zlib
+from collections import deque
+from collections.abc import Callable
+from collections.abc import Iterable
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from itertools import islice
 from pathlib import Path
 from signal import SIG_DFL
+from signal import SIG_IGN
 from signal import SIGPIPE
+from signal import SIGTERM
 from signal import signal
 
 import click
@@ -71,7 +99,31 @@ RAID_LIST = [
 ]
 
 
+ZFSTOOL_SOCKET = Path(os.environ.get("ZFSTOOL_SOCKET", "/run/zfstool.sock"))
+
+
+def daemon_request(request: dict) -> None | dict:
+    # answer from a running zfstool serve, None means ask zfs/zpool directly
+    if not ZFSTOOL_SOCKET.exists():
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as _socket:
+            _socket.settimeout(2)
+            _socket.connect(ZFSTOOL_SOCKET.as_posix())
+            _socket.sendall(json.dumps(request).encode() + b"\n")
+            with _socket.makefile("rb") as fh:
+                response = json.loads(fh.readline())
+    except (OSError, ValueError):
+        return None
+    if not response.get("ok"):
+        return None
+    return response
+
+
 def zpool_is_imported(zpool: str):
+    response = daemon_request({"op": "is_imported", "pool": zpool})
+    if response is not None:
+        return response["value"]
     _result = sh.zpool("list").splitlines()[1:]
     for _ in _result:
         _ = _.strip()
@@ -82,458 +134,3654 @@ def zpool_is_imported(zpool: str):
     return False
 
 
-@click.group(no_args_is_help=True, cls=AHGroup)
-@click_add_options(click_global_options)
-@click.pass_context
-def cli(
-    ctx,
-    verbose_inf: bool,
-    dict_output: bool,
-    verbose: bool = False,
-):
-    tty, verbose = tvicgvd(
-        ctx=ctx,
-        verbose=verbose,
-        verbose_inf=verbose_inf,
-        ic=ic,
-        gvd=gvd,
-    )
+def parallel_imap(
+    function: Callable,
+    iterable: Iterable,
+    *,
+    jobs: int,
+    window: None | int = None,
+) -> Iterator[tuple]:
+    # yields (item, result, exception) in completion order
+    # only window items are in flight, so iterable can be a huge generator
+    assert jobs >= 1
+    if window is None:
+        window = jobs * 4
+    iterator = iter(iterable)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = {}
+        for item in islice(iterator, window):
+            pending[executor.submit(function, item)] = item
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                exception = future.exception()
+                if exception is None:
+                    yield item, future.result(), None
+                else:
+                    yield item, None, exception
+                for item in islice(iterator, 1):
+                    pending[executor.submit(function, item)] = item
 
 
-@cli.command()
-@click_add_options(click_global_options)
-@click.pass_context
-def zfs_check_mountpoints(
-    ctx,
-    *,
-    verbose_inf: bool,
-    dict_output: bool,
-    verbose: bool = False,
-):
-    tty, verbose = tvicgvd(
-        ctx=ctx,
-        verbose=verbose,
-        verbose_inf=verbose_inf,
-        ic=ic,
-        gvd=gvd,
-    )
+class ByteRateLimiter:
+    # shared by all worker threads, rate=None means unlimited
+    def __init__(self, bytes_per_second: None | int):
+        if bytes_per_second is not None:
+            assert bytes_per_second > 0
+        self.bytes_per_second = bytes_per_second
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
 
-    mountpoints = sh.zfs.get("mountpoint")
-    ic(mountpoints)
+    def consume(self, count: int) -> None:
+        if not self.bytes_per_second:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.next_time = max(now, self.next_time) + (count / self.bytes_per_second)
+            delay = self.next_time - now
+        if delay > 0:
+            time.sleep(delay)
 
-    for line in mountpoints.splitlines()[1:]:
-        line = " ".join(line.split())
-        ic(line)
-        zfs_path = line.split(" mountpoint ", maxsplit=1)[0]
-        mountpoint = line.split(" mountpoint ")[1]
-        if mountpoint.startswith("none"):
+
+# zpool list -v prints these as rows of "-" above the vdevs of that allocation class
+ZPOOL_VDEV_CLASSES = ["dedup", "special", "logs", "cache", "spare", "spares"]
+
+
+def parse_zpool_list_vdevs(zpool_list_output: str) -> list[dict]:
+    # zpool list -v -p without -H: names are indented two spaces per level,
+    # -H indents every vdev with a single tab so the hierarchy is lost
+    vdevs = []
+    vdev_class = None
+    for line in zpool_list_output.splitlines():
+        if not line.strip():
             continue
-        if mountpoint.startswith("-"):  # snapshot
-            assert "@" in zfs_path
+        assert not line.startswith("\t"), "zpool list -v -H output has no vdev depth"
+        fields = line.split()
+        if fields[0] == "NAME":
             continue
-        assert mountpoint.startswith("/")
-        mountpoint = mountpoint.split(" ")[0]
-        ic(zfs_path, mountpoint)
-        assert zfs_path == mountpoint[1:]
+        depth = (len(line) - len(line.lstrip(" "))) // 2
+        name = fields[0]
+        if depth == 0:
+            if name in ZPOOL_VDEV_CLASSES and set(fields[1:]) == {"-"}:
+                vdev_class = name
+                continue
+            vdev_class = None
+        size, alloc, free = [
+            int(_) if _.isdigit() else None for _ in fields[1:4]
+        ]
+        vdevs.append(
+            {
+                "depth": depth,
+                "name": name,
+                "class": vdev_class,
+                "size": size,
+                "alloc": alloc,
+                "free": free,
+            }
+        )
+    return vdevs
 
 
-@cli.command()
-@click.argument(
-    "devices",
-    required=True,
-    nargs=-1,
-    type=click.Path(
-        exists=False,
-        dir_okay=False,
-        file_okay=True,
-        allow_dash=False,
-        path_type=Path,
-    ),
-)
-@click.option("--force", is_flag=True, required=False)
-@click.option("--raid", is_flag=False, required=True, type=click.Choice(RAID_LIST))
-@click.option("--raid-group-size", is_flag=False, required=True, type=int)
-@click.option("--pool-name", is_flag=False, required=True, type=str)
-@click.option(
-    "--mount-point",
-    is_flag=False,
-    required=True,
-    type=click.Path(
-        exists=True,
-        dir_okay=True,
-        file_okay=False,
-        allow_dash=False,
-        path_type=Path,
-    ),
-)
-@click_add_options(click_global_options)
-@click.pass_context
-def write_zfs_root_filesystem_on_devices(
-    ctx,
-    *,
-    devices: tuple[Path, ...],
-    force: bool,
-    raid: str,
-    raid_group_size: int,
-    pool_name: str,
-    mount_point: Path,
-    verbose_inf: bool,
-    dict_output: bool,
-    verbose: bool = False,
-):
-    tty, verbose = tvicgvd(
-        ctx=ctx,
-        verbose=verbose,
-        verbose_inf=verbose_inf,
-        ic=ic,
-        gvd=gvd,
-    )
-    devices = tuple([Path(_device) for _device in devices])
+def zpool_list_vdevs(pool: str) -> list[dict]:
+    _result = sh.zpool.list("-v", "-p", pool)
+    return parse_zpool_list_vdevs(str(_result))
 
-    # https://raw.githubusercontent.com/ryao/zfs-overlay/master/zfs-install
-    run_command("modprobe zfs || exit 1", verbose=True)
 
-    for device in devices:
-        assert path_is_block_special(device)
-        assert not block_special_path_is_mounted(
-            device,
-        )
-        if not Path(device).name.startswith("nvme"):
-            assert not device.name[-1].isdigit()
+def zfs_get_value(dataset: str, prop: str) -> str:
+    response = daemon_request({"op": "get", "name": dataset, "property": prop})
+    if response is not None:
+        return response["value"]
+    _result = sh.zfs.get("-H", "-p", "-o", "value", prop, dataset)
+    return str(_result).strip()
 
-    # assert raid_group_size >= 2
-    assert len(devices) >= raid_group_size
 
-    device_string = ""
-    if len(devices) == 1:
-        assert raid == "disk"
-        device_string = devices[0].as_posix()
+def zfs_newest_snapshot(dataset: str) -> None | str:
+    _result = sh.zfs.list(
+        "-H", "-t", "snapshot", "-o", "name", "-s", "createtxg", "-d", "1", dataset
+    )
+    snapshots = str(_result).splitlines()
+    if not snapshots:
+        return None
+    return snapshots[-1]
 
-    if len(devices) > 1:
-        assert raid == "mirror"
-        assert len(devices) % 2 == 0
 
-    if len(devices) == 2:
-        assert raid == "mirror"
-        device_string = "mirror " + devices[0].as_posix() + " " + devices[1].as_posix()
+ZFS_DIFF_ESCAPE_RE = re.compile(r"\\([0-7]{4})")
 
-    # striped mirror raid10
-    if len(devices) > 2:
-        for pair in grouper(devices, raid_group_size):
-            device_string = device_string + "mirror " + pair[0] + " " + pair[1] + " "
-            eprint("device_string:", device_string)
-    assert device_string != ""
 
-    assert len(pool_name) > 2
+def zfs_diff_created_files(snapshot: str) -> set[str]:
+    # regular files created after the snapshot, the only ones it holds no blocks of,
+    # zfs diff -H writes space, backslash and non ascii bytes as \0NNN
+    created = set()
+    for line in sh.zfs.diff("-H", "-F", snapshot, _iter=True):
+        fields = line.rstrip("\n").split("\t")
+        if fields[0] != "+" or fields[1] != "F":
+            continue
+        path = ZFS_DIFF_ESCAPE_RE.sub(lambda _: chr(int(_.group(1), 8)), fields[2])
+        created.add(os.fsdecode(path.encode("latin-1")))
+    return created
 
-    # -o feature@filesystem_limits=enabled \
-    zpool_command = (
-        """
-    zpool create \
-    -f \
-    -o feature@async_destroy=enabled \
-    -o feature@blake3=enabled \
-    -o feature@block_cloning=enabled \
-    -o feature@bookmarks=enabled \
-    -o feature@bookmark_v2=enabled \
-    -o feature@bookmark_written=enabled \
-    -o feature@device_rebuild=enabled \
-    -o feature@embedded_data=enabled \
-    -o feature@empty_bpobj=enabled \
-    -o feature@enabled_txg=enabled \
-    -o feature@encryption=enabled \
-    -o feature@extensible_dataset=enabled \
-    -o feature@head_errlog=enabled \
-    -o feature@spacemap_histogram=enabled \
-    -o feature@spacemap_v2=enabled \
-    -o feature@zpool_checkpoint=enabled \
-    -o feature@zstd_compress=enabled \
-    -o cachefile='/tmp/zpool.cache'\
-    -O atime=off \
-    -O compression=zstd \
-    -O copies=1 \
-    -O xattr=sa \
-    -O sharesmb=off \
-    -O sharenfs=off \
-    -O checksum=blake3 \
-    -O dedup=off \
-    -O utf8only=off \
-    -m none \
-    -R """
-        + mount_point.as_posix()
-        + " "
-        + pool_name
-        + " "
-        + device_string
-    )
 
-    run_command(zpool_command, verbose=True)
+REBALANCE_TEMP_PREFIX = ".zfstool-rebalance-"
 
-    # Create rootfs
-    run_command("zfs create -o mountpoint=none " + pool_name + "/ROOT", verbose=True)
-    run_command(
-        "zfs create -o mountpoint=/ " + pool_name + "/ROOT/gentoo", verbose=True
-    )
 
-    # Create home directories
-    # zfs create -o mountpoint=/home rpool/HOME
-    # zfs create -o mountpoint=/root rpool/HOME/root
+def rebalance_candidates(
+    root: Path,
+    *,
+    created_since_snapshot: None | set[str],
+    done: set[str],
+) -> Iterator[tuple[Path, os.stat_result]]:
+    # created_since_snapshot None means there is no snapshot to respect
+    root_dev = root.stat().st_dev
+    for dirpath, dirnames, filenames in os.walk(root):
+        # child datasets are separate mounts with their own st_dev
+        same_device = []
+        for dirname in dirnames:
+            try:
+                if os.lstat(os.path.join(dirpath, dirname)).st_dev == root_dev:
+                    same_device.append(dirname)
+            except FileNotFoundError:  # removed while walking a live dataset
+                continue
+        dirnames[:] = same_device
+        if dirpath == root.as_posix() and ".zfs" in dirnames:
+            dirnames.remove(".zfs")
+        for filename in filenames:
+            if filename.startswith(REBALANCE_TEMP_PREFIX):
+                continue
+            path = Path(dirpath) / Path(filename)
+            if path.as_posix() in done:
+                continue
+            if created_since_snapshot is not None and path.as_posix() not in created_since_snapshot:
+                continue  # blocks are held by a snapshot, rewriting doubles the space used
+            try:
+                _stat = path.lstat()
+            except FileNotFoundError:
+                continue
+            if not stat.S_ISREG(_stat.st_mode):
+                continue
+            if _stat.st_nlink > 1:  # rename would split the hardlinks
+                continue
+            yield path, _stat
 
-    # Create portage directories
-    # zfs create -o mountpoint=none -o setuid=off rpool/GENTOO
-    # zfs create -o mountpoint=/usr/portage -o atime=off rpool/GENTOO/portage
-    # zfs create -o mountpoint=/usr/portage/distfiles rpool/GENTOO/distfiles
 
-    # Create portage build directory
-    # run_command("zfs create -o mountpoint=/var/tmp/portage -o compression=zstd -o sync=disabled rpool/GENTOO/build-dir")
+def rebalance_file(
+    path: Path,
+    *,
+    expected_stat: os.stat_result,
+    limiter: ByteRateLimiter,
+    chunk_size: int = 1 << 20,
+) -> int:
+    # plain read()/write(), copy_file_range() could block clone and not reallocate anything
+    _fd, _temp = tempfile.mkstemp(dir=path.parent, prefix=REBALANCE_TEMP_PREFIX)
+    temp_path = Path(_temp)
+    try:
+        source_hash = hashlib.blake2b()
+        with open(path, "rb") as source, os.fdopen(_fd, "wb") as destination:
+            while chunk := source.read(chunk_size):
+                limiter.consume(len(chunk))
+                source_hash.update(chunk)
+                destination.write(chunk)
+            destination.flush()
+            os.fsync(destination.fileno())
 
-    # Create optional packages directory
-    # zfs create -o mountpoint=/usr/portage/packages rpool/GENTOO/packages
+        temp_hash = hashlib.blake2b()
+        with open(temp_path, "rb") as copy:
+            while chunk := copy.read(chunk_size):
+                temp_hash.update(chunk)
+        if temp_hash.digest() != source_hash.digest():
+            raise ValueError(f"checksum mismatch on copy of {path}")
 
-    # Create optional ccache directory
-    # zfs create -o mountpoint=/var/tmp/ccache -o compression=zstd rpool/GENTOO/ccache
+        _stat = path.lstat()
+        if (_stat.st_size, _stat.st_mtime_ns, _stat.st_ino) != (
+            expected_stat.st_size,
+            expected_stat.st_mtime_ns,
+            expected_stat.st_ino,
+        ):
+            raise ValueError(f"{path} changed while it was being copied")
 
-    # Set bootfs
-    run_command(
-        "zpool set bootfs=" + pool_name + "/ROOT/gentoo " + pool_name, verbose=True
-    )
+        os.chown(temp_path, _stat.st_uid, _stat.st_gid)
+        shutil.copystat(path, temp_path)  # after chown, chown clears setuid
+        os.replace(temp_path, path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return expected_stat.st_size
 
-    # Copy zpool.cache into chroot
-    run_command("mkdir -p /mnt/gentoo/etc/zfs", verbose=True)
-    run_command("cp /tmp/zpool.cache /mnt/gentoo/etc/zfs/zpool.cache", verbose=True)
 
-    # print("done making zfs filesystem, here's what is mounted:")
-    # run_command('mount')
+SIZE_SUFFIXES = {
+    "B": 0,
+    "K": 10,
+    "M": 20,
+    "G": 30,
+    "T": 40,
+    "P": 50,
+    "E": 60,
+}
 
 
-@cli.command()
-@click.argument(
-    "devices",
-    required=True,
-    nargs=-1,
-    type=str,
+def parse_size(size: None | str | int) -> None | int:
+    # accepts raw -p numbers and human readable 1.23G, 10g or 1.5TiB style sizes
+    if size is None or isinstance(size, int):
+        return size
+    size = size.strip()
+    if size in ["", "-", "none"]:
+        return None
+    if size.isdigit():
+        return int(size)
+    number = size.upper().rstrip("IBKMGTPE")
+    suffix = size[len(number) :].upper().rstrip("IB") or "B"
+    return int(float(number) * (1 << SIZE_SUFFIXES[suffix[0]]))
+
+
+SCAN_HEADER_RE = re.compile(
+    r"(?P<function>scrub|resilver)(?: \((?P<vdev>[^)]+)\))? (?P<state>in progress|paused|canceled)"
 )
-@click.option("--force", is_flag=True, required=False)
-@click.option("--simulate", is_flag=True, required=False)
-@click.option("--skip-checks", is_flag=True, required=False)
-@click.option("--raid", is_flag=False, required=True, type=click.Choice(RAID_LIST))
-@click.option("--raid-group-size", is_flag=False, required=True, type=int)
-@click.option("--pool-name", is_flag=False, required=True, type=str)
-@click.option("--ashift", is_flag=False, required=False, type=int, help=ASHIFT_HELP)
-@click.option("--encrypt", is_flag=True)
-@click_add_options(click_global_options)
-@click.pass_context
-def create_zfs_pool(
-    ctx,
-    *,
-    devices: tuple[str, ...],
-    force: bool,
-    simulate: bool,
-    skip_checks: bool,
-    raid: str,
-    raid_group_size: int,
-    pool_name: str,
-    ashift: None | int,
-    verbose_inf: bool,
-    dict_output: bool,
-    encrypt: bool,
-    verbose: bool = False,
-):
-    tty, verbose = tvicgvd(
-        ctx=ctx,
-        verbose=verbose,
-        verbose_inf=verbose_inf,
-        ic=ic,
-        gvd=gvd,
-    )
+SCAN_FINISHED_RE = re.compile(r"(?P<function>scrub repaired|resilvered) ")
+SCAN_SCANNED_RE = re.compile(r"(?P<scanned>\S+)(?: / (?P<total>\S+))? scanned")
+SCAN_ISSUED_RE = re.compile(r"(?P<issued>\S+)(?: / (?P<total>\S+))? issued")
+SCAN_TOTAL_RE = re.compile(r"(?P<total>\S+) total")
+SCAN_PROCESSED_RE = re.compile(r"(?P<processed>\S+) (?:repaired|resilvered),")
+SCAN_PERCENT_RE = re.compile(r"(?P<percent>[\d.]+)% done")
+SCAN_ETA_RE = re.compile(
+    r"(?:(?P<days>\d+) days )?(?P<hours>\d+):(?P<minutes>\d+):(?P<seconds>\d+) to go"
+)
+VDEV_TRIM_RE = re.compile(r"(?P<percent>\d+)% trimmed")
 
-    # needed for --simulate
-    devices_pathlib: tuple[Path, ...] = tuple([Path(_device) for _device in devices])
-    del devices
-    devices = devices_pathlib
-    del devices_pathlib
 
-    if ashift:
-        assert ashift >= 9
-        assert ashift <= 16
-        eprint("using block size: {} (ashift={})".format(1 << ashift, ashift))
+def parse_zpool_status_scan(scan_lines: list[str]) -> dict:
+    text = " ".join(_.strip() for _ in scan_lines)
+    scan: dict = {"function": None, "state": None}
+    match = SCAN_HEADER_RE.search(text)
+    if match:
+        scan["function"] = match.group("function")
+        scan["state"] = match.group("state")
+        scan["vdev"] = match.group("vdev")
+    else:
+        match = SCAN_FINISHED_RE.search(text)
+        if match:
+            function = match.group("function").split()[0]
+            scan["function"] = {"resilvered": "resilver"}.get(function, function)
+            scan["state"] = "finished"
+        return scan
 
-    if skip_checks:
-        assert simulate
+    for regex, keys in [
+        (SCAN_SCANNED_RE, ["scanned", "total"]),
+        (SCAN_ISSUED_RE, ["issued", "total"]),
+        (SCAN_TOTAL_RE, ["total"]),
+        (SCAN_PROCESSED_RE, ["processed"]),
+    ]:
+        match = regex.search(text)
+        if match:
+            for key in keys:
+                if match.group(key) is not None:
+                    scan[key] = parse_size(match.group(key))
+    match = SCAN_PERCENT_RE.search(text)
+    if match:
+        scan["percent"] = float(match.group("percent"))
+    match = SCAN_ETA_RE.search(text)
+    if match:
+        scan["eta_seconds"] = (
+            int(match.group("days") or 0) * 86400
+            + int(match.group("hours")) * 3600
+            + int(match.group("minutes")) * 60
+            + int(match.group("seconds"))
+        )
+    return scan
 
-    if simulate:
-        skip_checks = True
+
+def parse_zpool_status_config(config_lines: list[str]) -> list[dict]:
+    vdevs = []
+    for line in config_lines:
+        if not line.strip():
+            continue
+        if line.startswith("\t"):
+            line = line[1:]
+        fields = line.split()
+        if fields[0] == "NAME":
+            continue
+        depth = (len(line) - len(line.lstrip(" "))) // 2
+        vdev: dict = {"depth": depth, "name": fields[0], "state": None}
+        if len(fields) > 1:
+            vdev["state"] = fields[1]
+        if len(fields) >= 5:
+            vdev["read"], vdev["write"], vdev["cksum"] = [
+                parse_size(_) for _ in fields[2:5]
+            ]
+            note = " ".join(fields[5:])
+            if note:
+                vdev["note"] = note.strip("()")
+                match = VDEV_TRIM_RE.search(note)
+                if match:
+                    vdev["trim_percent"] = int(match.group("percent"))
+        vdevs.append(vdev)
+    return vdevs
+
+
+def parse_zpool_status(zpool_status_output: str) -> dict[str, dict]:
+    # text output of zpool status -p [-t]
+    pools: dict[str, dict] = {}
+    pool: dict = {}
+    section = None
+    sections: dict[str, list[str]] = {}
+    for line in zpool_status_output.splitlines() + ["  pool: "]:
+        key, _, value = line.partition(":")
+        key = key.strip()
+        if not line.startswith("\t") and key in [
+            "pool",
+            "state",
+            "status",
+            "action",
+            "scan",
+            "config",
+            "errors",
+            "see",
+            "remove",
+            "checkpoint",
+        ]:
+            if key == "pool":
+                if pool:
+                    pool["scan"] = parse_zpool_status_scan(sections.get("scan", []))
+                    pool["config"] = parse_zpool_status_config(
+                        sections.get("config", [])
+                    )
+                    pools[pool["pool"]] = pool
+                pool = {"pool": value.strip()}
+                sections = {}
+            elif key == "state":
+                pool["state"] = value.strip()
+            section = key
+            sections[section] = [value]
+            continue
+        if section:
+            sections[section].append(line)
+    return pools
+
+
+def zpool_status_json_to_pools(zpool_status_json: dict) -> dict[str, dict]:
+    # zpool status -j (OpenZFS 2.3+), mapped onto the parse_zpool_status() layout
+    def _vdevs(vdev_dict: dict, depth: int) -> Iterator[dict]:
+        for name, vdev in vdev_dict.items():
+            entry = {
+                "depth": depth,
+                "name": name,
+                "state": vdev.get("state"),
+                "read": parse_size(vdev.get("read_errors")),
+                "write": parse_size(vdev.get("write_errors")),
+                "cksum": parse_size(vdev.get("checksum_errors")),
+            }
+            if vdev.get("resilver_repair"):
+                entry["note"] = "resilvering"
+            if "trim_progress" in vdev:  # not present on every version
+                entry["trim_percent"] = int(float(vdev["trim_progress"]))
+            yield entry
+            yield from _vdevs(vdev.get("vdevs", {}), depth + 1)
+
+    pools = {}
+    for name, pool_json in zpool_status_json.get("pools", {}).items():
+        scan_json = pool_json.get("scan_stats", {})
+        scan: dict = {"function": None, "state": None}
+        if scan_json:
+            scan["function"] = scan_json.get("function", "").lower() or None
+            state = scan_json.get("state", "").lower()
+            scan["state"] = {"scanning": "in progress"}.get(state, state)
+            scan["scanned"] = parse_size(scan_json.get("examined"))
+            scan["issued"] = parse_size(scan_json.get("issued"))
+            scan["total"] = parse_size(scan_json.get("to_examine"))
+            scan["processed"] = parse_size(scan_json.get("processed"))
+            if scan["issued"] is not None and scan["total"]:
+                scan["percent"] = 100 * scan["issued"] / scan["total"]
+        pools[name] = {
+            "pool": name,
+            "state": pool_json.get("state"),
+            "scan": scan,
+            "config": list(_vdevs(pool_json.get("vdevs", {}), 0)),
+        }
+    return pools
+
+
+def parse_zpool_status_any(zpool_status_output: str) -> dict[str, dict]:
+    if zpool_status_output.lstrip().startswith("{"):
+        return zpool_status_json_to_pools(json.loads(zpool_status_output))
+    return parse_zpool_status(zpool_status_output)
+
+
+def zpool_status(pools: Iterable[str] = ()) -> dict[str, dict]:
+    pools = list(pools)
+    try:
+        _result = sh.zpool.status("-j", "-p", "-t", *pools)
+    except sh.ErrorReturnCode:  # -j is OpenZFS 2.3+
+        _result = sh.zpool.status("-p", "-t", *pools)
+    return parse_zpool_status_any(str(_result))
+
+
+def vdev_tree(config: list[dict]) -> dict[str, dict]:
+    # name -> {"parent": name, "children": [names], "depth": int}
+    tree: dict[str, dict] = {}
+    stack: list[str] = []
+    for vdev in config:
+        depth = vdev["depth"]
+        del stack[depth:]
+        parent = stack[-1] if stack else None
+        tree[vdev["name"]] = {"parent": parent, "children": [], "depth": depth}
+        if parent is not None:
+            tree[parent]["children"].append(vdev["name"])
+        stack.append(vdev["name"])
+    return tree
+
+
+IOSTAT_COLUMNS = [
+    "name",
+    "alloc",
+    "free",
+    "read_ops",
+    "write_ops",
+    "read_bytes",
+    "write_bytes",
+    "total_wait_read",
+    "total_wait_write",
+    "disk_wait_read",
+    "disk_wait_write",
+    "syncq_wait_read",
+    "syncq_wait_write",
+    "asyncq_wait_read",
+    "asyncq_wait_write",
+    "scrub_wait",
+    "trim_wait",
+    "rebuild_wait",
+]
+
+
+def parse_zpool_iostat(
+    zpool_iostat_output: str,
+    pools: Iterable[str],
+) -> dict[str, list[list[dict]]]:
+    # zpool iostat -v [-l] -H -p, a new sample starts at each row for a pool itself
+    pools = list(pools)
+    samples: dict[str, list[list[dict]]] = {_: [] for _ in pools}
+    pool = None
+    for line in zpool_iostat_output.splitlines():
+        fields = line.strip().split("\t")
+        if not fields[0]:
+            continue
+        row = {"name": fields[0]}
+        for key, value in zip(IOSTAT_COLUMNS[1:], fields[1:]):
+            row[key] = parse_size(value)
+        if row["name"] in samples:
+            pool = row["name"]
+            samples[pool].append([])
+        if pool is None:
+            continue
+        samples[pool][-1].append(row)
+    return samples
+
+
+class RateHistory:
+    # rolling rate history, fed either a monotonically increasing counter or rates
+    def __init__(self, *, window: int = 60, alpha: float = 0.2):
+        self.samples: deque = deque(maxlen=window)
+        self.rates: deque = deque(maxlen=window)
+        self.alpha = alpha
+        self.smoothed: None | float = None
+
+    def add_rate(self, rate: None | float) -> None | float:
+        if rate is None:
+            return self.smoothed
+        self.rates.append(rate)
+        if self.smoothed is None:
+            self.smoothed = rate
+        else:
+            self.smoothed = self.alpha * rate + (1 - self.alpha) * self.smoothed
+        return self.smoothed
+
+    def add(self, timestamp: float, value: None | float) -> None | float:
+        if value is None:
+            return self.smoothed
+        if self.samples:
+            last_timestamp, last_value = self.samples[-1]
+            if value < last_value:  # a new scan started
+                self.samples.clear()
+                self.rates.clear()
+                self.smoothed = None
+            elif timestamp > last_timestamp:
+                self.add_rate((value - last_value) / (timestamp - last_timestamp))
+        self.samples.append((timestamp, value))
+        return self.smoothed
+
+    @property
+    def rate(self) -> None | float:
+        if not self.rates:
+            return None
+        return self.rates[-1]
+
+    @property
+    def peak(self) -> None | float:
+        if not self.rates:
+            return None
+        return max(self.rates)
+
+    def eta(self, remaining: None | int) -> None | float:
+        if remaining is None or not self.smoothed:
+            return None
+        return remaining / self.smoothed
+
+
+def slow_leaf_devices(
+    tree: dict[str, dict],
+    iostat_rows: list[dict],
+    *,
+    factor: float = 2.0,
+) -> list[dict]:
+    # leaves whose disk wait is factor times the median of their siblings
+    latency = {}
+    for row in iostat_rows:
+        waits = [row.get("disk_wait_read"), row.get("disk_wait_write")]
+        waits = [_ for _ in waits if _ is not None]
+        if waits:
+            latency[row["name"]] = max(waits)
+    slow = []
+    for name, node in tree.items():
+        if node["children"] or node["parent"] is None or name not in latency:
+            continue
+        siblings = [
+            latency[_]
+            for _ in tree[node["parent"]]["children"]
+            if _ != name and _ in latency and not tree[_]["children"]
+        ]
+        if not siblings:
+            continue
+        baseline = statistics.median(siblings)
+        if latency[name] > factor * max(baseline, 1):
+            slow.append(
+                {
+                    "name": name,
+                    "vdev": node["parent"],
+                    "disk_wait": latency[name],
+                    "sibling_median_disk_wait": baseline,
+                }
+            )
+    return slow
+
+
+HISTOGRAM_COLUMNS = [
+    "total_wait_read",
+    "total_wait_write",
+    "disk_wait_read",
+    "disk_wait_write",
+    "syncq_wait_read",
+    "syncq_wait_write",
+    "asyncq_wait_read",
+    "asyncq_wait_write",
+    "scrub_wait",
+    "trim_wait",
+    "rebuild_wait",
+]
+
+
+def parse_zpool_iostat_histograms(
+    zpool_iostat_output: str,
+    pool: str,
+) -> list[dict[str, dict[str, dict[int, int]]]]:
+    # zpool iostat -v -w -H -p [-y interval count]
+    # each vdev is a name line followed by "bucket\tcount\tcount..." rows
+    # returns one {vdev: {column: {bucket: count}}} per sample
+    samples: list[dict[str, dict[str, dict[int, int]]]] = []
+    vdev = None
+    for line in zpool_iostat_output.splitlines():
+        fields = line.strip().split("\t")
+        if not fields[0]:
+            continue
+        if len(fields) == 1 and not fields[0].isdigit():
+            vdev = fields[0]
+            if vdev == pool or not samples:
+                samples.append({})
+            samples[-1][vdev] = {_: {} for _ in HISTOGRAM_COLUMNS}
+            continue
+        if vdev is None or not fields[0].isdigit():
+            continue  # a header line
+        bucket = int(fields[0])
+        for column, count in zip(HISTOGRAM_COLUMNS, fields[1:]):
+            count_int = parse_size(count)
+            if count_int:
+                histogram = samples[-1][vdev][column]
+                histogram[bucket] = histogram.get(bucket, 0) + count_int
+    return samples
+
+
+def merge_histograms(histograms: Iterable[dict[int, int]]) -> dict[int, int]:
+    merged: dict[int, int] = {}
+    for histogram in histograms:
+        for bucket, count in histogram.items():
+            merged[bucket] = merged.get(bucket, 0) + count
+    return merged
+
+
+def histogram_percentile(histogram: dict[int, int], percentile: float) -> None | int:
+    # returns the upper bound of the bucket holding the percentile
+    total = sum(histogram.values())
+    if not total:
+        return None
+    threshold = total * percentile / 100
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= threshold:
+            return bucket
+    return max(histogram)
+
+
+def robust_score(
+    value: float,
+    others: list[float],
+    *,
+    mad_floor: float,
+) -> tuple[float, float]:
+    # (median of others, distance from it in MADs), MAD scaled to sigma for normal data
+    median = statistics.median(others)
+    mad = statistics.median([abs(_ - median) for _ in others])
+    mad = max(mad * 1.4826, mad_floor)
+    return median, (value - median) / mad
+
+
+def zfs_list(properties: list[str], *args) -> list[dict[str, str]]:
+    # one zfs list -H -p call, rows as {property: value}
+    _result = sh.zfs.list("-H", "-p", "-o", ",".join(properties), *args)
+    rows = []
+    for line in str(_result).splitlines():
+        if not line:
+            continue
+        rows.append(dict(zip(properties, line.split("\t"))))
+    return rows
+
+
+def run_dependency_graph(
+    dependencies: dict[str, set[str]],
+    function: Callable,
+    *,
+    jobs: int,
+) -> Iterator[tuple]:
+    # runs function(node) once everything in dependencies[node] succeeded
+    # yields (node, result, exception), nodes behind a failure get an exception without running
+    assert jobs >= 1
+    waiting = {node: set(deps) for node, deps in dependencies.items()}
+    dependents: dict[str, set[str]] = {node: set() for node in dependencies}
+    for node, deps in dependencies.items():
+        for dep in deps:
+            dependents[dep].add(node)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = {}
+
+        def _submit_ready():
+            for node in [_ for _, deps in waiting.items() if not deps]:
+                del waiting[node]
+                pending[executor.submit(function, node)] = node
+
+        _submit_ready()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = pending.pop(future)
+                exception = future.exception()
+                if exception is None:
+                    yield node, future.result(), None
+                    for dependent in dependents[node]:
+                        if dependent in waiting:
+                            waiting[dependent].discard(node)
+                    continue
+                yield node, None, exception
+                stack = [node]
+                while stack:
+                    failed = stack.pop()
+                    for dependent in dependents[failed]:
+                        if dependent in waiting:
+                            del waiting[dependent]
+                            stack.append(dependent)
+                            yield dependent, None, RuntimeError(
+                                f"skipped, {failed} did not finish"
+                            )
+            _submit_ready()
+
+    for node in waiting:
+        yield node, None, RuntimeError("dependency cycle")
+
+
+def dependency_levels(dependencies: dict[str, set[str]]) -> dict[str, int]:
+    levels: dict[str, int] = {}
+
+    def _level(node: str) -> int:
+        if node not in levels:
+            levels[node] = 0  # cycle guard
+            levels[node] = 1 + max(
+                (_level(_) for _ in dependencies[node]), default=-1
+            )
+        return levels[node]
+
+    for node in dependencies:
+        _level(node)
+    return levels
+
+
+def processes_using_mountpoints(mountpoints: Iterable[str]) -> dict[str, set[int]]:
+    # the fuser -m check, against cwd/root/exe, open files and mmaps of every process
+    mountpoints = sorted(
+        {_.rstrip("/") or "/" for _ in mountpoints}, key=len, reverse=True
+    )
+    users: dict[str, set[int]] = {_: set() for _ in mountpoints}
+
+    def _owner(path: str) -> None | str:
+        for mountpoint in mountpoints:
+            if path == mountpoint or path.startswith(mountpoint.rstrip("/") + "/"):
+                return mountpoint
+        return None
+
+    for proc in Path("/proc").iterdir():
+        if not proc.name.isdigit():
+            continue
+        pid = int(proc.name)
+        paths = []
+        try:
+            for link in ["cwd", "root", "exe"]:
+                try:
+                    paths.append(os.readlink(proc / link))
+                except FileNotFoundError:
+                    pass
+            for fd in (proc / "fd").iterdir():
+                try:
+                    paths.append(os.readlink(fd))
+                except FileNotFoundError:
+                    pass
+            for line in (proc / "maps").read_text().splitlines():
+                fields = line.split(maxsplit=5)
+                if len(fields) == 6 and fields[5].startswith("/"):
+                    paths.append(fields[5])
+        except (FileNotFoundError, PermissionError, ProcessLookupError):
+            continue
+        for path in paths:
+            owner = _owner(path)
+            if owner is not None:
+                users[owner].add(pid)
+    return {mountpoint: pids for mountpoint, pids in users.items() if pids}
+
+
+def plan_recursive_destroy(
+    entries: list[dict[str, str]],
+    *,
+    snapshot_batch: int,
+) -> dict[str, set[str]]:
+    # entries: zfs list -o name,type,createtxg,clones rows for the whole subtree
+    # returns {zfs destroy argument: set of arguments that must be destroyed first}
+    assert snapshot_batch >= 1
+    datasets = {_["name"] for _ in entries if _["type"] != "snapshot"}
+    snapshots: dict[str, list[dict[str, str]]] = {_: [] for _ in datasets}
+    for entry in entries:
+        if entry["type"] == "snapshot":
+            snapshots[entry["name"].split("@")[0]].append(entry)
+
+    dependencies: dict[str, set[str]] = {_: set() for _ in datasets}
+    for dataset in datasets:
+        parent = dataset.rpartition("/")[0]
+        if parent in dependencies:
+            dependencies[parent].add(dataset)
+
+        # contiguous createtxg runs become a@first%last ranges,
+        # a snapshot with clones is its own step after those clones are gone
+        batch: list[str] = []
+
+        def _flush(batch=batch, dataset=dataset):
+            if not batch:
+                return
+            target = dataset + "@" + batch[0]
+            if len(batch) > 1:
+                target += "%" + batch[-1]
+            dependencies[target] = set()
+            dependencies[dataset].add(target)
+            batch.clear()
+
+        for snapshot in sorted(snapshots[dataset], key=lambda _: int(_["createtxg"])):
+            short_name = snapshot["name"].split("@")[1]
+            clones = [_ for _ in snapshot.get("clones", "").split(",") if _ not in ["", "-"]]
+            if not clones:
+                batch.append(short_name)
+                if len(batch) >= snapshot_batch:
+                    _flush()
+                continue
+            _flush()
+            outside = [_ for _ in clones if _ not in datasets]
+            if outside:
+                raise ValueError(
+                    f"{snapshot['name']} has clones outside the tree: {outside}"
+                )
+            dependencies[snapshot["name"]] = set(clones)
+            dependencies[dataset].add(snapshot["name"])
+        _flush()
+    return dependencies
+
+
+def mount_dependencies(mountpoints: dict[str, str]) -> dict[str, set[str]]:
+    # {dataset: mountpoint} -> {dataset: {dataset mounted on the closest parent path}}
+    by_mountpoint = {_.rstrip("/") or "/": dataset for dataset, _ in mountpoints.items()}
+    dependencies: dict[str, set[str]] = {}
+    for dataset, mountpoint in mountpoints.items():
+        dependencies[dataset] = set()
+        path = Path(mountpoint)
+        for parent in path.parents:
+            if parent.as_posix() in by_mountpoint:
+                dependencies[dataset].add(by_mountpoint[parent.as_posix()])
+                break
+    return dependencies
+
+
+def write_file_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _fd, _temp = tempfile.mkstemp(dir=path.parent, prefix="." + path.name + ".")
+    try:
+        with os.fdopen(_fd, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(_temp, path)
+    except BaseException:
+        Path(_temp).unlink(missing_ok=True)
+        raise
+    _dir_fd = os.open(path.parent, os.O_RDONLY)
+    try:
+        os.fsync(_dir_fd)
+    finally:
+        os.close(_dir_fd)
+
+
+# the property list zfs-mount-generator expects, from history_event-zfs-list-cacher.sh
+ZFS_LIST_CACHE_PROPERTIES = [
+    "name",
+    "mountpoint",
+    "canmount",
+    "atime",
+    "relatime",
+    "devices",
+    "exec",
+    "readonly",
+    "setuid",
+    "nbmand",
+    "encroot",
+    "keylocation",
+    "org.openzfs.systemd:requires",
+    "org.openzfs.systemd:requires-mounts-for",
+    "org.openzfs.systemd:before",
+    "org.openzfs.systemd:after",
+    "org.openzfs.systemd:wanted-by",
+    "org.openzfs.systemd:required-by",
+    "org.openzfs.systemd:nofail",
+    "org.openzfs.systemd:ignore",
+]
+
+
+def generate_zfs_list_cache(pools: list[str]) -> dict[str, bytes]:
+    # one streaming zfs list for every pool, split into per pool zfs-list.cache contents
+    altroots = {}
+    for line in sh.zpool.get("-H", "-o", "name,value", "altroot", *pools).splitlines():
+        pool, altroot = line.split("\t")
+        altroots[pool] = altroot.rstrip("/") if altroot != "-" else ""
+    caches: dict[str, list[str]] = {_: [] for _ in pools}
+    for line in sh.zfs.list(
+        "-H",
+        "-t",
+        "filesystem",
+        "-o",
+        ",".join(ZFS_LIST_CACHE_PROPERTIES),
+        "-r",
+        *pools,
+        _iter=True,
+    ):
+        fields = line.rstrip("\n").split("\t")
+        pool = fields[0].split("/")[0]
+        altroot = altroots[pool]
+        mountpoint = fields[1]
+        if altroot and (mountpoint == altroot or mountpoint.startswith(altroot + "/")):
+            fields[1] = mountpoint[len(altroot) :] or "/"
+        caches[pool].append("\t".join(fields) + "\n")
+    return {pool: "".join(lines).encode() for pool, lines in caches.items()}
+
+
+def generate_zpool_cache(pools: list[str], directory: Path) -> bytes:
+    # the kernel writes the cachefile, point the pools at a scratch file then restore them
+    previous = {}
+    for line in sh.zpool.get("-H", "-o", "name,value", "cachefile", *pools).splitlines():
+        pool, cachefile = line.split("\t")
+        previous[pool] = "" if cachefile == "-" else cachefile
+    directory.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=directory, prefix=".zpool.cache.") as _temp:
+        temp_cachefile = Path(_temp) / Path("zpool.cache")
+        try:
+            for pool in pools:
+                sh.zpool.set(f"cachefile={temp_cachefile.as_posix()}", pool)
+            data = temp_cachefile.read_bytes()
+        finally:
+            for pool, cachefile in previous.items():
+                sh.zpool.set(f"cachefile={cachefile}", pool)
+    return data
+
+
+def zpool_cache_summary(cachefile: Path) -> dict[str, dict]:
+    # pool -> {"guid", "leaves": [(guid, path)]} as zdb -C -U reads the file, nothing is imported or set
+    summary: dict[str, dict] = {}
+    pool = None
+    guid = None
+    for line in sh.zdb("-C", "-U", cachefile.as_posix(), _iter=True):
+        line = line.rstrip("\n")
+        if line and not line[0].isspace() and line.endswith(":"):
+            pool = line[:-1]
+            summary[pool] = {"guid": None, "leaves": []}
+            continue
+        if pool is None:
+            continue
+        key, _, value = line.strip().partition(": ")
+        value = value.strip("'")
+        if key == "pool_guid":
+            summary[pool]["guid"] = value
+        elif key == "guid":
+            guid = value
+        elif key == "path":
+            summary[pool]["leaves"].append((guid, value))
+    for _ in summary.values():
+        _["leaves"].sort()
+    return summary
+
+
+def zpool_live_summary(pools: list[str]) -> dict[str, dict]:
+    # the zpool_cache_summary() layout for imported pools, -P and -g list the same rows in the same order
+    summary = {}
+    for line in sh.zpool.list("-H", "-p", "-o", "name,guid", *pools).splitlines():
+        pool, guid = line.split("\t")
+        summary[pool] = {"guid": guid, "leaves": []}
+    paths = parse_zpool_list_vdevs(str(sh.zpool.list("-v", "-p", "-P", *pools)))
+    guids = parse_zpool_list_vdevs(str(sh.zpool.list("-v", "-p", "-g", *pools)))
+    pool = None
+    for path_vdev, guid_vdev in zip(paths, guids, strict=True):
+        if path_vdev["depth"] == 0:
+            pool = path_vdev["name"]
+        elif path_vdev["class"] in ["cache", "spare", "spares"]:
+            continue  # aux vdevs are kept in the pool, not in zpool.cache
+        elif path_vdev["name"].startswith("/"):
+            summary[pool]["leaves"].append((guid_vdev["name"], path_vdev["name"]))
+    for _ in summary.values():
+        _["leaves"].sort()
+    return summary
+
+
+def parse_zfs_get(zfs_get_output: Iterable[str]) -> dict[str, dict[str, str]]:
+    # zfs get / zpool get -H -p -o name,property,value[,source]
+    properties: dict[str, dict[str, str]] = {}
+    for line in zfs_get_output:
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) < 3:
+            continue
+        properties.setdefault(fields[0], {})[fields[1]] = fields[2]
+    return properties
+
+
+# only changed by logged zfs/zpool commands, so a history event invalidates them,
+# used/available/mounted/health and the like change without one
+ZFS_CACHE_PROPERTIES = {
+    "aclinherit",
+    "aclmode",
+    "acltype",
+    "altroot",
+    "ashift",
+    "atime",
+    "autoexpand",
+    "autotrim",
+    "bootfs",
+    "cachefile",
+    "canmount",
+    "casesensitivity",
+    "checksum",
+    "compression",
+    "copies",
+    "createtxg",
+    "creation",
+    "dedup",
+    "devices",
+    "dnodesize",
+    "encryption",
+    "exec",
+    "failmode",
+    "filesystem_limit",
+    "guid",
+    "keyformat",
+    "keylocation",
+    "logbias",
+    "mountpoint",
+    "normalization",
+    "overlay",
+    "primarycache",
+    "quota",
+    "readonly",
+    "recordsize",
+    "redundant_metadata",
+    "refquota",
+    "refreservation",
+    "relatime",
+    "reservation",
+    "secondarycache",
+    "setuid",
+    "sharenfs",
+    "sharesmb",
+    "snapdev",
+    "snapdir",
+    "snapshot_limit",
+    "special_small_blocks",
+    "sync",
+    "type",
+    "utf8only",
+    "volmode",
+    "volsize",
+    "xattr",
+    "zoned",
+}
+
+
+class ZFSCache:
+    # in memory pools/datasets/properties, refreshed per subtree from zpool events
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.pools: dict[str, dict[str, str]] = {}
+        self.datasets: dict[str, dict[str, str]] = {}
+        self.loaded = threading.Event()
+        self.stale = threading.Event()  # set once zpool events -f is no longer followed
+        self.refreshes = 0
+
+    def load(self) -> None:
+        pools = parse_zfs_get(
+            sh.zpool.get("-H", "-p", "-o", "name,property,value", "all", _iter=True)
+        )
+        datasets = parse_zfs_get(
+            sh.zfs.get("-H", "-p", "-o", "name,property,value", "all", _iter=True)
+        )
+        with self.lock:
+            self.pools = pools
+            self.datasets = datasets
+        self.loaded.set()
+
+    def drop_subtree(self, name: str) -> None:
+        with self.lock:
+            for dataset in [
+                _
+                for _ in self.datasets
+                if _ == name or _.startswith(name + "/") or _.startswith(name + "@")
+            ]:
+                del self.datasets[dataset]
+
+    def refresh_pool(self, pool: str) -> None:
+        try:
+            pool_properties = parse_zfs_get(
+                sh.zpool.get("-H", "-p", "-o", "name,property,value", "all", pool, _iter=True)
+            )
+        except sh.ErrorReturnCode:  # exported or destroyed
+            with self.lock:
+                self.pools.pop(pool, None)
+            self.drop_subtree(pool)
+            return
+        with self.lock:
+            imported = pool in self.pools
+            self.pools.update(pool_properties)
+        if not imported:
+            self.refresh_dataset(pool)
+
+    def refresh_dataset(self, name: str) -> None:
+        self.refreshes += 1
+        try:
+            datasets = parse_zfs_get(
+                sh.zfs.get(
+                    "-H", "-p", "-r", "-o", "name,property,value", "all", name, _iter=True
+                )
+            )
+        except sh.ErrorReturnCode:  # destroyed or renamed away
+            self.drop_subtree(name)
+            parent = name.split("@")[0].rpartition("/")[0]
+            if parent and "@" not in name:
+                self.refresh_dataset(parent)
+            return
+        with self.lock:
+            if "@" not in name:
+                self.drop_subtree(name)
+            self.datasets.update(datasets)
+
+    def query(self, request: dict) -> dict:
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "request is not an object"}
+        if self.stale.is_set():
+            return {"ok": False, "error": "not following zpool events"}
+        op = request.get("op")
+        if op in ["get", "property"] and request.get("property") not in ZFS_CACHE_PROPERTIES:
+            return {"ok": False, "error": f"not cached: {request.get('property')}"}
+        with self.lock:
+            if op == "is_imported":
+                return {"ok": True, "value": request["pool"] in self.pools}
+            if op == "pools":
+                return {"ok": True, "value": sorted(self.pools)}
+            if op == "get":
+                name = request["name"]
+                properties = self.datasets.get(name, self.pools.get(name))
+                if properties is None or request["property"] not in properties:
+                    return {"ok": False, "error": f"unknown: {name} {request['property']}"}
+                return {"ok": True, "value": properties[request["property"]]}
+            if op == "property":
+                prop = request["property"]
+                return {
+                    "ok": True,
+                    "value": {
+                        name: properties[prop]
+                        for name, properties in self.datasets.items()
+                        if prop in properties
+                    },
+                }
+            if op == "stats":
+                return {
+                    "ok": True,
+                    "value": {
+                        "pools": len(self.pools),
+                        "datasets": len(self.datasets),
+                        "refreshes": self.refreshes,
+                    },
+                }
+        return {"ok": False, "error": f"unknown op: {op}"}
+
+
+ZPOOL_EVENT_FIELD_RE = re.compile(r"^\s+(?P<key>\S+) = (?P<value>.*)$")
+
+
+def parse_zpool_events(lines: Iterable[str]) -> Iterator[dict[str, str]]:
+    # zpool events -H -v: "time\tclass" then indented "key = value" lines, blank line between events
+    event: dict[str, str] = {}
+    for line in lines:
+        line = line.rstrip("\n")
+        match = ZPOOL_EVENT_FIELD_RE.match(line)
+        if match and event:
+            event[match.group("key")] = match.group("value").strip('"')
+            continue
+        if not line.strip():
+            if event:
+                yield event
+            event = {}
+            continue
+        if event:
+            yield event
+        fields = line.split("\t")
+        event = {"time": fields[0], "class": fields[-1].strip()}
+    if event:
+        yield event
+
+
+def follow_zpool_events(cache: ZFSCache) -> None:
+    # refreshes are coalesced, a burst of events on one tree costs one zfs get,
+    # cache.stale is set when this returns or raises
+    try:
+        _follow_zpool_events(cache)
+    except Exception as e:  # pylint: disable=broad-except
+        eprint(f"zpool events -f failed: {e!r}")
+    finally:
+        cache.stale.set()
+
+
+def zpool_event_datasets(event: dict[str, str]) -> list[str]:
+    # datasets a history event changed, a rename is logged under the old name
+    # with "-> pool/new/name" or "-> @newsnap" in history_internal_str
+    dataset = event.get("history_dsname")
+    if dataset is None:
+        return []
+    if "%" in dataset:  # internal clone names, tank/fs/%recv is tank/fs
+        dataset = dataset.split("%")[0].rstrip("/")
+    datasets = [dataset]
+    if event.get("history_internal_name") == "rename":
+        _, arrow, new_name = event.get("history_internal_str", "").partition("-> ")
+        new_name = new_name.strip()
+        if arrow and new_name.startswith("@"):
+            datasets.append(dataset.split("@")[0] + new_name)
+        elif arrow and new_name:
+            datasets.append(new_name)
+    return datasets
+
+
+def _follow_zpool_events(cache: ZFSCache) -> None:
+    skip = len(list(parse_zpool_events(sh.zpool.events("-H", "-v", _iter=True))))
+    pending: deque = deque()
+    wakeup = threading.Event()
+
+    def _refresher():
+        cache.loaded.wait()
+        while True:
+            wakeup.wait()
+            time.sleep(0.1)
+            wakeup.clear()
+            targets = set()
+            while pending:
+                targets.add(pending.popleft())
+            for pool, dataset in sorted(targets, key=lambda _: (_[0], _[1] or "")):
+                if dataset is None:
+                    cache.refresh_pool(pool)
+                    continue
+                covered = [
+                    _
+                    for _pool, _ in targets
+                    if _ is not None
+                    and _ != dataset
+                    and (dataset.startswith(_ + "/") or dataset.startswith(_ + "@"))
+                ]
+                if not covered:
+                    cache.refresh_dataset(dataset)
+
+    threading.Thread(target=_refresher, daemon=True).start()
+    for index, event in enumerate(
+        parse_zpool_events(sh.zpool.events("-f", "-H", "-v", _iter=True))
+    ):
+        if index < skip:
+            continue
+        ic(event)
+        pool = event.get("pool", event.get("pool_name"))
+        if pool is None:
+            continue
+        pending.append((pool, None))
+        for dataset in zpool_event_datasets(event):
+            pending.append((pool, dataset))
+        wakeup.set()
+
+
+class ZFSCacheRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.cache.query(json.loads(line))
+            except (ValueError, KeyError, TypeError) as e:
+                response = {"ok": False, "error": repr(e)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+# not inherited by children, per zfsprops(7)
+NON_INHERITABLE_PROPERTIES = {
+    "canmount",
+    "filesystem_limit",
+    "keyformat",
+    "keylocation",
+    "pbkdf2iters",
+    "quota",
+    "refquota",
+    "refreservation",
+    "reservation",
+    "snapshot_limit",
+    "volblocksize",
+    "volsize",
+}
+
+
+class DatasetNode:
+    # component is interned, snapshots are children named "@snap"
+    # properties is None or an interned tuple of (property_id, value_id, source_id) triples
+    __slots__ = ("component", "parent", "children", "properties")
+
+    def __init__(self, component: str, parent: None | DatasetNode):
+        self.component = component
+        self.parent = parent
+        self.children: None | dict[str, DatasetNode] = None
+        self.properties: None | tuple[int, ...] = None
+
+
+class DatasetTree:
+    # dataset/snapshot trie holding only local and received values, inheritance resolved here
+    SOURCES = ["local", "received"]
+
+    def __init__(self):
+        self.roots: dict[str, DatasetNode] = {}
+        self.strings: list[str] = []
+        self.string_ids: dict[str, int] = {}
+        self.property_sets: dict[tuple[int, ...], tuple[int, ...]] = {}
+        self.count = 0
+
+    def _string_id(self, string: str) -> int:
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(string)
+            self.string_ids[string] = string_id
+        return string_id
+
+    @staticmethod
+    def split(name: str) -> list[str]:
+        dataset, _, snapshot = name.partition("@")
+        components = dataset.split("/")
+        if snapshot:
+            components.append("@" + snapshot)
+        return components
+
+    def find(self, name: str) -> None | DatasetNode:
+        components = self.split(name)
+        node = self.roots.get(components[0])
+        for component in components[1:]:
+            if node is None or node.children is None:
+                return None
+            node = node.children.get(component)
+        return node
+
+    def add(self, name: str) -> DatasetNode:
+        components = self.split(name)
+        node = self.roots.get(components[0])
+        if node is None:
+            node = DatasetNode(sys.intern(components[0]), None)
+            self.roots[node.component] = node
+            self.count += 1
+        for component in components[1:]:
+            if node.children is None:
+                node.children = {}
+            child = node.children.get(component)
+            if child is None:
+                child = DatasetNode(sys.intern(component), node)
+                node.children[child.component] = child
+                self.count += 1
+            node = child
+        return node
+
+    def set(self, name: str, prop: str, value: str, source: str = "local") -> None:
+        node = self.add(name)
+        property_id = self._string_id(prop)
+        entry = (property_id, self._string_id(value), self.SOURCES.index(source))
+        properties = node.properties or ()
+        for index in range(0, len(properties), 3):
+            if properties[index] == property_id:
+                if source == "received" and properties[index + 2] == 0:
+                    return  # a local value overrides the received one
+                properties = properties[:index] + entry + properties[index + 3 :]
+                break
+        else:
+            properties = properties + entry
+        # identical property sets (every snapshot of a series, say) share one tuple
+        node.properties = self.property_sets.setdefault(properties, properties)
+
+    def load_zfs_get(self, lines: Iterable[str]) -> None:
+        # zfs get -H -p -o name,property,value,source -s local,received
+        for line in lines:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 4:
+                continue
+            self.set(fields[0], fields[1], fields[2], fields[3])
+
+    @classmethod
+    def load(cls, datasets: Iterable[str] = ()) -> DatasetTree:
+        tree = cls()
+        tree.load_zfs_get(
+            sh.zfs.get(
+                "-H",
+                "-p",
+                "-o",
+                "name,property,value,source",
+                "-s",
+                "local,received",
+                "-r",
+                "all",
+                *datasets,
+                _iter=True,
+            )
+        )
+        # datasets with nothing set locally are not in the zfs get output
+        tree.load_names(
+            sh.zfs.list(
+                "-H", "-o", "name", "-t", "all", "-r", *datasets, _iter=True
+            )
+        )
+        return tree
+
+    def load_names(self, names: Iterable[str]) -> None:
+        for name in names:
+            self.add(name.strip())
+
+    def name(self, node: DatasetNode) -> str:
+        components = []
+        while node is not None:
+            components.append(node.component)
+            node = node.parent
+        name = ""
+        for component in reversed(components):
+            if not name or component.startswith("@"):
+                name += component
+            else:
+                name += "/" + component
+        return name
+
+    def local(self, node: DatasetNode, prop: str) -> None | tuple[str, str]:
+        property_id = self.string_ids.get(prop)
+        if property_id is None or node.properties is None:
+            return None
+        for index in range(0, len(node.properties), 3):
+            if node.properties[index] == property_id:
+                return (
+                    self.strings[node.properties[index + 1]],
+                    self.SOURCES[node.properties[index + 2]],
+                )
+        return None
+
+    def get(self, name: str, prop: str) -> tuple[None | str, str]:
+        # (value, source) with zfs get style sources, value None means the zfs default
+        node = self.find(name)
+        if node is None:
+            raise KeyError(name)
+        is_snapshot = node.component.startswith("@")
+        if is_snapshot and prop == "mountpoint":
+            return None, "-"
+        local = self.local(node, prop)
+        if local is not None:
+            return local
+        if prop in NON_INHERITABLE_PROPERTIES:
+            return None, "-" if is_snapshot else "default"
+
+        relative: list[str] = []
+        ancestor = node
+        while ancestor.parent is not None:
+            if not ancestor.component.startswith("@"):
+                relative.append(ancestor.component)
+            ancestor = ancestor.parent
+            local = self.local(ancestor, prop)
+            if local is None:
+                continue
+            value, _ = local
+            source = "inherited from " + self.name(ancestor)
+            if prop == "mountpoint" and value.startswith("/"):
+                value = value.rstrip("/") + "/" + "/".join(reversed(relative))
+            return value, source
+        if prop == "mountpoint":
+            return "/" + name, "default"
+        return None, "default"
+
+    def iter_subtree(
+        self, name: str, *, snapshots: bool = True
+    ) -> Iterator[DatasetNode]:
+        node = self.find(name)
+        if node is None:
+            raise KeyError(name)
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.children:
+                for child in node.children.values():
+                    if snapshots or not child.component.startswith("@"):
+                        stack.append(child)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, name: str) -> bool:
+        return self.find(name) is not None
+
+
+PCI_ADDRESS_RE = re.compile(r"^[0-9a-f]{4}:[0-9a-f]{2}:[0-9a-f]{2}\.[0-9a-f]$")
+
+
+def block_device_controller(device: Path) -> str:
+    # the PCI function the disk hangs off, devices without one (loop, dm) are "virtual:<name>",
+    # each its own group since nothing says they share a bus
+    name = Path(os.path.realpath(device)).name
+    sys_device = Path(f"/sys/class/block/{name}/device")
+    if not sys_device.exists():
+        return "virtual:" + name
+    controller = "virtual:" + name
+    for component in Path(os.path.realpath(sys_device)).parts:
+        if PCI_ADDRESS_RE.match(component):
+            controller = component
+    return controller
+
+
+def probe_block_device(
+    device: Path,
+    *,
+    seconds: float,
+    sequential_block_size: int = 1 << 20,
+    random_block_size: int = 4096,
+) -> dict:
+    size = get_block_device_size(device)
+    assert size >= sequential_block_size
+    direct = True
+    try:
+        fd = os.open(device, os.O_RDONLY | os.O_DIRECT)
+    except OSError as e:
+        if e.errno != errno.EINVAL:  # tmpfs backed loop devices
+            raise
+        direct = False
+        fd = os.open(device, os.O_RDONLY)
+    try:
+        # O_DIRECT needs aligned buffers, anonymous mmaps are page aligned
+        with mmap.mmap(-1, sequential_block_size) as buffer:
+            if not direct:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            offset = 0
+            total = 0
+            start = time.monotonic()
+            while (elapsed := time.monotonic() - start) < seconds:
+                if offset + sequential_block_size > size:
+                    offset = 0
+                count = os.preadv(fd, [buffer], offset)
+                assert count > 0
+                offset += count
+                total += count
+            sequential = total / elapsed
+
+            if not direct:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            view = memoryview(buffer)[:random_block_size]
+            blocks = size // random_block_size
+            rng = random.Random(device.as_posix())
+            operations = 0
+            start = time.monotonic()
+            while (elapsed := time.monotonic() - start) < seconds:
+                os.preadv(fd, [view], rng.randrange(blocks) * random_block_size)
+                operations += 1
+            view.release()
+            iops = operations / elapsed
+    finally:
+        os.close(fd)
+    return {
+        "device": device.as_posix(),
+        "controller": block_device_controller(device),
+        "size": size,
+        "direct": direct,
+        "sequential_bytes_per_second": int(sequential),
+        "random_iops": int(iops),
+    }
+
+
+def benchmark_block_devices(
+    devices: Iterable[Path],
+    *,
+    seconds: float,
+    per_controller: None | int = None,
+    stagger: float = 0.25,
+) -> list[dict]:
+    # controllers run in parallel, devices behind one controller start stagger seconds apart
+    # and all run at once unless per_controller caps them (a saturated HBA makes disks look slow)
+    controllers: dict[str, list[Path]] = {}
+    for device in devices:
+        controllers.setdefault(block_device_controller(device), []).append(device)
+
+    def _controller(controller_devices: list[Path]) -> list[tuple]:
+        jobs = per_controller or len(controller_devices)
+
+        def _probe(indexed: tuple[int, Path]) -> dict:
+            index, device = indexed
+            if index < jobs:  # the first wave, later devices wait for a free slot anyway
+                time.sleep(index * stagger)
+            return probe_block_device(device, seconds=seconds)
+
+        return list(parallel_imap(_probe, enumerate(controller_devices), jobs=jobs))
+
+    results = []
+    for _, probes, exception in parallel_imap(
+        _controller, controllers.values(), jobs=len(controllers)
+    ):
+        if exception is not None:
+            raise exception
+        for _, result, probe_exception in probes:
+            if probe_exception is not None:
+                raise probe_exception
+            results.append(result)
+    return results
+
+
+def block_device_outliers(results: list[dict], *, tolerance: float) -> list[dict]:
+    # devices below (1 - tolerance) times the median of the other devices, per metric
+    outliers = []
+    for result in results:
+        others = [_ for _ in results if _ is not result]
+        if not others:
+            continue
+        for metric in ["sequential_bytes_per_second", "random_iops"]:
+            median = statistics.median([_[metric] for _ in others])
+            ratio = result[metric] / median if median else 1.0
+            result[metric + "_ratio"] = round(ratio, 3)
+            if ratio < 1 - tolerance:
+                outliers.append(
+                    {"device": result["device"], "metric": metric, "ratio": round(ratio, 3)}
+                )
+    return outliers
+
+
+def parse_zfs_send_estimate(zfs_send_output: str) -> int:
+    # zfs send -n -v -P, the last "size\t<bytes>" line is the total
+    size = None
+    for line in zfs_send_output.splitlines():
+        fields = line.split("\t")
+        if fields[0] == "size":
+            size = int(fields[1])
+    if size is None:
+        raise ValueError(f"no size in zfs send output: {zfs_send_output!r}")
+    return size
+
+
+def plan_sends(
+    entries: list[dict[str, str]],
+    *,
+    from_snapshot: None | str,
+    to_snapshot: None | str,
+) -> list[tuple[str, None | str, str, None | str]]:
+    # entries: zfs list -o name,type,createtxg rows
+    # returns (dataset, from snapshot or None for a full send, to snapshot, error) per dataset,
+    # only a dataset without the from snapshot gets a full send
+    snapshots: dict[str, list[tuple[int, str]]] = {}
+    for entry in entries:
+        if entry["type"] == "snapshot":
+            dataset, _, short_name = entry["name"].partition("@")
+            snapshots.setdefault(dataset, []).append((int(entry["createtxg"]), short_name))
+        else:
+            snapshots.setdefault(entry["name"], [])
+
+    plan = []
+    for dataset, dataset_snapshots in snapshots.items():
+        dataset_snapshots.sort()
+        names = [_ for __, _ in dataset_snapshots]
+        if not names:
+            continue
+        to_name = to_snapshot or names[-1]
+        if to_name not in names:
+            continue
+        if from_snapshot not in names:
+            plan.append((dataset, None, to_name, None))
+        elif names.index(from_snapshot) < names.index(to_name):
+            plan.append((dataset, from_snapshot, to_name, None))
+        else:
+            plan.append(
+                (dataset, from_snapshot, to_name, f"@{from_snapshot} is not older than @{to_name}")
+            )
+    return plan
+
+
+class ContentDefinedChunker:
+    # bytes are mapped through a fixed random table to one bit each and a boundary is the end
+    # of run_length consecutive set bits, so boundaries only depend on the last run_length bytes
+    # translate() and find() do the scanning in C, the mean chunk is about 2 ** (run_length + 1)
+    def __init__(self, *, run_length: int, min_size: int, max_size: int, seed: int):
+        assert run_length < min_size < max_size
+        bits = [1] * 128 + [0] * 128
+        random.Random(seed).shuffle(bits)
+        self.table = bytes(bits)
+        self.pattern = b"\x01" * run_length
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def _boundary(self, classified: bytes, start: int, *, final: bool) -> None | int:
+        limit = min(start + self.max_size, len(classified))
+        search_from = max(start + self.min_size - len(self.pattern), start)
+        index = classified.find(self.pattern, search_from, limit)
+        if index != -1:
+            return index + len(self.pattern)
+        if limit == start + self.max_size or (final and limit > start):
+            return limit
+        return None
+
+    def chunks(self, blocks: Iterable[bytes]) -> Iterator[bytes]:
+        buffer = bytearray()
+        for block in blocks:
+            buffer += block
+            classified = buffer.translate(self.table)
+            start = 0
+            while (end := self._boundary(classified, start, final=False)) is not None:
+                yield bytes(buffer[start:end])
+                start = end
+            del buffer[:start]
+        classified = buffer.translate(self.table)
+        start = 0
+        while (end := self._boundary(classified, start, final=True)) is not None:
+            yield bytes(buffer[start:end])
+            start = end
+
+
+class ChunkStore:
+    # <path>/config.json, <path>/chunks/ab/abcd... (zlib), <path>/streams/<name>.json manifests
+    DEFAULT_CONFIG = {
+        "version": 1,
+        "hash": "sha256",
+        "compression": "zlib",
+        "run_length": 19,  # ~1MiB chunks
+        "min_size": 1 << 18,
+        "max_size": 1 << 23,
+        "seed": 0x5A17,
+    }
+
+    def __init__(self, path: Path, *, create: bool = False):
+        self.path = path
+        config_path = path / Path("config.json")
+        if not config_path.exists():
+            assert create, f"{path} is not a chunk store"
+            write_file_atomic(
+                config_path, json.dumps(self.DEFAULT_CONFIG, indent=2).encode()
+            )
+        self.config = json.loads(config_path.read_text())
+        assert self.config["version"] == 1
+        (path / Path("chunks")).mkdir(exist_ok=True)
+        (path / Path("streams")).mkdir(exist_ok=True)
+
+    def chunker(self) -> ContentDefinedChunker:
+        return ContentDefinedChunker(
+            run_length=self.config["run_length"],
+            min_size=self.config["min_size"],
+            max_size=self.config["max_size"],
+            seed=self.config["seed"],
+        )
+
+    def chunk_path(self, digest: str) -> Path:
+        return self.path / Path("chunks") / Path(digest[:2]) / Path(digest)
+
+    def put(self, data: bytes) -> tuple[str, int]:
+        # (digest, compressed bytes written, 0 when the chunk was already stored)
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if path.exists():
+            return digest, 0
+        compressed = zlib.compress(data, 3)
+        path.parent.mkdir(exist_ok=True)
+        _fd, _temp = tempfile.mkstemp(dir=path.parent, prefix="." + digest[:8])
+        with os.fdopen(_fd, "wb") as fh:
+            fh.write(compressed)
+        try:
+            os.link(_temp, path)  # of concurrent writers of one chunk exactly one creates it
+        except FileExistsError:
+            return digest, 0
+        finally:
+            os.unlink(_temp)
+        return digest, len(compressed)
+
+    def get(self, digest: str) -> bytes:
+        data = zlib.decompress(self.chunk_path(digest).read_bytes())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"chunk {digest} is corrupt")
+        return data
+
+    def manifest_path(self, snapshot: str, from_snapshot: None | str) -> Path:
+        name = urllib.parse.quote(snapshot, safe="@")
+        if from_snapshot is None:
+            name += ".full"
+        else:
+            name += ".from." + urllib.parse.quote(from_snapshot, safe="@")
+        return self.path / Path("streams") / Path(name + ".json")
+
+    def manifests(self) -> Iterator[tuple[Path, dict]]:
+        for path in sorted((self.path / Path("streams")).glob("*.json")):
+            yield path, json.loads(path.read_text())
+
+    def chunk_digests(self) -> Iterator[str]:
+        for directory in (self.path / Path("chunks")).iterdir():
+            for path in directory.iterdir():
+                if not path.name.startswith("."):
+                    yield path.name
+
+
+def ordered_prefetch(
+    function: Callable,
+    iterable: Iterable,
+    *,
+    jobs: int,
+) -> Iterator:
+    # like executor.map but in order with only jobs * 2 results held at once
+    iterator = iter(iterable)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending: deque = deque(
+            executor.submit(function, _) for _ in islice(iterator, jobs * 2)
+        )
+        while pending:
+            result = pending.popleft().result()
+            for item in islice(iterator, 1):
+                pending.append(executor.submit(function, item))
+            yield result
+
+
+CAPACITY_PROPERTIES = ["quota", "reservation", "refreservation", "refquota"]
+CAPACITY_USAGE_PROPERTIES = [
+    "used",
+    "available",
+    "referenced",
+    "usedbydataset",
+    "usedbychildren",
+    "usedbysnapshots",
+    "usedbyrefreservation",
+]
+
+
+def zfs_capacity_state(pool: str) -> tuple[dict[str, None | int], dict[str, dict[str, int]]]:
+    # one zpool list and one zfs list, "none"/"-" become 0
+    pool_fields = ["name", "size", "allocated", "free", "fragmentation", "capacity"]
+    _result = sh.zpool.list("-H", "-p", "-o", ",".join(pool_fields), pool)
+    pool_row = dict(zip(pool_fields, str(_result).strip().split("\t")))
+    pool_state = {key: parse_size(value.rstrip("%")) for key, value in pool_row.items() if key != "name"}
+
+    rows = zfs_list(
+        ["name"] + CAPACITY_USAGE_PROPERTIES + CAPACITY_PROPERTIES,
+        "-r",
+        "-t",
+        "filesystem,volume",
+        pool,
+    )
+    datasets = {
+        row["name"]: {key: parse_size(value) or 0 for key, value in row.items() if key != "name"}
+        for row in rows
+    }
+    return pool_state, datasets
+
+
+def parse_capacity_plan(lines: Iterable[str]) -> dict[str, dict[str, int]]:
+    # "tank/a quota=100G reservation=10G" per line, # comments, none clears a value
+    changes: dict[str, dict[str, int]] = {}
+    for line in lines:
+        line = line.split("#")[0].strip()
+        if not line:
+            continue
+        dataset, *assignments = line.split()
+        assert "@" not in dataset
+        for assignment in assignments:
+            prop, _, value = assignment.partition("=")
+            assert prop in CAPACITY_PROPERTIES, prop
+            if value == "auto":  # depends on volsize and zfs internals, not projectable
+                raise ValueError(f"{dataset} {assignment}: auto is not supported, give a size")
+            try:
+                changes.setdefault(dataset, {})[prop] = parse_size(value) or 0
+            except (ValueError, KeyError) as e:
+                raise ValueError(f"{dataset} {assignment}: not a size") from e
+    return changes
+
+
+def capacity_projection(
+    pool: str,
+    datasets: dict[str, dict[str, int]],
+    changes: dict[str, dict[str, int]],
+) -> dict:
+    # a dataset's used leaves out its own reservation, its parent is charged
+    # max(used, reservation), so the changed datasets and their ancestors are
+    # recomputed bottom up, a child reservation inside an ancestor's unused
+    # reservation then adds nothing
+    root = datasets[pool]
+    usable = root["used"] + root["available"]
+    empty = {_: 0 for _ in CAPACITY_USAGE_PROPERTIES + CAPACITY_PROPERTIES}
+
+    def _lineage(name: str) -> list[str]:  # name, parent, ..., pool
+        return [name.rsplit("/", _)[0] for _ in range(name.count("/") + 1)]
+
+    affected = {_ for name in changes for _ in _lineage(name)}
+    children_delta = {_: 0 for _ in affected}
+    delta = 0
+    for name in sorted(affected, key=lambda _: -_.count("/")):
+        current = datasets.get(name, empty)  # a dataset that does not exist yet
+        new = {**current, **changes.get(name, {})}
+        used = (
+            current["usedbydataset"]
+            + current["usedbysnapshots"]
+            + current["usedbychildren"]
+            + children_delta[name]
+            + max(new["refreservation"] - current["referenced"], 0)
+        )
+        charged = max(used, new["reservation"]) - max(current["used"], current["reservation"])
+        if name == pool:
+            delta = charged
+        else:
+            children_delta[name.rpartition("/")[0]] += charged
+    projected_used = root["used"] + delta
+
+    # a quota below another quota is already bounded by it
+    quotas = {
+        name: changes.get(name, {}).get("quota", datasets.get(name, empty)["quota"])
+        for name in set(datasets) | set(changes)
+    }
+    headroom = 0
+    for name, quota in quotas.items():
+        if quota and not any(quotas.get(_) for _ in _lineage(name)[1:]):
+            headroom += max(quota - datasets.get(name, empty)["used"], 0)
+    unbounded = sum(
+        1 for name in quotas if not any(quotas.get(_) for _ in _lineage(name))
+    )
+
+    return {
+        "usable": usable,
+        "used": root["used"],
+        "projected_used": projected_used,
+        "fill": round(root["used"] / usable, 4),
+        "projected_fill": round(projected_used / usable, 4),
+        "quota_worst_case_fill": round((projected_used + headroom) / usable, 4),
+        "datasets_without_quota": unbounded,
+    }
+
+
+def capacity_fill_limit(
+    fragmentation: None | int,
+    *,
+    fill_threshold: float,
+    fragmentation_margin: float,
+) -> float:
+    # allocation slows down sooner on a fragmented pool, so leave more room
+    if fragmentation is not None and fragmentation >= 50:
+        return fill_threshold - fragmentation_margin
+    return fill_threshold
+
+
+def capacity_plan_refused(projection: dict, limit: float) -> bool:
+    # only plans that commit more space are refused, quota changes and shrinking
+    # reservations are what a pool already past the limit needs
+    return projection["projected_used"] > projection["used"] and projection["projected_fill"] > limit
+
+
+@click.group(no_args_is_help=True, cls=AHGroup)
+@click_add_options(click_global_options)
+@click.pass_context
+def cli(
+    ctx,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+):
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+
+@cli.command()
+@click_add_options(click_global_options)
+@click.pass_context
+def zfs_check_mountpoints(
+    ctx,
+    *,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+):
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    response = daemon_request({"op": "property", "property": "mountpoint"})
+    if response is not None:
+        mountpoints = response["value"]
+    else:
+        _result = sh.zfs.get("-H", "-o", "name,value", "mountpoint")
+        mountpoints = dict(_.split("\t", 1) for _ in _result.splitlines())
+    ic(mountpoints)
+
+    for zfs_path, mountpoint in mountpoints.items():
+        if mountpoint.startswith("none"):
+            continue
+        if mountpoint.startswith("-"):  # snapshot
+            assert "@" in zfs_path
+            continue
+        assert mountpoint.startswith("/")
+        ic(zfs_path, mountpoint)
+        assert zfs_path == mountpoint[1:]
+
+
+@cli.command()
+@click.argument(
+    "devices",
+    required=True,
+    nargs=-1,
+    type=click.Path(
+        exists=False,
+        dir_okay=False,
+        file_okay=True,
+        allow_dash=False,
+        path_type=Path,
+    ),
+)
+@click.option("--force", is_flag=True, required=False)
+@click.option("--raid", is_flag=False, required=True, type=click.Choice(RAID_LIST))
+@click.option("--raid-group-size", is_flag=False, required=True, type=int)
+@click.option("--pool-name", is_flag=False, required=True, type=str)
+@click.option(
+    "--mount-point",
+    is_flag=False,
+    required=True,
+    type=click.Path(
+        exists=True,
+        dir_okay=True,
+        file_okay=False,
+        allow_dash=False,
+        path_type=Path,
+    ),
+)
+@click_add_options(click_global_options)
+@click.pass_context
+def write_zfs_root_filesystem_on_devices(
+    ctx,
+    *,
+    devices: tuple[Path, ...],
+    force: bool,
+    raid: str,
+    raid_group_size: int,
+    pool_name: str,
+    mount_point: Path,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+):
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+    devices = tuple([Path(_device) for _device in devices])
+
+    # https://raw.githubusercontent.com/ryao/zfs-overlay/master/zfs-install
+    run_command("modprobe zfs || exit 1", verbose=True)
+
+    for device in devices:
+        assert path_is_block_special(device)
+        assert not block_special_path_is_mounted(
+            device,
+        )
+        if not Path(device).name.startswith("nvme"):
+            assert not device.name[-1].isdigit()
+
+    # assert raid_group_size >= 2
+    assert len(devices) >= raid_group_size
+
+    device_string = ""
+    if len(devices) == 1:
+        assert raid == "disk"
+        device_string = devices[0].as_posix()
+
+    if len(devices) > 1:
+        assert raid == "mirror"
+        assert len(devices) % 2 == 0
+
+    if len(devices) == 2:
+        assert raid == "mirror"
+        device_string = "mirror " + devices[0].as_posix() + " " + devices[1].as_posix()
+
+    # striped mirror raid10
+    if len(devices) > 2:
+        for pair in grouper(devices, raid_group_size):
+            device_string = device_string + "mirror " + pair[0] + " " + pair[1] + " "
+            eprint("device_string:", device_string)
+    assert device_string != ""
+
+    assert len(pool_name) > 2
+
+    # -o feature@filesystem_limits=enabled \
+    zpool_command = (
+        """
+    zpool create \
+    -f \
+    -o feature@async_destroy=enabled \
+    -o feature@blake3=enabled \
+    -o feature@block_cloning=enabled \
+    -o feature@bookmarks=enabled \
+    -o feature@bookmark_v2=enabled \
+    -o feature@bookmark_written=enabled \
+    -o feature@device_rebuild=enabled \
+    -o feature@embedded_data=enabled \
+    -o feature@empty_bpobj=enabled \
+    -o feature@enabled_txg=enabled \
+    -o feature@encryption=enabled \
+    -o feature@extensible_dataset=enabled \
+    -o feature@head_errlog=enabled \
+    -o feature@spacemap_histogram=enabled \
+    -o feature@spacemap_v2=enabled \
+    -o feature@zpool_checkpoint=enabled \
+    -o feature@zstd_compress=enabled \
+    -o cachefile='/tmp/zpool.cache'\
+    -O atime=off \
+    -O compression=zstd \
+    -O copies=1 \
+    -O xattr=sa \
+    -O sharesmb=off \
+    -O sharenfs=off \
+    -O checksum=blake3 \
+    -O dedup=off \
+    -O utf8only=off \
+    -m none \
+    -R """
+        + mount_point.as_posix()
+        + " "
+        + pool_name
+        + " "
+        + device_string
+    )
+
+    run_command(zpool_command, verbose=True)
+
+    # Create rootfs
+    run_command("zfs create -o mountpoint=none " + pool_name + "/ROOT", verbose=True)
+    run_command(
+        "zfs create -o mountpoint=/ " + pool_name + "/ROOT/gentoo", verbose=True
+    )
+
+    # Create home directories
+    # zfs create -o mountpoint=/home rpool/HOME
+    # zfs create -o mountpoint=/root rpool/HOME/root
+
+    # Create portage directories
+    # zfs create -o mountpoint=none -o setuid=off rpool/GENTOO
+    # zfs create -o mountpoint=/usr/portage -o atime=off rpool/GENTOO/portage
+    # zfs create -o mountpoint=/usr/portage/distfiles rpool/GENTOO/distfiles
+
+    # Create portage build directory
+    # run_command("zfs create -o mountpoint=/var/tmp/portage -o compression=zstd -o sync=disabled rpool/GENTOO/build-dir")
+
+    # Create optional packages directory
+    # zfs create -o mountpoint=/usr/portage/packages rpool/GENTOO/packages
+
+    # Create optional ccache directory
+    # zfs create -o mountpoint=/var/tmp/ccache -o compression=zstd rpool/GENTOO/ccache
+
+    # Set bootfs
+    run_command(
+        "zpool set bootfs=" + pool_name + "/ROOT/gentoo " + pool_name, verbose=True
+    )
+
+    # zpool.cache and zfs-list.cache into the chroot
+    ctx.invoke(
+        boot_cache,
+        pools=(pool_name,),
+        root=mount_point,
+    )
+
+    # print("done making zfs filesystem, here's what is mounted:")
+    # run_command('mount')
+
+
+@cli.command()
+@click.argument(
+    "devices",
+    required=True,
+    nargs=-1,
+    type=str,
+)
+@click.option("--force", is_flag=True, required=False)
+@click.option("--simulate", is_flag=True, required=False)
+@click.option("--skip-checks", is_flag=True, required=False)
+@click.option("--raid", is_flag=False, required=True, type=click.Choice(RAID_LIST))
+@click.option("--raid-group-size", is_flag=False, required=True, type=int)
+@click.option("--pool-name", is_flag=False, required=True, type=str)
+@click.option("--ashift", is_flag=False, required=False, type=int, help=ASHIFT_HELP)
+@click.option("--encrypt", is_flag=True)
+@click.option(
+    "--benchmark",
+    is_flag=True,
+    help="read benchmark all devices first, refuse slow outliers unless --force",
+)
+@click.option("--benchmark-seconds", type=float, default=10.0, show_default=True)
+@click.option("--benchmark-tolerance", type=float, default=0.25, show_default=True)
+@click.option(
+    "--benchmark-per-controller",
+    type=int,
+    help="devices probed at once behind one controller, default all",
+)
+@click_add_options(click_global_options)
+@click.pass_context
+def create_zfs_pool(
+    ctx,
+    *,
+    devices: tuple[str, ...],
+    force: bool,
+    simulate: bool,
+    skip_checks: bool,
+    raid: str,
+    raid_group_size: int,
+    pool_name: str,
+    ashift: None | int,
+    verbose_inf: bool,
+    dict_output: bool,
+    encrypt: bool,
+    benchmark: bool,
+    benchmark_seconds: float,
+    benchmark_tolerance: float,
+    benchmark_per_controller: None | int,
+    verbose: bool = False,
+):
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    # needed for --simulate
+    devices_pathlib: tuple[Path, ...] = tuple([Path(_device) for _device in devices])
+    del devices
+    devices = devices_pathlib
+    del devices_pathlib
+
+    if ashift:
+        assert ashift >= 9
+        assert ashift <= 16
+        eprint("using block size: {} (ashift={})".format(1 << ashift, ashift))
+
+    if skip_checks:
+        assert simulate
+
+    if benchmark and simulate:  # the devices may not exist
+        eprint("--benchmark reads every device, it can not be used with --simulate/--skip-checks")
+        sys.exit(1)
+
+    if simulate:
+        skip_checks = True
+
+    # https://raw.githubusercontent.com/ryao/zfs-overlay/master/zfs-install
+    run_command(
+        "modprobe zfs || exit 1",
+        verbose=verbose,
+    )
+
+    for device in devices:
+        if not skip_checks:
+            assert path_is_block_special(device, follow_symlinks=True)
+            assert not block_special_path_is_mounted(
+                device,
+            )
+        if not (
+            Path(device).name.startswith("nvme")
+            or Path(device).name.startswith("mmcblk")
+            or Path(device).name.startswith("wwn-")
+        ):
+            assert not device.name[-1].isdigit()
+
+    if not skip_checks:
+        first_device_size = get_block_device_size(
+            devices[0],
+        )
+        for device in devices:
+            assert (
+                get_block_device_size(
+                    device,
+                )
+                == first_device_size
+            )
+
+    if benchmark:
+        results = benchmark_block_devices(
+            devices, seconds=benchmark_seconds, per_controller=benchmark_per_controller
+        )
+        outliers = block_device_outliers(results, tolerance=benchmark_tolerance)
+        for result in results:
+            ic(result)
+        for outlier in outliers:
+            eprint(
+                f"{outlier['device']}: {outlier['metric']} is {outlier['ratio']:.2f}x the other devices"
+            )
+        if outliers and not force:
+            eprint("refusing to create a pool with slow devices, --force to override")
+            sys.exit(1)
+
+    assert raid_group_size >= 1
+    assert len(devices) >= raid_group_size
+
+    device_string = ""
+    if len(devices) == 1:
+        assert raid == "disk"
+        device_string = devices[0].as_posix()
+
+    if len(devices) > 1:
+        if raid in ["raidz3"]:
+            assert len(devices) % 2 == 0
+        assert raid in ["mirror", "raidz3"]
+        assert raid_group_size >= 2
+
+    if len(devices) == 2:
+        assert raid == "mirror"
+        device_string = "mirror " + devices[0].as_posix() + " " + devices[1].as_posix()
+
+    if len(devices) > 2:
+        if raid_group_size == 2:  # striped mirror raid10
+            for pair in grouper(devices, 2):
+                device_string = (
+                    device_string + "mirror " + pair[0] + " " + pair[1] + " "
+                )
+                eprint("device_string:", device_string)
+        elif raid_group_size == 4:
+            for quad in grouper(devices, 4):
+                assert False  # a 4x mirror? or a 2x2 mirror?
+                device_string = (
+                    device_string
+                    + "mirror "
+                    + quad[0]
+                    + " "
+                    + quad[1]
+                    + " "
+                    + quad[2]
+                    + " "
+                    + quad[3]
+                    + " "
+                )
+                eprint("device_string:", device_string)
+        elif raid_group_size in [8, 16]:
+            assert raid in ["raidz3", "mirror"]
+            if raid == "raidz3":
+                device_string = "raidz3"
+            elif raid == "mirror":
+                device_string = "mirror"
+
+            for device in devices:
+                device_string += " " + device.as_posix()
+            eprint("device_string:", device_string)
+        else:
+            if raid == "mirror":
+                device_string = "mirror"
+                for device in devices:
+                    device_string += " " + device.as_posix()
+                eprint("device_string:", device_string)
+            else:
+                print("unknown mode")
+                sys.exit(1)
+
+    assert device_string != ""
+    assert len(pool_name) > 2
+
+    if encrypt:
+        if not simulate:
+            passphrase = passphrase_prompt(
+                "zpool",
+            )
+            passphrase = passphrase.decode("utf8")
+
+    command = "zpool create"
+    command += " -o feature@async_destroy=enabled"  # default Destroy filesystems asynchronously.
+    command += " -o feature@blake3=enabled"
+    command += " -o feature@block_cloning=enabled"
+    command += " -o feature@bookmarks=enabled"  # default "zfs bookmark" command
+    command += " -o feature@bookmark_v2=enabled"  # default
+    command += " -o feature@device_rebuild=enabled"
+    command += " -o feature@embedded_data=enabled"  # default Blocks which compress very well use even less space.
+    command += " -o feature@empty_bpobj=enabled"  # default Snapshots use less space.
+    command += " -o feature@enabled_txg=enabled"  # default   # Record txg at which a feature is enabled
+    command += " -o feature@extensible_dataset=enabled"  # default   # Enhanced dataset functionality.
+    command += " -o feature@head_errlog=enabled"
+    command += " -o feature@spacemap_histogram=enabled"  # default   # Spacemaps maintain space histograms.
+    command += " -o feature@spacemap_v2=enabled"  # default
+    command += " -o feature@zpool_checkpoint=enabled"  # default
+    command += (
+        " -o feature@large_dnode=enabled"  # default  Variable on-disk size of dnodes.
+    )
+    command += " -o feature@large_blocks=enabled"  # default  Support for blocks larger than 128KB.
+    command += " -o feature@zstd_compress=enabled"  # default (independent of the zfs compression flag)
+    if ashift:
+        command += f" -o ashift={ashift}"
+    command += " -o listsnapshots=on"
+
+    if encrypt:
+        command += " -o feature@encryption=enabled"
+        command += " -O encryption=aes-256-gcm"
+        command += " -O keyformat=passphrase"
+        command += " -O keylocation=prompt"
+        command += " -O pbkdf2iters=560000"
+        command += " -O checksum=blake3"
+    else:
+        command += " -O checksum=fletcher4"  # default
+
+    command += " -O atime=off"  # (dont write when reading)
+    command += " -O compression=zstd"  # (better than lzjb)
+    command += " -O copies=1"
+    command += " -O xattr=off"  # (sa is better than on)
+    command += " -O sharesmb=off"
+    command += " -O sharenfs=off"
+    command += " -O dedup=off"  # default
+    command += " -O utf8only=off"  # default
+    command += " -O mountpoint=none"  # dont mount raw zpools
+    command += " -O setuid=off"  # only needed on rootfs
+    command += " " + pool_name + " " + device_string
+
+    ic(command)
+    if not simulate:
+        # stdin = None
+        # if encrypt:
+        #    stdin = passphrase
+        os.system(command)
+
+
+@cli.command()
+@click.argument("pool", required=True, nargs=1)
+@click.argument("name", required=True, nargs=1)
+@click.option(
+    "--simulate",
+    is_flag=True,
+    help="print the destroy plan",
+)
+@click.option(
+    "--recursive",
+    is_flag=True,
+    help="destroy all children and snapshots, leaves first, in parallel",
+)
+@click.option("--jobs", type=int, default=8, show_default=True)
+@click.option("--snapshot-batch", type=int, default=256, show_default=True)
+@click_add_options(click_global_options)
+@click.pass_context
+def zfs_filesystem_destroy(
+    ctx,
+    pool: str,
+    name: str,
+    simulate: bool,
+    recursive: bool,
+    jobs: int,
+    snapshot_batch: int,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    assert "/" not in pool
+    assert not name.startswith("/")
+    assert len(pool.split()) == 1
+    assert len(name.split()) == 1
+    assert len(name) > 2
+    filesystem = pool + "/" + name
+
+    list_args = ["-t", "filesystem,volume,snapshot", filesystem]
+    if recursive:
+        list_args = ["-r"] + list_args
+    entries = zfs_list(
+        ["name", "type", "used", "createtxg", "clones", "mountpoint", "mounted"],
+        *list_args,
+    )
+    datasets = [_ for _ in entries if _["type"] != "snapshot"]
+    eprint(f"{filesystem}: {len(entries)} datasets and snapshots, ~{entries[0]['used']} bytes to free")
+
+    mounted = {
+        _["mountpoint"]: _["name"]
+        for _ in datasets
+        if _["mounted"] == "yes" and _["mountpoint"].startswith("/")
+    }
+    busy = processes_using_mountpoints(mounted.keys())
+    busy_pids = {mounted[mountpoint]: sorted(pids) for mountpoint, pids in busy.items()}
+    for mountpoint, pids in busy.items():
+        eprint(f"{mounted[mountpoint]} is busy at {mountpoint}, pids: {sorted(pids)}")
+    if busy and not simulate:
+        sys.exit(1)
+
+    if not recursive:
+        if simulate:
+            print(f"zfs destroy {filesystem}")
+            if busy:
+                eprint(f"{filesystem}: busy, a real run would refuse")
+            return
+        sh.zfs.destroy(filesystem, _fg=True)
+        return
+
+    dependencies = plan_recursive_destroy(entries, snapshot_batch=snapshot_batch)
+    if simulate:
+        levels = dependency_levels(dependencies)
+        for target in sorted(dependencies, key=lambda _: (levels[_], _)):
+            output(
+                {"step": levels[target], "destroy": target, "busy_pids": busy_pids.get(target, [])},
+                reason=None,
+                dict_output=dict_output,
+                tty=tty,
+            )
+        if busy:
+            eprint(f"{filesystem}: {len(busy)} busy mountpoints, a real run would refuse")
+        return
+
+    # children before parents, so no parent unmount finds a mounted child
+    for mountpoint in sorted(mounted, key=len, reverse=True):
+        sh.zfs.unmount(mounted[mountpoint])
+
+    failed = 0
+    for index, (target, _, exception) in enumerate(
+        run_dependency_graph(
+            dependencies,
+            lambda _: sh.zfs.destroy(_),
+            jobs=jobs,
+        ),
+        start=1,
+    ):
+        if exception is not None:
+            failed += 1
+            eprint(f"[{index}/{len(dependencies)}] {target}: {exception}")
+            continue
+        eprint(f"[{index}/{len(dependencies)}] {target}")
+    if failed:
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument("pool", required=True, nargs=1)
+@click.argument("name", required=True, nargs=1)
+@click.option(
+    "--simulate",
+    is_flag=True,
+)
+@click.option(
+    "--encrypt",
+    is_flag=True,
+)
+@click.option(
+    "--nfs-subnet",
+    type=str,
+)
+@click.option(
+    "--exec",
+    "exe",
+    is_flag=True,
+)
+@click.option(
+    "--nomount",
+    is_flag=True,
+)
+@click.option(
+    "--reservation",
+    type=str,
+)
+@click_add_options(click_global_options)
+@click.pass_context
+def create_zfs_filesystem(
+    ctx,
+    pool: str,
+    name: str,
+    simulate: bool,
+    encrypt: bool,
+    nfs_subnet: str,
+    exe: bool,
+    nomount: bool,
+    verbose_inf: bool,
+    reservation: str,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+    ic()
+
+    assert "/" not in pool
+    assert not name.startswith("/")
+    assert len(pool.split()) == 1
+    assert len(name.split()) == 1
+    assert len(name) > 2
 
     # https://raw.githubusercontent.com/ryao/zfs-overlay/master/zfs-install
-    run_command(
-        "modprobe zfs || exit 1",
+    # run_command("modprobe zfs || exit 1")
+
+    command = "zfs create -o setuid=off -o devices=off"
+    if encrypt:
+        command += " -o encryption=aes-256-gcm"
+        command += " -o keyformat=passphrase"
+        command += " -o keylocation=prompt"
+
+    if exe:
+        command += " -o exec=on"
+    else:
+        command += " -o exec=off"
+
+    if reservation:
+        try:
+            reservation_bytes = parse_size(reservation) or 0
+        except (ValueError, KeyError):
+            eprint(f"--reservation {reservation}: not a size")
+            sys.exit(1)
+        command += " -o reservation=" + reservation
+        if not simulate:
+            pool_state, datasets = zfs_capacity_state(pool)
+            projection = capacity_projection(
+                pool,
+                datasets,
+                {pool + "/" + name: {"reservation": reservation_bytes}},
+            )
+            limit = capacity_fill_limit(
+                pool_state["fragmentation"],
+                fill_threshold=0.8,
+                fragmentation_margin=0.1,
+            )
+            if capacity_plan_refused(projection, limit):
+                eprint(
+                    f"reservation={reservation} takes {pool} to {projection['projected_fill']:.1%} committed, limit is {limit:.1%}, see capacity-plan"
+                )
+                sys.exit(1)
+
+    if not nomount:
+        command += " -o mountpoint=/" + pool + "/" + name
+
+    command += " " + pool + "/" + name
+
+    if verbose or simulate:
+        ic(command)
+
+    if not simulate:
+        run_command(command, verbose=True, expected_exit_status=0)
+
+    if nfs_subnet:
+        ctx.invoke(
+            zfs_set_sharenfs,
+            pool=pool,
+            name=name,
+            subnet=nfs_subnet,
+            simulate=simulate,
+        )
+
+
+@cli.command()
+@click.argument("path", required=True, nargs=1)
+@click.option(
+    "--simulate",
+    is_flag=True,
+)
+@click_add_options(click_global_options)
+@click.pass_context
+def create_zfs_filesystem_snapshot(
+    ctx,
+    *,
+    path: str,
+    simulate: bool,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    assert not path.startswith("/")
+    assert len(path.split()) == 1
+    assert len(path) > 3
+
+    timestamp = str(int(float(get_timestamp())))
+    snapshot_path = path + f"@__{timestamp}"
+    command = sh.zfs.snapshot.bake(snapshot_path)
+
+    if verbose or simulate:
+        ic(command)
+
+    if not simulate:
+        command()
+
+
+@cli.command()
+@click.argument("pool", required=True, nargs=1)
+@click.argument("name", required=True, nargs=1)
+@click.argument("subnet", required=True, nargs=1)
+@click.option(
+    "--no-root-write",
+    is_flag=True,
+)
+@click.option(
+    "--off",
+    is_flag=True,
+)
+@click.option(
+    "--simulate",
+    is_flag=True,
+)
+@click_add_options(click_global_options)
+@click.pass_context
+def zfs_set_sharenfs(
+    ctx,
+    *,
+    pool: str,
+    name: str,
+    subnet: str,
+    off: bool,
+    no_root_write: bool,
+    simulate: bool,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+):
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+    maxone([off, no_root_write])
+
+    filesystem = pool + "/" + name
+
+    assert not filesystem.startswith("/")
+    assert len(filesystem.split()) == 1
+    assert len(filesystem.split()) == 1
+    assert len(filesystem) > 2
+
+    if verbose:
+        eprint(sh.zfs.get("sharenfs", filesystem))
+
+    if off:
+        disable_nfs_command = sh.zfs.set.bake("sharenfs=off", filesystem)
+        if simulate:
+            print(disable_nfs_command)
+        else:
+            disable_nfs_command()
+        return
+
+    sharenfs_list = [
+        "sync",
+        "wdelay",
+        "hide",
+        "crossmnt",
+        "secure",
+        "no_all_squash",
+        "no_subtree_check",
+        "secure_locks",
+        "mountpoint",
+        "anonuid=65534",
+        "anongid=65534",
+        "sec=sys",
+    ]
+    # these cause zfs set sharenfs= command to fail:
+    # ['acl', 'no_pnfs']
+
+    assert "/" in subnet
+    sharenfs_list.append("rw=" + subnet)
+
+    if no_root_write:
+        sharenfs_list.append("root_squash")
+    else:
+        sharenfs_list.append("no_root_squash")
+
+    sharenfs_line = ",".join(sharenfs_list)
+    ic(sharenfs_line)
+
+    # sharenfs_line = 'sharenfs=*(' + sharenfs_line + ')'
+    sharenfs_line = "sharenfs=" + sharenfs_line
+    ic(sharenfs_line)
+
+    zfs_command = sh.zfs.set.bake(sharenfs_line, filesystem)
+    if simulate:
+        output(
+            zfs_command,
+            reason=None,
+            dict_output=dict_output,
+            tty=tty,
+        )
+    else:
+        output(
+            zfs_command(),
+            reason=None,
+            dict_output=dict_output,
+            tty=tty,
+        )
+
+
+@cli.command()
+@click.argument("dataset", required=True, nargs=1)
+@click.option("--jobs", type=int, default=4, show_default=True)
+@click.option(
+    "--bytes-per-second",
+    type=int,
+    help="total rewrite rate across all jobs",
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(
+        exists=False,
+        dir_okay=False,
+        file_okay=True,
+        allow_dash=False,
+        path_type=Path,
+    ),
+    help="file of completed paths, resumes from it if it exists",
+)
+@click.option(
+    "--include-snapshotted",
+    is_flag=True,
+    help="also rewrite files held by snapshots (doubles their space use)",
+)
+@click.option(
+    "--simulate",
+    is_flag=True,
+)
+@click_add_options(click_global_options)
+@click.pass_context
+def rebalance(
+    ctx,
+    *,
+    dataset: str,
+    jobs: int,
+    bytes_per_second: None | int,
+    checkpoint: None | Path,
+    include_snapshotted: bool,
+    simulate: bool,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    assert not dataset.startswith("/")
+    assert "@" not in dataset
+    assert len(dataset.split()) == 1
+    assert jobs >= 1
+    pool = dataset.split("/")[0]
+
+    assert zfs_get_value(dataset, "mounted") == "yes"
+    mountpoint = Path(zfs_get_value(dataset, "mountpoint"))
+    assert mountpoint.is_absolute()
+    ic(mountpoint)
+
+    # an mtime newer than the snapshot is not enough, appended or partly
+    # rewritten files keep most of their blocks in it
+    created_since_snapshot = None
+    if not include_snapshotted:
+        snapshot = zfs_newest_snapshot(dataset)
+        ic(snapshot)
+        if snapshot is not None:
+            created_since_snapshot = zfs_diff_created_files(snapshot)
+            eprint(f"{len(created_since_snapshot)} files created since {snapshot}")
+
+    done: set[str] = set()
+    if checkpoint and checkpoint.exists():
+        done = {
+            os.fsdecode(_) for _ in checkpoint.read_bytes().split(b"\0") if _
+        }
+        eprint(f"resuming, {len(done)} files already rewritten")
+
+    before = zpool_list_vdevs(pool)
+
+    candidates = rebalance_candidates(
+        mountpoint,
+        created_since_snapshot=created_since_snapshot,
+        done=done,
+    )
+    if simulate:
+        for path, _stat in candidates:
+            output(
+                {"path": path.as_posix(), "size": _stat.st_size},
+                reason=None,
+                dict_output=dict_output,
+                tty=tty,
+            )
+        return
+
+    limiter = ByteRateLimiter(bytes_per_second)
+    checkpoint_lock = threading.Lock()
+    checkpoint_fh = None
+    if checkpoint:
+        checkpoint_fh = open(checkpoint, "ab")
+
+    def _rewrite(candidate):
+        path, _stat = candidate
+        size = rebalance_file(path, expected_stat=_stat, limiter=limiter)
+        if checkpoint_fh:
+            with checkpoint_lock:
+                checkpoint_fh.write(os.fsencode(path) + b"\0")
+                checkpoint_fh.flush()
+        return size
+
+    files = 0
+    failed = 0
+    total_bytes = 0
+    start = time.monotonic()
+    try:
+        for candidate, size, exception in parallel_imap(
+            _rewrite, candidates, jobs=jobs
+        ):
+            path, _ = candidate
+            if exception is not None:
+                failed += 1
+                eprint(f"{path}: {exception}")
+                continue
+            files += 1
+            total_bytes += size
+            if verbose:
+                eprint(f"{path}: {size}")
+    finally:
+        if checkpoint_fh:
+            checkpoint_fh.close()
+
+    elapsed = time.monotonic() - start
+    eprint(
+        f"rewrote {files} files, {total_bytes} bytes in {elapsed:.1f}s, {failed} failed"
+    )
+
+    after = {_["name"]: _ for _ in zpool_list_vdevs(pool)}
+    for vdev in before:
+        output(
+            {
+                "depth": vdev["depth"],
+                "name": vdev["name"],
+                "class": vdev["class"],
+                "size": vdev["size"],
+                "alloc_before": vdev["alloc"],
+                "alloc_after": after.get(vdev["name"], {}).get("alloc"),
+            },
+            reason=None,
+            dict_output=dict_output,
+            tty=tty,
+        )
+
+
+@cli.command()
+@click.argument("pools", required=False, nargs=-1)
+@click.option("--interval", type=float, default=5.0, show_default=True)
+@click.option("--count", type=int, help="stop after this many polls")
+@click.option("--window", type=int, default=60, show_default=True)
+@click.option(
+    "--drop-ratio",
+    type=float,
+    default=0.5,
+    show_default=True,
+    help="look for slow disks when the smoothed rate falls below this fraction of the recent peak",
+)
+@click.option(
+    "--slow-factor",
+    type=float,
+    default=2.0,
+    show_default=True,
+    help="a disk is slow when its disk wait is this many times its siblings median",
+)
+@click.option("--exit-when-idle", is_flag=True)
+@click.option(
+    "--replay",
+    multiple=True,
+    type=click.Path(
+        exists=True,
+        dir_okay=False,
+        file_okay=True,
+        allow_dash=False,
+        path_type=Path,
+    ),
+    help="recorded zpool status -p or -j outputs, one poll per file, --interval seconds apart",
+)
+@click.option(
+    "--replay-iostat",
+    multiple=True,
+    type=click.Path(
+        exists=True,
+        dir_okay=False,
+        file_okay=True,
+        allow_dash=False,
+        path_type=Path,
+    ),
+    help="recorded zpool iostat -v -l -H -p outputs, paired with the --replay files in order",
+)
+@click.option("--json", "json_lines", is_flag=True)
+@click_add_options(click_global_options)
+@click.pass_context
+def watch(
+    ctx,
+    *,
+    pools: tuple[str, ...],
+    interval: float,
+    count: None | int,
+    window: int,
+    drop_ratio: float,
+    slow_factor: float,
+    exit_when_idle: bool,
+    replay: tuple[Path, ...],
+    replay_iostat: tuple[Path, ...],
+    json_lines: bool,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+    assert interval > 0
+    assert 0 < drop_ratio < 1
+    assert len(replay_iostat) <= len(replay)
+
+    histories: dict[tuple, RateHistory] = {}
+
+    def _history(*key) -> RateHistory:
+        if key not in histories:
+            histories[key] = RateHistory(window=window)
+        return histories[key]
+
+    polls = 0
+    start = time.monotonic()
+    while True:
+        if replay:
+            if polls >= len(replay):
+                return
+            status = parse_zpool_status_any(replay[polls].read_text())
+            timestamp = polls * interval
+            iostat: dict[str, list[list[dict]]] = {}
+            if polls < len(replay_iostat):
+                iostat = parse_zpool_iostat(replay_iostat[polls].read_text(), status.keys())
+        else:
+            status = zpool_status(pools)
+            # the iostat interval is also the poll sleep
+            _result = sh.zpool.iostat(
+                "-v", "-l", "-H", "-p", "-y", *status.keys(), int(max(interval, 1)), 1
+            )
+            iostat = parse_zpool_iostat(str(_result), status.keys())
+            timestamp = time.monotonic() - start
+        polls += 1
+
+        busy = False
+        for name, pool in status.items():
+            if pools and name not in pools:
+                continue
+            scan = pool["scan"]
+            in_progress = scan["state"] == "in progress"
+            counter = scan.get("issued", scan.get("scanned"))
+            history = _history(name)
+            if in_progress:
+                history.add(timestamp, counter)
+            remaining = None
+            if counter is not None and scan.get("total") is not None:
+                remaining = max(scan["total"] - counter, 0)
+
+            tree = vdev_tree(pool["config"])
+            iostat_rows = (iostat.get(name) or [[]])[-1]
+            vdevs = []
+            for row in iostat_rows:
+                bandwidth = None
+                if row.get("read_bytes") is not None:
+                    bandwidth = row["read_bytes"] + (row.get("write_bytes") or 0)
+                vdevs.append(
+                    {
+                        "name": row["name"],
+                        "bandwidth": bandwidth,
+                        "smoothed_bandwidth": _history(name, row["name"]).add_rate(
+                            bandwidth
+                        ),
+                    }
+                )
+            for vdev in pool["config"]:
+                if vdev.get("trim_percent") is None or vdev["trim_percent"] >= 100:
+                    continue
+                busy = True
+                trim_history = _history(name, vdev["name"], "trim")
+                trim_history.add(timestamp, vdev["trim_percent"])
+                vdevs.append(
+                    {
+                        "name": vdev["name"],
+                        "trim_percent": vdev["trim_percent"],
+                        "trim_eta_seconds": trim_history.eta(100 - vdev["trim_percent"]),
+                    }
+                )
+
+            slow_devices = []
+            if (
+                in_progress
+                and history.smoothed is not None
+                and history.peak
+                and history.smoothed < drop_ratio * history.peak
+            ):
+                slow_devices = slow_leaf_devices(tree, iostat_rows, factor=slow_factor)
+
+            busy = busy or in_progress
+            record = {
+                "time": time.time() if not replay else timestamp,
+                "pool": name,
+                "state": pool.get("state"),
+                "function": scan["function"],
+                "scan_state": scan["state"],
+                "issued": counter,
+                "total": scan.get("total"),
+                "percent": scan.get("percent"),
+                "rate": history.rate if in_progress else None,
+                "smoothed_rate": history.smoothed if in_progress else None,
+                "peak_rate": history.peak if in_progress else None,
+                "eta_seconds": history.eta(remaining) if in_progress else None,
+                "zpool_eta_seconds": scan.get("eta_seconds"),
+                "slow_devices": slow_devices,
+                "vdevs": vdevs,
+            }
+            if json_lines:
+                print(json.dumps(record), flush=True)
+                continue
+
+            line = f"{name} {pool.get('state')}"
+            if in_progress:
+                line += f" {scan['function']} {record['percent'] or 0:.2f}%"
+                if record["smoothed_rate"] is not None:
+                    line += f" {record['smoothed_rate'] / (1 << 20):.1f}MiB/s"
+                if record["eta_seconds"] is not None:
+                    line += f" eta {int(record['eta_seconds'])}s"
+            for device in slow_devices:
+                line += f" SLOW:{device['vdev']}/{device['name']}"
+            print(line, flush=True)
+
+        if count is not None and polls >= count:
+            return
+        if exit_when_idle and not busy:
+            return
+
+
+@cli.command()
+@click.argument("pool", required=True, nargs=1)
+@click.option("--window", type=int, default=60, show_default=True, help="seconds")
+@click.option(
+    "--latency",
+    type=click.Choice(["disk_wait", "total_wait"]),
+    default="disk_wait",
+    show_default=True,
+)
+@click.option("--min-ops", type=int, default=100, show_default=True)
+@click.option(
+    "--threshold",
+    type=float,
+    default=3.0,
+    show_default=True,
+    help="robust z score (log2 p99 latency vs siblings) to call a disk an outlier",
+)
+@click.option(
+    "--status-file",
+    type=click.Path(
+        exists=True, dir_okay=False, file_okay=True, allow_dash=False, path_type=Path
+    ),
+    help="captured zpool status -p or -j output instead of running zpool status",
+)
+@click.option(
+    "--iostat-file",
+    type=click.Path(
+        exists=True, dir_okay=False, file_okay=True, allow_dash=False, path_type=Path
+    ),
+    help="captured zpool iostat -v -w -H -p -y output instead of sampling",
+)
+@click_add_options(click_global_options)
+@click.pass_context
+def find_slow_disks(
+    ctx,
+    *,
+    pool: str,
+    window: int,
+    latency: str,
+    min_ops: int,
+    threshold: float,
+    status_file: None | Path,
+    iostat_file: None | Path,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+    assert window >= 1
+
+    if status_file:
+        status = parse_zpool_status_any(status_file.read_text())
+    else:
+        status = zpool_status([pool])
+    tree = vdev_tree(status[pool]["config"])
+
+    if iostat_file:
+        iostat_output = iostat_file.read_text()
+    else:
+        eprint(f"sampling {pool} for {window}s")
+        iostat_output = str(
+            sh.zpool.iostat("-v", "-w", "-H", "-p", "-y", pool, window, 1)
+        )
+    samples = parse_zpool_iostat_histograms(iostat_output, pool)
+    assert samples
+
+    columns = [latency + "_read", latency + "_write"]
+    devices = {}
+    for name, node in tree.items():
+        if node["children"] or node["parent"] is None:
+            continue
+        histogram = merge_histograms(
+            sample[name][_] for sample in samples if name in sample for _ in columns
+        )
+        ops = sum(histogram.values())
+        if ops < min_ops:
+            continue
+        devices[name] = {
+            "device": name,
+            "vdev": node["parent"],
+            "ops": ops,
+            "p50": histogram_percentile(histogram, 50),
+            "p99": histogram_percentile(histogram, 99),
+        }
+
+    ranked = []
+    for name, device in devices.items():
+        siblings = [
+            devices[_]["p99"]
+            for _ in tree[device["vdev"]]["children"]
+            if _ != name and _ in devices
+        ]
+        if not siblings:
+            continue
+        # buckets are powers of two, so compare in log2 and never trust less than half a bucket
+        median, score = robust_score(
+            math.log2(device["p99"]),
+            [math.log2(_) for _ in siblings],
+            mad_floor=0.5,
+        )
+        device["sibling_median_p99"] = round(2**median)
+        device["p99_delta"] = device["p99"] - device["sibling_median_p99"]
+        device["score"] = round(score, 2)
+        device["outlier"] = score >= threshold
+        ranked.append(device)
+
+    ranked.sort(key=lambda _: _["score"], reverse=True)
+    for device in ranked:
+        output(
+            device,
+            reason=None,
+            dict_output=dict_output,
+            tty=tty,
+        )
+
+
+@cli.command()
+@click.argument("pools", required=False, nargs=-1)
+@click.option("--jobs", type=int, default=os.cpu_count(), show_default=True)
+@click.option("--no-mount", is_flag=True)
+@click.option(
+    "--simulate",
+    is_flag=True,
+)
+@click_add_options(click_global_options)
+@click.pass_context
+def unlock(
+    ctx,
+    *,
+    pools: tuple[str, ...],
+    jobs: int,
+    no_mount: bool,
+    simulate: bool,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
         verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
     )
 
-    for device in devices:
-        if not skip_checks:
-            assert path_is_block_special(device, follow_symlinks=True)
-            assert not block_special_path_is_mounted(
-                device,
+    list_args = ["-t", "filesystem,volume"]
+    if pools:
+        list_args += ["-r", *pools]
+    datasets = zfs_list(
+        [
+            "name",
+            "encryptionroot",
+            "keystatus",
+            "keylocation",
+            "mountpoint",
+            "canmount",
+            "mounted",
+        ],
+        *list_args,
+    )
+    roots = [
+        _
+        for _ in datasets
+        if _["encryptionroot"] == _["name"] and _["keystatus"] == "unavailable"
+    ]
+    eprint(f"{len(roots)} locked encryption roots")
+    if simulate:
+        for root in roots:
+            output(
+                {"encryptionroot": root["name"], "keylocation": root["keylocation"]},
+                reason=None,
+                dict_output=dict_output,
+                tty=tty,
             )
-        if not (
-            Path(device).name.startswith("nvme")
-            or Path(device).name.startswith("mmcblk")
-            or Path(device).name.startswith("wwn-")
-        ):
-            assert not device.name[-1].isdigit()
+        return
 
-    if not skip_checks:
-        first_device_size = get_block_device_size(
-            devices[0],
+    passphrase = None
+    if any(_["keylocation"] == "prompt" for _ in roots):
+        passphrase = passphrase_prompt(
+            "zfs",
         )
-        for device in devices:
-            assert (
-                get_block_device_size(
-                    device,
-                )
-                == first_device_size
-            )
 
-    assert raid_group_size >= 1
-    assert len(devices) >= raid_group_size
+    def _load_key(root: dict[str, str]) -> float:
+        start = time.monotonic()
+        if root["keylocation"] == "prompt":
+            sh.zfs("load-key", root["name"], _in=passphrase)
+        else:
+            sh.zfs("load-key", root["name"])
+        return time.monotonic() - start
 
-    device_string = ""
-    if len(devices) == 1:
-        assert raid == "disk"
-        device_string = devices[0].as_posix()
+    # one serial attempt first, so a mistyped passphrase costs one pbkdf2 run, not hundreds
+    prompted = [_ for _ in roots if _["keylocation"] == "prompt"]
+    if prompted:
+        roots.remove(prompted[0])
+        roots.insert(0, prompted[0])
 
-    if len(devices) > 1:
-        if raid in ["raidz3"]:
-            assert len(devices) % 2 == 0
-        assert raid in ["mirror", "raidz3"]
-        assert raid_group_size >= 2
+    unlocked = set()
+    failed = 0
+    results = []
+    if roots:
+        try:
+            results.append((roots[0], _load_key(roots[0]), None))
+        except sh.ErrorReturnCode as e:
+            results.append((roots[0], None, e))
+            if roots[0]["keylocation"] == "prompt":
+                eprint(f"{roots[0]['name']}: {e.stderr.decode().strip()}")
+                sys.exit(1)
+    results.extend(parallel_imap(_load_key, roots[1:], jobs=jobs))
+    for root, seconds, exception in results:
+        record: dict = {"encryptionroot": root["name"], "seconds": seconds}
+        if exception is not None:
+            failed += 1
+            record["error"] = str(exception).strip()
+            if isinstance(exception, sh.ErrorReturnCode):
+                record["error"] = exception.stderr.decode().strip()
+        else:
+            unlocked.add(root["name"])
+            record["seconds"] = round(seconds, 3)
+        output(
+            record,
+            reason=None,
+            dict_output=dict_output,
+            tty=tty,
+        )
 
-    if len(devices) == 2:
-        assert raid == "mirror"
-        device_string = "mirror " + devices[0].as_posix() + " " + devices[1].as_posix()
+    if not no_mount:
+        mountpoints = {
+            _["name"]: _["mountpoint"]
+            for _ in datasets
+            if _["encryptionroot"] in unlocked
+            and _["canmount"] == "on"
+            and _["mounted"] == "no"
+            and _["mountpoint"].startswith("/")
+        }
+        for dataset, _, exception in run_dependency_graph(
+            mount_dependencies(mountpoints),
+            lambda _: sh.zfs.mount(_),
+            jobs=jobs,
+        ):
+            if exception is not None:
+                failed += 1
+                eprint(f"{dataset}: {exception}")
+            elif verbose:
+                eprint(f"mounted {dataset} on {mountpoints[dataset]}")
 
-    if len(devices) > 2:
-        if raid_group_size == 2:  # striped mirror raid10
-            for pair in grouper(devices, 2):
-                device_string = (
-                    device_string + "mirror " + pair[0] + " " + pair[1] + " "
-                )
-                eprint("device_string:", device_string)
-        elif raid_group_size == 4:
-            for quad in grouper(devices, 4):
-                assert False  # a 4x mirror? or a 2x2 mirror?
-                device_string = (
-                    device_string
-                    + "mirror "
-                    + quad[0]
-                    + " "
-                    + quad[1]
-                    + " "
-                    + quad[2]
-                    + " "
-                    + quad[3]
-                    + " "
-                )
-                eprint("device_string:", device_string)
-        elif raid_group_size in [8, 16]:
-            assert raid in ["raidz3", "mirror"]
-            if raid == "raidz3":
-                device_string = "raidz3"
-            elif raid == "mirror":
-                device_string = "mirror"
+    if failed:
+        sys.exit(1)
 
-            for device in devices:
-                device_string += " " + device.as_posix()
-            eprint("device_string:", device_string)
+
+@cli.command()
+@click.argument("pools", required=False, nargs=-1)
+@click.option(
+    "--root",
+    type=click.Path(
+        exists=True,
+        dir_okay=True,
+        file_okay=False,
+        allow_dash=False,
+        path_type=Path,
+    ),
+    default=Path("/"),
+    show_default=True,
+    help="system root holding etc/zfs",
+)
+@click.option(
+    "--check",
+    is_flag=True,
+    help="only report drift, exit 1 if any file is stale",
+)
+@click_add_options(click_global_options)
+@click.pass_context
+def boot_cache(
+    ctx,
+    *,
+    pools: tuple[str, ...],
+    root: Path,
+    check: bool,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    pool_list = list(pools)
+    if not pool_list:
+        # cachefile=none keeps a pool out of the boot cache unless it is named
+        for line in sh.zpool.get("-H", "-o", "name,value", "cachefile").splitlines():
+            pool, cachefile = line.split("\t")
+            if cachefile != "none":
+                pool_list.append(pool)
+    assert pool_list
+
+    etc_zfs = Path(root) / Path("etc/zfs")
+    zpool_cache = etc_zfs / Path("zpool.cache")
+    files = {}
+    if not check:
+        files[zpool_cache] = generate_zpool_cache(pool_list, etc_zfs)
+    for pool, data in generate_zfs_list_cache(pool_list).items():
+        files[etc_zfs / Path("zfs-list.cache") / Path(pool)] = data
+
+    drift = False
+    if check:
+        # generating a zpool.cache means setting cachefile on live pools, compare what it describes instead
+        if not zpool_cache.exists():
+            state = "missing"
         else:
-            if raid == "mirror":
-                device_string = "mirror"
-                for device in devices:
-                    device_string += " " + device.as_posix()
-                eprint("device_string:", device_string)
-            else:
-                print("unknown mode")
-                sys.exit(1)
+            try:
+                current = zpool_cache_summary(zpool_cache) == zpool_live_summary(pool_list)
+            except (sh.ErrorReturnCode, ValueError, AssertionError) as e:  # unreadable or unparsable
+                eprint(f"{zpool_cache.as_posix()}: {e}")
+                current = False
+            state = "current" if current else "stale"
+        drift = state != "current"
+        output(
+            {"path": zpool_cache.as_posix(), "state": state},
+            reason=None,
+            dict_output=dict_output,
+            tty=tty,
+        )
+    for path, data in files.items():
+        if not path.exists():
+            state = "missing"
+        elif path.read_bytes() != data:
+            state = "stale"
+        else:
+            state = "current"
+        if state != "current":
+            drift = True
+            if not check:
+                write_file_atomic(path, data)
+                state += ", rewritten"
+        output(
+            {"path": path.as_posix(), "state": state},
+            reason=None,
+            dict_output=dict_output,
+            tty=tty,
+        )
 
-    assert device_string != ""
-    assert len(pool_name) > 2
+    if check and drift:
+        sys.exit(1)
 
-    if encrypt:
-        if not simulate:
-            passphrase = passphrase_prompt(
-                "zpool",
-            )
-            passphrase = passphrase.decode("utf8")
 
-    command = "zpool create"
-    command += " -o feature@async_destroy=enabled"  # default Destroy filesystems asynchronously.
-    command += " -o feature@blake3=enabled"
-    command += " -o feature@block_cloning=enabled"
-    command += " -o feature@bookmarks=enabled"  # default "zfs bookmark" command
-    command += " -o feature@bookmark_v2=enabled"  # default
-    command += " -o feature@device_rebuild=enabled"
-    command += " -o feature@embedded_data=enabled"  # default Blocks which compress very well use even less space.
-    command += " -o feature@empty_bpobj=enabled"  # default Snapshots use less space.
-    command += " -o feature@enabled_txg=enabled"  # default   # Record txg at which a feature is enabled
-    command += " -o feature@extensible_dataset=enabled"  # default   # Enhanced dataset functionality.
-    command += " -o feature@head_errlog=enabled"
-    command += " -o feature@spacemap_histogram=enabled"  # default   # Spacemaps maintain space histograms.
-    command += " -o feature@spacemap_v2=enabled"  # default
-    command += " -o feature@zpool_checkpoint=enabled"  # default
-    command += (
-        " -o feature@large_dnode=enabled"  # default  Variable on-disk size of dnodes.
+@cli.command()
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(
+        exists=False,
+        dir_okay=False,
+        file_okay=True,
+        allow_dash=False,
+        path_type=Path,
+    ),
+    default=ZFSTOOL_SOCKET,
+    show_default=True,
+)
+@click_add_options(click_global_options)
+@click.pass_context
+def serve(
+    ctx,
+    *,
+    socket_path: Path,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
     )
-    command += " -o feature@large_blocks=enabled"  # default  Support for blocks larger than 128KB.
-    command += " -o feature@zstd_compress=enabled"  # default (independent of the zfs compression flag)
-    if ashift:
-        command += f" -o ashift={ashift}"
-    command += " -o listsnapshots=on"
 
-    if encrypt:
-        command += " -o feature@encryption=enabled"
-        command += " -O encryption=aes-256-gcm"
-        command += " -O keyformat=passphrase"
-        command += " -O keylocation=prompt"
-        command += " -O pbkdf2iters=560000"
-        command += " -O checksum=blake3"
-    else:
-        command += " -O checksum=fletcher4"  # default
+    if socket_path.exists():
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as _socket:
+                _socket.connect(socket_path.as_posix())
+            eprint(f"{socket_path} is already being served")
+            sys.exit(1)
+        except ConnectionRefusedError:
+            socket_path.unlink()  # left over from a dead daemon
 
-    command += " -O atime=off"  # (dont write when reading)
-    command += " -O compression=zstd"  # (better than lzjb)
-    command += " -O copies=1"
-    command += " -O xattr=off"  # (sa is better than on)
-    command += " -O sharesmb=off"
-    command += " -O sharenfs=off"
-    command += " -O dedup=off"  # default
-    command += " -O utf8only=off"  # default
-    command += " -O mountpoint=none"  # dont mount raw zpools
-    command += " -O setuid=off"  # only needed on rootfs
-    command += " " + pool_name + " " + device_string
+    cache = ZFSCache()
+    # events are followed before the load, so nothing between the two is missed
+    threading.Thread(target=follow_zpool_events, args=(cache,), daemon=True).start()
+    start = time.monotonic()
+    cache.load()
+    eprint(
+        f"loaded {len(cache.pools)} pools, {len(cache.datasets)} datasets in {time.monotonic() - start:.1f}s"
+    )
 
-    ic(command)
-    if not simulate:
-        # stdin = None
-        # if encrypt:
-        #    stdin = passphrase
-        os.system(command)
+    with socketserver.ThreadingUnixStreamServer(
+        socket_path.as_posix(), ZFSCacheRequestHandler
+    ) as server:
+        server.daemon_threads = True
+        server.cache = cache
+        os.chmod(socket_path, 0o660)
+        signal(SIGTERM, lambda *_: sys.exit(0))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            # a cache nobody refreshes would answer every client wrong, exiting
+            # removes the socket and clients go back to zfs/zpool
+            cache.stale.wait()
+            eprint("stopped following zpool events, exiting")
+            sys.exit(1)
+        finally:
+            server.shutdown()
+            socket_path.unlink(missing_ok=True)
+
+
+@cli.command()
+@click.argument(
+    "devices",
+    required=True,
+    nargs=-1,
+    type=click.Path(
+        exists=True,
+        dir_okay=False,
+        file_okay=True,
+        allow_dash=False,
+        path_type=Path,
+    ),
+)
+@click.option("--seconds", type=float, default=10.0, show_default=True, help="per probe")
+@click.option(
+    "--per-controller",
+    type=int,
+    help="devices probed at once behind one controller, default all",
+)
+@click.option("--tolerance", type=float, default=0.25, show_default=True)
+@click_add_options(click_global_options)
+@click.pass_context
+def disk_bench(
+    ctx,
+    *,
+    devices: tuple[Path, ...],
+    seconds: float,
+    per_controller: None | int,
+    tolerance: float,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+    assert 0 < tolerance < 1
+    for device in devices:
+        assert path_is_block_special(device, follow_symlinks=True)
+        assert not block_special_path_is_mounted(
+            device,
+        )
+
+    results = benchmark_block_devices(
+        devices, seconds=seconds, per_controller=per_controller
+    )
+    outliers = block_device_outliers(results, tolerance=tolerance)
+    for result in results:
+        output(
+            result,
+            reason=None,
+            dict_output=dict_output,
+            tty=tty,
+        )
+    for outlier in outliers:
+        eprint(
+            f"{outlier['device']}: {outlier['metric']} is {outlier['ratio']:.2f}x the other devices"
+        )
+    if outliers:
+        sys.exit(1)
 
 
 @cli.command()
-@click.argument("pool", required=True, nargs=1)
-@click.argument("name", required=True, nargs=1)
+@click.argument("datasets", required=True, nargs=-1)
 @click.option(
-    "--simulate",
-    is_flag=True,
+    "--from",
+    "from_snapshot",
+    type=str,
+    help="incremental base snapshot name, datasets without it get a full send",
 )
+@click.option("--to", "to_snapshot", type=str, help="default: the newest snapshot")
+@click.option("--intermediate", is_flag=True, help="-I instead of -i")
+@click.option("--raw", is_flag=True)
+@click.option("--compressed", is_flag=True)
+@click.option("--bandwidth", type=str, help="bytes/s, 100M style sizes are fine")
+@click.option("--jobs", type=int, default=8, show_default=True)
+@click.option("--json", "json_output", is_flag=True)
 @click_add_options(click_global_options)
 @click.pass_context
-def zfs_filesystem_destroy(
+def send_plan(
     ctx,
-    pool: str,
-    name: str,
-    simulate: bool,
+    *,
+    datasets: tuple[str, ...],
+    from_snapshot: None | str,
+    to_snapshot: None | str,
+    intermediate: bool,
+    raw: bool,
+    compressed: bool,
+    bandwidth: None | str,
+    jobs: int,
+    json_output: bool,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
@@ -545,57 +3793,116 @@ def zfs_filesystem_destroy(
         ic=ic,
         gvd=gvd,
     )
+    bandwidth_bytes = parse_size(bandwidth)
+    if bandwidth is not None:
+        assert bandwidth_bytes
 
-    assert "/" not in pool
-    assert not name.startswith("/")
-    assert len(pool.split()) == 1
-    assert len(name.split()) == 1
-    assert len(name) > 2
-    # todo check if mounted, need to get mountpoint= from zfs
-    sh.zfs.destroy(Path(pool) / Path(name), _fg=True)
+    entries = zfs_list(
+        ["name", "type", "createtxg"],
+        "-r",
+        "-t",
+        "filesystem,volume,snapshot",
+        *datasets,
+    )
+    plan = plan_sends(entries, from_snapshot=from_snapshot, to_snapshot=to_snapshot)
 
+    def _estimate(pair: tuple[str, None | str, str, None | str]) -> int:
+        dataset, from_name, to_name, error = pair
+        if error is not None:
+            raise ValueError(error)
+        args = ["-n", "-v", "-P"]
+        if raw:
+            args.append("-w")
+        if compressed:
+            args.append("-c")
+        if from_name is not None:
+            args += ["-I" if intermediate else "-i", "@" + from_name]
+        args.append(dataset + "@" + to_name)
+        return parse_zfs_send_estimate(str(sh.zfs.send(*args, _err_to_out=True)))
 
-@cli.command()
-@click.argument("pool", required=True, nargs=1)
-@click.argument("name", required=True, nargs=1)
-@click.option(
-    "--simulate",
-    is_flag=True,
-)
-@click.option(
-    "--encrypt",
-    is_flag=True,
-)
-@click.option(
-    "--nfs-subnet",
-    type=str,
-)
-@click.option(
-    "--exec",
-    "exe",
-    is_flag=True,
-)
-@click.option(
-    "--nomount",
-    is_flag=True,
-)
-@click.option(
-    "--reservation",
-    type=str,
+    records = []
+    total = 0
+    failed = 0
+    for (dataset, from_name, to_name, _), size, exception in parallel_imap(
+        _estimate, plan, jobs=jobs
+    ):
+        record: dict = {
+            "dataset": dataset,
+            "from": from_name,
+            "to": to_name,
+            "full": from_name is None,
+            "bytes": size,
+        }
+        if exception is not None:
+            failed += 1
+            record["error"] = str(exception).strip()
+        else:
+            total += size
+            if bandwidth_bytes:
+                record["seconds"] = round(size / bandwidth_bytes, 1)
+        records.append(record)
+    records.sort(key=lambda _: _["dataset"])
+
+    summary: dict = {"datasets": len(records), "failed": failed, "bytes": total}
+    if bandwidth_bytes:
+        summary["bandwidth"] = bandwidth_bytes
+        summary["seconds"] = round(total / bandwidth_bytes, 1)
+
+    if json_output:
+        print(json.dumps({"sends": records, "total": summary}))
+    else:
+        for record in records:
+            output(
+                record,
+                reason=None,
+                dict_output=dict_output,
+                tty=tty,
+            )
+        output(
+            summary,
+            reason=None,
+            dict_output=dict_output,
+            tty=tty,
+        )
+    if failed:
+        sys.exit(1)
+
+
+STORE_OPTION = click.option(
+    "--store",
+    required=True,
+    type=click.Path(
+        exists=False,
+        dir_okay=True,
+        file_okay=False,
+        allow_dash=False,
+        path_type=Path,
+    ),
 )
+
+
+@cli.group(no_args_is_help=True, cls=AHGroup)
+def archive():
+    pass
+
+
+@archive.command("send")
+@click.argument("snapshot", required=True, nargs=1)
+@STORE_OPTION
+@click.option("--from", "from_snapshot", type=str, help="incremental base snapshot")
+@click.option("--raw", is_flag=True)
+@click.option("--jobs", type=int, default=os.cpu_count(), show_default=True)
 @click_add_options(click_global_options)
 @click.pass_context
-def create_zfs_filesystem(
+def archive_send(
     ctx,
-    pool: str,
-    name: str,
-    simulate: bool,
-    encrypt: bool,
-    nfs_subnet: str,
-    exe: bool,
-    nomount: bool,
+    *,
+    snapshot: str,
+    store: Path,
+    from_snapshot: None | str,
+    raw: bool,
+    jobs: int,
     verbose_inf: bool,
-    reservation: str,
     dict_output: bool,
     verbose: bool = False,
 ) -> None:
@@ -606,65 +3913,164 @@ def create_zfs_filesystem(
         ic=ic,
         gvd=gvd,
     )
-    ic()
+    assert "@" in snapshot
+    assert not snapshot.startswith("/")
 
-    assert "/" not in pool
-    assert not name.startswith("/")
-    assert len(pool.split()) == 1
-    assert len(name.split()) == 1
-    assert len(name) > 2
+    store.mkdir(parents=True, exist_ok=True)
+    chunk_store = ChunkStore(store, create=True)
 
-    # https://raw.githubusercontent.com/ryao/zfs-overlay/master/zfs-install
-    # run_command("modprobe zfs || exit 1")
+    command = ["zfs", "send"]
+    if raw:
+        command.append("-w")
+    if from_snapshot:
+        command += ["-i", from_snapshot]
+    command.append(snapshot)
+    ic(command)
 
-    command = "zfs create -o setuid=off -o devices=off"
-    if encrypt:
-        command += " -o encryption=aes-256-gcm"
-        command += " -o keyformat=passphrase"
-        command += " -o keylocation=prompt"
+    stream_bytes = 0
+    unique_bytes = 0
+    stored_bytes = 0
 
-    if exe:
-        command += " -o exec=on"
-    else:
-        command += " -o exec=off"
+    def _counted(chunks: Iterable[bytes]) -> Iterator[bytes]:
+        nonlocal stream_bytes
+        for chunk in chunks:
+            stream_bytes += len(chunk)
+            yield chunk
 
-    if reservation:
-        command += " -o reservation=" + reservation
+    def _put(chunk: bytes) -> tuple[str, int, int]:
+        digest, written = chunk_store.put(chunk)
+        return digest, len(chunk) if written else 0, written
 
-    if not nomount:
-        command += " -o mountpoint=/" + pool + "/" + name
+    start = time.monotonic()
+    digests = []
+    with subprocess.Popen(command, stdout=subprocess.PIPE) as process:
+        blocks = iter(lambda: process.stdout.read(1 << 23), b"")
+        for digest, unique, written in ordered_prefetch(
+            _put, _counted(chunk_store.chunker().chunks(blocks)), jobs=jobs
+        ):
+            digests.append(digest)
+            unique_bytes += unique
+            stored_bytes += written
+    if process.returncode != 0:
+        eprint(f"{' '.join(command)} exited {process.returncode}, no manifest written")
+        sys.exit(1)
+    elapsed = time.monotonic() - start
 
-    command += " " + pool + "/" + name
+    os.sync()  # chunks are on disk before a manifest refers to them
+    manifest_path = chunk_store.manifest_path(snapshot, from_snapshot)
+    write_file_atomic(
+        manifest_path,
+        json.dumps(
+            {
+                "snapshot": snapshot,
+                "from": from_snapshot,
+                "raw": raw,
+                "size": stream_bytes,
+                "created": int(time.time()),
+                "chunks": digests,
+            }
+        ).encode(),
+    )
 
-    if verbose or simulate:
-        ic(command)
+    output(
+        {
+            "manifest": manifest_path.as_posix(),
+            "stream_bytes": stream_bytes,
+            "chunks": len(digests),
+            "new_chunks_bytes": unique_bytes,
+            "stored_bytes": stored_bytes,
+            "dedup_ratio": round(stream_bytes / unique_bytes, 2) if unique_bytes else None,
+            "mb_per_second": round(stream_bytes / elapsed / 1e6, 1),
+        },
+        reason=None,
+        dict_output=dict_output,
+        tty=tty,
+    )
 
-    if not simulate:
-        run_command(command, verbose=True, expected_exit_status=0)
 
-    if nfs_subnet:
-        ctx.invoke(
-            zfs_set_sharenfs,
-            pool=pool,
-            name=name,
-            subnet=nfs_subnet,
-            simulate=simulate,
-        )
+@archive.command("restore")
+@click.argument(
+    "manifest",
+    required=True,
+    nargs=1,
+    type=click.Path(
+        exists=True,
+        dir_okay=False,
+        file_okay=True,
+        allow_dash=False,
+        path_type=Path,
+    ),
+)
+@click.argument("target", required=True, nargs=1)
+@STORE_OPTION
+@click.option("--force", is_flag=True, help="zfs recv -F")
+@click.option("--jobs", type=int, default=os.cpu_count(), show_default=True)
+@click_add_options(click_global_options)
+@click.pass_context
+def archive_restore(
+    ctx,
+    *,
+    manifest: Path,
+    target: str,
+    store: Path,
+    force: bool,
+    jobs: int,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+    chunk_store = ChunkStore(store)
+    stream = json.loads(manifest.read_text())
+
+    command = ["zfs", "recv"]
+    if force:
+        command.append("-F")
+    command.append(target)
+    ic(command)
 
+    start = time.monotonic()
+    # with SIGPIPE at SIG_DFL a recv that exits early would kill us before its status is reported
+    previous_sigpipe = signal(SIGPIPE, SIG_IGN)
+    try:
+        with subprocess.Popen(command, stdin=subprocess.PIPE) as process:
+            try:
+                for data in ordered_prefetch(chunk_store.get, stream["chunks"], jobs=jobs):
+                    process.stdin.write(data)
+            except BrokenPipeError:
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+    finally:
+        signal(SIGPIPE, previous_sigpipe)
+    if process.returncode != 0:
+        eprint(f"{' '.join(command)} exited {process.returncode}")
+        sys.exit(1)
+    elapsed = time.monotonic() - start
+    eprint(
+        f"restored {stream['snapshot']} to {target}, {stream['size'] / elapsed / 1e6:.1f}MB/s"
+    )
 
-@cli.command()
-@click.argument("path", required=True, nargs=1)
-@click.option(
-    "--simulate",
-    is_flag=True,
-)
+
+@archive.command("verify")
+@STORE_OPTION
+@click.option("--jobs", type=int, default=os.cpu_count(), show_default=True)
 @click_add_options(click_global_options)
 @click.pass_context
-def create_zfs_filesystem_snapshot(
+def archive_verify(
     ctx,
     *,
-    path: str,
-    simulate: bool,
+    store: Path,
+    jobs: int,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
@@ -676,53 +4082,97 @@ def create_zfs_filesystem_snapshot(
         ic=ic,
         gvd=gvd,
     )
+    chunk_store = ChunkStore(store)
 
-    assert not path.startswith("/")
-    assert len(path.split()) == 1
-    assert len(path) > 3
+    def _check(digest: str) -> int:
+        chunk_store.get(digest)
+        return chunk_store.chunk_path(digest).stat().st_size
 
-    timestamp = str(int(float(get_timestamp())))
-    snapshot_path = path + f"@__{timestamp}"
-    command = sh.zfs.snapshot.bake(snapshot_path)
+    chunks = set()
+    corrupt = 0
+    stored_bytes = 0
+    for digest, size, exception in parallel_imap(
+        _check, chunk_store.chunk_digests(), jobs=jobs
+    ):
+        chunks.add(digest)
+        if exception is not None:
+            corrupt += 1
+            eprint(f"{digest}: {exception}")
+            continue
+        stored_bytes += size
 
-    if verbose or simulate:
-        ic(command)
+    missing = 0
+    stream_bytes = 0
+    manifests = 0
+    for path, stream in chunk_store.manifests():
+        manifests += 1
+        stream_bytes += stream["size"]
+        absent = [_ for _ in stream["chunks"] if _ not in chunks]
+        if absent:
+            missing += len(absent)
+            eprint(f"{path}: {len(absent)} missing chunks")
 
-    if not simulate:
-        command()
+    output(
+        {
+            "manifests": manifests,
+            "chunks": len(chunks),
+            "corrupt_chunks": corrupt,
+            "missing_chunks": missing,
+            "stream_bytes": stream_bytes,
+            "stored_bytes": stored_bytes,
+            "ratio": round(stream_bytes / stored_bytes, 2) if stored_bytes else None,
+        },
+        reason=None,
+        dict_output=dict_output,
+        tty=tty,
+    )
+    if corrupt or missing:
+        sys.exit(1)
 
 
 @cli.command()
 @click.argument("pool", required=True, nargs=1)
-@click.argument("name", required=True, nargs=1)
-@click.argument("subnet", required=True, nargs=1)
+@click.argument(
+    "plan",
+    required=False,
+    nargs=1,
+    type=click.File("r"),
+)
 @click.option(
-    "--no-root-write",
-    is_flag=True,
+    "--set",
+    "assignments",
+    multiple=True,
+    help="DATASET:PROPERTY=VALUE, in addition to the PLAN file",
 )
+@click.option("--fill-threshold", type=float, default=0.8, show_default=True)
 @click.option(
-    "--off",
-    is_flag=True,
+    "--fragmentation-margin",
+    type=float,
+    default=0.1,
+    show_default=True,
+    help="taken off --fill-threshold when the pool is 50%+ fragmented",
 )
+@click.option("--jobs", type=int, default=8, show_default=True)
 @click.option(
     "--simulate",
     is_flag=True,
 )
 @click_add_options(click_global_options)
 @click.pass_context
-def zfs_set_sharenfs(
+def capacity_plan(
     ctx,
     *,
     pool: str,
-    name: str,
-    subnet: str,
-    off: bool,
-    no_root_write: bool,
+    plan,
+    assignments: tuple[str, ...],
+    fill_threshold: float,
+    fragmentation_margin: float,
+    jobs: int,
     simulate: bool,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
-):
+) -> None:
     tty, verbose = tvicgvd(
         ctx=ctx,
         verbose=verbose,
@@ -730,70 +4180,76 @@ def zfs_set_sharenfs(
         ic=ic,
         gvd=gvd,
     )
-    maxone([off, no_root_write])
-
-    filesystem = pool + "/" + name
+    assert "/" not in pool
+    assert 0 < fill_threshold <= 1
 
-    assert not filesystem.startswith("/")
-    assert len(filesystem.split()) == 1
-    assert len(filesystem.split()) == 1
-    assert len(filesystem) > 2
+    lines = list(plan) if plan else []
+    lines += [_.replace(":", " ", 1) for _ in assignments]
+    try:
+        changes = parse_capacity_plan(lines)
+    except ValueError as e:
+        eprint(e)
+        sys.exit(1)
+    assert changes
+    for dataset in changes:
+        assert dataset == pool or dataset.startswith(pool + "/"), dataset
 
-    if verbose:
-        eprint(sh.zfs.get("sharenfs", filesystem))
+    pool_state, datasets = zfs_capacity_state(pool)
+    missing = [_ for _ in changes if _ not in datasets]
+    if missing:
+        eprint(f"not in {pool}: {missing}")
+        sys.exit(1)
 
-    if off:
-        disable_nfs_command = sh.zfs.set.bake("sharenfs=off", filesystem)
-        if simulate:
-            print(disable_nfs_command)
-        else:
-            disable_nfs_command()
+    projection = capacity_projection(pool, datasets, changes)
+    limit = capacity_fill_limit(
+        pool_state["fragmentation"],
+        fill_threshold=fill_threshold,
+        fragmentation_margin=fragmentation_margin,
+    )
+    projection["fragmentation"] = pool_state["fragmentation"]
+    projection["fill_limit"] = limit
+    projection["accepted"] = not capacity_plan_refused(projection, limit)
+    output(
+        projection,
+        reason=None,
+        dict_output=dict_output,
+        tty=tty,
+    )
+    if projection["quota_worst_case_fill"] > 1:
+        eprint("quotas are overcommitted, filling them all would fill the pool")
+    if not projection["accepted"]:
+        eprint(
+            f"refusing, the plan takes {pool} to {projection['projected_fill']:.1%} committed, limit is {limit:.1%}"
+        )
+        sys.exit(1)
+    if simulate:
         return
 
-    sharenfs_list = [
-        "sync",
-        "wdelay",
-        "hide",
-        "crossmnt",
-        "secure",
-        "no_all_squash",
-        "no_subtree_check",
-        "secure_locks",
-        "mountpoint",
-        "anonuid=65534",
-        "anongid=65534",
-        "sec=sys",
-    ]
-    # these cause zfs set sharenfs= command to fail:
-    # ['acl', 'no_pnfs']
-
-    assert "/" in subnet
-    sharenfs_list.append("rw=" + subnet)
-
-    if no_root_write:
-        sharenfs_list.append("root_squash")
-    else:
-        sharenfs_list.append("no_root_squash")
+    # shrinking reservations first frees the space growing ones need
+    def _growth(dataset: str) -> int:
+        current = datasets[dataset]
+        return sum(
+            changes[dataset].get(_, current[_]) - current[_]
+            for _ in ["reservation", "refreservation"]
+        )
 
-    sharenfs_line = ",".join(sharenfs_list)
-    ic(sharenfs_line)
+    shrinking = [_ for _ in changes if _growth(_) <= 0]
+    growing = [_ for _ in changes if _growth(_) > 0]
 
-    # sharenfs_line = 'sharenfs=*(' + sharenfs_line + ')'
-    sharenfs_line = "sharenfs=" + sharenfs_line
-    ic(sharenfs_line)
+    def _apply(dataset: str) -> None:
+        values = [
+            f"{prop}={value if value else 'none'}"
+            for prop, value in sorted(changes[dataset].items())
+        ]
+        sh.zfs.set(*values, dataset)
 
-    zfs_command = sh.zfs.set.bake(sharenfs_line, filesystem)
-    if simulate:
-        output(
-            zfs_command,
-            reason=None,
-            dict_output=dict_output,
-            tty=tty,
-        )
-    else:
-        output(
-            zfs_command(),
-            reason=None,
-            dict_output=dict_output,
-            tty=tty,
-        )
+    failed = 0
+    for phase in [shrinking, growing]:
+        for dataset, _, exception in parallel_imap(_apply, phase, jobs=jobs):
+            if exception is not None:
+                failed += 1
+                eprint(f"{dataset}: {exception}")
+            elif verbose:
+                eprint(f"{dataset}: {changes[dataset]}")
+    if failed:
+        sys.exit(1)